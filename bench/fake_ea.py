@@ -0,0 +1,320 @@
+"""A local stand in for the EA flood monitoring API.
+
+Serves synthetic stations, stage scales and readings in the shape of the
+real API, at a configurable number of stations and with configurable
+latency and error rates, so ingestion can be tested offline and benchmarked
+reproducibly. Readings follow a slow sine wave per station, taken every
+`interval` seconds up to the current time.
+
+Run standalone and point riverscope at it with RIVERSCOPE_EA_API_ROOT:
+
+    $ python -m bench.fake_ea --port 8080 --stations 1800 --latency 0.05
+    $ export RIVERSCOPE_EA_API_ROOT=http://127.0.0.1:8080/flood-monitoring
+"""
+import argparse
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import math
+import random
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+
+PREFIX = '/flood-monitoring'
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+DEFAULT_LIMIT = 500
+MAX_LIMIT = 10000
+
+# A real station, so tests written against the live API still hold
+KNOWN_STATIONS = [
+    {'notation': 'E8360', 'label': 'Uckfield Mill upstream', 'town': 'Uckfield',
+     'riverName': 'River Uck', 'RLOIid': '6163', 'lat': 50.968, 'long': 0.09},
+]
+
+
+def format_epoch(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime(DATETIME_FORMAT)
+
+
+def parse_epoch(text):
+    """Return the epoch seconds of a datetime or date query value."""
+    for fmt in (DATETIME_FORMAT, '%Y-%m-%d'):
+        try:
+            return int(datetime.strptime(text, fmt).replace(tzinfo=timezone.utc).timestamp())
+        except ValueError:
+            pass
+    raise ValueError('Invalid date {!r}'.format(text))
+
+
+class FakeEA:
+    """Synthetic EA data and the API answering requests for it.
+
+    stations
+        Number of stations, including the known stations.
+    history_days
+        Days of readings held before now.
+    interval
+        Seconds between readings.
+    latency
+        Seconds each response is delayed.
+    error_rate
+        Fraction of requests answered 503 Service Unavailable.
+    clock
+        Function returning the current epoch seconds, readings being held
+        up to then. Pass a fixed time for reproducible responses.
+    """
+    def __init__(self, stations=1800, history_days=7, interval=900, latency=0.0,
+                 error_rate=0.0, seed=0, clock=time.time):
+        self.clock = clock
+        self.history_days = history_days
+        self.interval = interval
+        self.latency = latency
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.bytes_sent = 0
+
+        self.stations = [dict(station) for station in KNOWN_STATIONS[:stations]]
+        for i in range(len(self.stations), stations):
+            self.stations.append({
+                'notation': 'F{:05d}'.format(i),
+                'label': 'Synthetic station {}'.format(i),
+                'town': 'Town {}'.format(i % 200),
+                'riverName': 'River {}'.format(i % 300),
+                'RLOIid': str(10000 + i),
+                'lat': round(self._random.uniform(50.0, 55.5), 5),
+                'long': round(self._random.uniform(-5.5, 1.7), 5),
+            })
+        for station in self.stations:
+            station['measure'] = '{}-level-stage-i-15_min-mASD'.format(station['notation'])
+            low = round(self._random.uniform(0.1, 1.0), 3)
+            station['typical'] = (low, round(low + self._random.uniform(0.5, 3.0), 3))
+            station['wave'] = (self._random.uniform(0, 2 * math.pi),
+                               self._random.uniform(6, 48) * 3600)
+        self.by_ref = {station['notation']: station for station in self.stations}
+        self.by_measure = {station['measure']: station for station in self.stations}
+
+    def times(self):
+        """Return the epoch seconds of every reading held, oldest first."""
+        latest = int(self.clock()) // self.interval * self.interval
+        count = self.history_days * 86400 // self.interval
+        return list(range(latest - count * self.interval, latest + 1, self.interval))
+
+    def value(self, station, epoch):
+        low, high = station['typical']
+        phase, period = station['wave']
+        middle = (low + high) / 2
+        return round(middle + (high - low) * 0.6 * math.sin(phase + 2 * math.pi * epoch / period), 3)
+
+    def station_json(self, root, station):
+        ref = station['notation']
+        return {
+            '@id': '{}/id/stations/{}'.format(root, ref),
+            'notation': ref,
+            'stationReference': ref,
+            'label': station['label'],
+            'town': station['town'],
+            'riverName': station['riverName'],
+            'RLOIid': station['RLOIid'],
+            'lat': station['lat'],
+            'long': station['long'],
+            'stageScale': '{}/id/stations/{}/stageScale'.format(root, ref),
+            'measures': [{'@id': '{}/id/measures/{}'.format(root, station['measure']),
+                          'parameter': 'level', 'qualifier': 'Stage'}],
+        }
+
+    def reading_json(self, root, station, epoch):
+        measure = '{}/id/measures/{}'.format(root, station['measure'])
+        date = format_epoch(epoch)
+        return {'@id': '{}/data/readings/{}/{}'.format(root, station['measure'], date),
+                'dateTime': date, 'measure': measure, 'value': self.value(station, epoch)}
+
+    def select_times(self, query):
+        """Return the reading times matching the date filters of `query`."""
+        times = self.times()
+        if 'since' in query:
+            times = times[bisect_right(times, parse_epoch(query['since'])):]
+        if 'startdate' in query:
+            start = parse_epoch(query['startdate'])
+            end = parse_epoch(query.get('enddate', query['startdate'])) + 86400
+            times = times[bisect_left(times, start):bisect_left(times, end)]
+        if 'date' in query or 'today' in query:
+            start = parse_epoch(query['date']) if 'date' in query else times[-1] // 86400 * 86400
+            times = times[bisect_left(times, start):bisect_left(times, start + 86400)]
+        if 'latest' in query:
+            times = times[-1:]
+        return times
+
+    def page(self, items, query):
+        """Apply the _sorted, _offset and _limit arguments of `query`."""
+        limit = min(int(query.get('_limit', DEFAULT_LIMIT)), MAX_LIMIT)
+        offset = int(query.get('_offset', 0))
+        return items[offset:offset + limit]
+
+    def get_stations(self, root, query):
+        stations = self.stations
+        if 'stationReference' in query:
+            stations = [s for s in stations if s['notation'] == query['stationReference']]
+        if 'RLOIid' in query:
+            stations = [s for s in stations if s['RLOIid'] == query['RLOIid']]
+        if 'search' in query:
+            search = query['search'].lower()
+            stations = [s for s in stations if search in s['label'].lower()]
+        return {'items': [self.station_json(root, s) for s in self.page(stations, query)]}
+
+    def get_stage_scale(self, ref):
+        station = self.by_ref.get(ref)
+        if station is None:
+            return None
+        low, high = station['typical']
+        return {'items': {'typicalRangeLow': low, 'typicalRangeHigh': high}}
+
+    def get_measure_readings(self, root, measure, query):
+        station = self.by_measure.get(measure)
+        if station is None:
+            return None
+        times = self.select_times(query)
+        if '_sorted' in query:
+            times = times[::-1]
+        return {'items': [self.reading_json(root, station, epoch)
+                          for epoch in self.page(times, query)]}
+
+    def get_readings(self, root, query):
+        readings = [(epoch, i) for epoch in self.select_times(query)
+                    for i in range(len(self.stations))]
+        if '_sorted' in query:
+            readings.reverse()
+        return {'items': [self.reading_json(root, self.stations[i], epoch)
+                          for epoch, i in self.page(readings, query)]}
+
+    def route(self, root, path, query):
+        """Return the JSON payload of a request, or None if not found."""
+        parts = path.strip('/').split('/')
+        if parts == ['id', 'stations']:
+            return self.get_stations(root, query)
+        if len(parts) == 4 and parts[:2] == ['id', 'stations'] and parts[3] == 'stageScale':
+            return self.get_stage_scale(parts[2])
+        if len(parts) == 4 and parts[:2] == ['id', 'measures'] and parts[3] == 'readings':
+            return self.get_measure_readings(root, parts[2], query)
+        if parts == ['data', 'readings']:
+            return self.get_readings(root, query)
+        return None
+
+    def count(self, sent, error=False):
+        with self._lock:
+            self.requests += 1
+            self.bytes_sent += sent
+            if error:
+                self.errors += 1
+
+    def stats(self):
+        with self._lock:
+            return {'requests': self.requests, 'errors': self.errors,
+                    'bytes_sent': self.bytes_sent}
+
+
+class FakeEAHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        api = self.server.api
+        if api.latency:
+            time.sleep(api.latency)
+        if api.error_rate and random.random() < api.error_rate:
+            self.respond(503, b'{}', error=True, headers={'Retry-After': '0'})
+            return
+        url = urlsplit(self.path)
+        query = {key: values[0] for key, values in
+                 parse_qs(url.query, keep_blank_values=True).items()}
+        if not url.path.startswith(PREFIX):
+            self.respond(404, b'{}')
+            return
+        root = 'http://{}{}'.format(self.headers.get('Host', '127.0.0.1'), PREFIX)
+        try:
+            payload = api.route(root, url.path[len(PREFIX):], query)
+        except ValueError:
+            self.respond(400, b'{}')
+            return
+        if payload is None:
+            self.respond(404, b'{}')
+            return
+        self.respond(200, json.dumps(payload).encode('utf-8'))
+
+    def respond(self, status, body, error=False, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.api.count(len(body), error)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeEAServer(ThreadingHTTPServer):
+    """Serve FakeEA `api` on `address`, by default a free local port, from a
+    background thread. Use as a context manager or start and stop it."""
+    daemon_threads = True
+
+    def __init__(self, api, address=('127.0.0.1', 0)):
+        super().__init__(address, FakeEAHandler)
+        self.api = api
+        self._thread = None
+
+    @property
+    def url(self):
+        """The EA_API_ROOT of the server."""
+        host, port = self.server_address[:2]
+        return 'http://{}:{}{}'.format(host, port, PREFIX)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--stations', type=int, default=1800)
+    parser.add_argument('--history-days', type=int, default=7)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds each response is delayed')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Fraction of requests answered 503')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    api = FakeEA(args.stations, args.history_days, latency=args.latency,
+                 error_rate=args.error_rate, seed=args.seed)
+    server = FakeEAServer(api, (args.host, args.port))
+    print('Serving {} stations at {}'.format(args.stations, server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
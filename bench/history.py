@@ -0,0 +1,48 @@
+"""JSON history of benchmark runs, so each run is compared with the last."""
+from datetime import datetime, timezone
+import json
+import os
+import subprocess
+
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(BASE_DIR, 'bench', 'results')
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=BASE_DIR, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_history(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+
+def previous_result(history, params, scenario):
+    """Return the latest result of `scenario` run with the same `params`."""
+    for run in reversed(history):
+        if run['params'] == params:
+            for result in run['results']:
+                if result['scenario'] == scenario:
+                    return result
+    return None
+
+
+def append_run(path, history, params, results):
+    """Save `history` to `path` with a run of `results` appended."""
+    history.append({
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'revision': git_revision(),
+        'params': params,
+        'results': results,
+    })
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(history, f, indent=2)
@@ -0,0 +1,122 @@
+"""Benchmark the ingestion commands end to end against the fake EA API.
+
+Each scenario runs a management command in a fresh process against a
+bench.fake_ea server, recording wall time, requests served, rows in the
+target table and the peak RSS of the process. Results are appended to a
+JSON file of past runs and compared with the previous run of each
+scenario, so regressions show up.
+
+Uses the database configured in riverscope.settings, whose stations and
+readings are replaced, so point it at a scratch database:
+
+    $ python -m bench.ingest --stations 1800 --latency 0.05
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench.fake_ea import FakeEA, FakeEAServer
+from bench.history import BASE_DIR, RESULTS_DIR, append_run, load_history, previous_result
+
+
+# Name, manage.py arguments and the table whose rows are counted
+SCENARIOS = [
+    ('getstations', ['getstations'], 'stations_stations'),
+    ('getstations -r', ['getstations', '-r'], 'stations_stations'),
+    ('getreadings', ['getreadings'], 'stations_stationreadings'),
+    ('getreadings -b', ['getreadings', '-b'], 'stations_stationreadings'),
+    ('getreadings -i', ['getreadings', '-i'], 'stations_stationreadings'),
+]
+
+
+def count_rows(table):
+    from django.db import connection
+    with connection.cursor() as cursor:
+        cursor.execute('select count(*) from {}'.format(table))
+        return cursor.fetchone()[0]
+
+
+def run_command(args, env, log_dir):
+    """Run a management command, returning its wall time in seconds and
+    peak RSS in KiB."""
+    command = [sys.executable, os.path.join(BASE_DIR, 'manage.py')] + args + [
+        '--no-cache', '-l', log_dir]
+    start = time.perf_counter()
+    process = subprocess.Popen(command, env=env, cwd=BASE_DIR,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    stderr = process.stderr.read()
+    # Wait with wait4 for the resource usage of this process alone
+    _, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = status
+    elapsed = time.perf_counter() - start
+    if status:
+        raise RuntimeError('{} failed:\n{}'.format(' '.join(args), stderr.decode()))
+    return elapsed, rusage.ru_maxrss
+
+
+def run_scenario(name, args, table, api, env, log_dir):
+    before = api.stats()
+    elapsed, peak_rss = run_command(args, env, log_dir)
+    after = api.stats()
+    requests = after['requests'] - before['requests']
+    rows = count_rows(table)
+    return {
+        'scenario': name,
+        'seconds': round(elapsed, 3),
+        'requests': requests,
+        'errors': after['errors'] - before['errors'],
+        'bytes': after['bytes_sent'] - before['bytes_sent'],
+        'requests_per_second': round(requests / elapsed, 1),
+        'rows': rows,
+        'rows_per_second': round(rows / elapsed, 1),
+        'peak_rss_kib': peak_rss,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--stations', type=int, default=1800)
+    parser.add_argument('--history-days', type=int, default=7)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('-s', '--scenario', action='append',
+                        choices=[name for name, _, _ in SCENARIOS],
+                        help='Run only these scenarios')
+    parser.add_argument('-o', '--output', default=os.path.join(RESULTS_DIR, 'ingest.json'),
+                        help='JSON file of past runs to append results to')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'riverscope.settings')
+    import django
+    django.setup()
+
+    params = {'stations': args.stations, 'history_days': args.history_days,
+              'latency': args.latency, 'error_rate': args.error_rate}
+    scenarios = [s for s in SCENARIOS if not args.scenario or s[0] in args.scenario]
+    history = load_history(args.output)
+    api = FakeEA(args.stations, args.history_days, latency=args.latency,
+                 error_rate=args.error_rate)
+
+    results = []
+    with FakeEAServer(api) as server, tempfile.TemporaryDirectory() as log_dir:
+        env = dict(os.environ, RIVERSCOPE_EA_API_ROOT=server.url)
+        for name, command_args, table in scenarios:
+            result = run_scenario(name, command_args, table, api, env, log_dir)
+            results.append(result)
+            previous = previous_result(history, params, name)
+            change = ''
+            if previous:
+                change = ' ({:+.0%} vs previous)'.format(
+                    result['seconds'] / previous['seconds'] - 1)
+            print('{scenario:<16} {seconds:>8.2f}s{change} {requests_per_second:>8.1f} req/s '
+                  '{rows_per_second:>10.1f} rows/s {peak_rss_kib:>8} KiB'.format(
+                      change=change, **result))
+
+    append_run(args.output, history, params, results)
+
+
+if __name__ == '__main__':
+    main()
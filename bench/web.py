@@ -0,0 +1,251 @@
+"""Benchmark the index page and data endpoints over synthetic data.
+
+For each combination of station count and readings per station, a test
+database is seeded with synthetic stations and readings, the summaries and
+trends are refreshed as after an ingestion, and each endpoint is requested
+through the Django test client. Latency percentiles, response size and the
+time spent in each stage of the request are recorded. Results are appended
+to a JSON file of past runs and compared with the previous run, so
+regressions show up.
+
+Stage times are exclusive, so time in the SQL of a build that is called
+from the cache is counted as sql rather than cache, and `other` is what is
+left of the request, mostly URL resolution, middleware and the response.
+Endpoints marked cold have the cache invalidated before each request.
+
+Creates and destroys a test database alongside the one configured in
+riverscope.settings:
+
+    $ python -m bench.web --stations 1000 10000 --readings 10 1000 10000
+"""
+import argparse
+from collections import defaultdict
+import json
+import os
+import statistics
+import time
+
+from bench.history import RESULTS_DIR, append_run, load_history, previous_result
+
+
+# Name, path, request headers and whether the cache is invalidated first
+ENDPOINTS = [
+    ('index', '/', {}, False),
+    ('stations.geojson', '/api/stations.geojson', {}, True),
+    ('stations.geojson gzip', '/api/stations.geojson',
+     {'HTTP_ACCEPT_ENCODING': 'gzip'}, True),
+    ('stations.geojson warm', '/api/stations.geojson', {}, False),
+    ('within', '/api/stations/within?bbox=-2,51,0,52&zoom=10', {}, False),
+    ('within zoomed out', '/api/stations/within?bbox=-6,49,2,56&zoom=6', {}, False),
+    ('tile clustered', '/tiles/6/31/21.mvt', {}, True),
+    ('tile', '/tiles/10/511/340.mvt', {}, True),
+    ('readings', '/api/stations/B1/readings', {}, False),
+    ('readings 30 days', '/api/stations/B1/readings?start={start}&points=2000', {}, False),
+]
+
+PERCENTILES = (50, 90, 99)
+
+# Stations at random points in England, numbered B1, B2...
+SEED_STATIONS_SQL = '''
+select setseed(0);
+insert into stations_stations
+(station_ref, rloiid, url, town, river_name, label, stage_scale_url,
+ typical_low, typical_high, measure, point)
+select 'B' || g, g, 'bench/' || g, 'Town ' || g % 200, 'River ' || g % 300,
+'Bench station ' || g, 'bench/' || g || '/stageScale', 0.2, 1.8, 'bench/' || g || '/measure',
+st_setsrid(st_makepoint(-5.5 + random() * 7.2, 50.0 + random() * 5.5), 4326)
+from generate_series(1, %(stations)s) g;
+'''
+
+# Readings every 15 minutes up to the current hour, on a slow sine wave
+SEED_READINGS_SQL = '''
+insert into stations_stationreadings (station_id, datetime, measure)
+select s.id, date_trunc('hour', now()) - g * interval '15 minutes',
+round((1 + sin(s.id + g / 20.0))::numeric, 2)
+from stations_stations s, generate_series(0, %(readings)s - 1) g;
+'''
+
+
+class StageTimer:
+    """Accumulates the exclusive time spent in functions wrapped by stage.
+
+    Time in a wrapped function called from another is counted only
+    against the innermost stage.
+    """
+    def __init__(self):
+        self.totals = defaultdict(float)
+        self._children = []
+
+    def wrap(self, stage, func):
+        def timed(*args, **kwargs):
+            self._children.append(0.0)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                self.totals[stage] += elapsed - self._children.pop()
+                if self._children:
+                    self._children[-1] += elapsed
+        return timed
+
+    def reset(self):
+        self.totals.clear()
+
+
+class Patches:
+    """Replace attributes of objects, restoring them on exit."""
+    def __init__(self):
+        self._saved = []
+
+    def set(self, owner, name, value):
+        self._saved.append((owner, name, getattr(owner, name)))
+        setattr(owner, name, value)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        while self._saved:
+            owner, name, value = self._saved.pop()
+            setattr(owner, name, value)
+
+
+def instrument(timer, patches):
+    """Wrap the functions of each request stage with `timer`."""
+    from django.template.backends import django as django_backend
+    from stations import geocache, views
+    stages = [
+        (views, 'get_station_readings', 'sql'),
+        (views, 'get_station_series', 'sql'),
+        (views, 'build_station_tile', 'sql'),
+        (views, 'station_readings_to_geojson', 'geojson'),
+        (json, 'dumps', 'serialize'),
+        (geocache, 'cached', 'cache'),
+        (django_backend.Template, 'render', 'template'),
+    ]
+    for owner, name, stage in stages:
+        patches.set(owner, name, timer.wrap(stage, getattr(owner, name)))
+
+
+def seed(stations, readings):
+    """Replace the stations and readings of the database with synthetic ones
+    and refresh their summaries and trends."""
+    from django.db import connection, transaction
+    from stations import geocache
+    from stations.summary import refresh_station_summary
+    from stations.trends import update_trends
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('truncate stations_stations cascade;')
+        cursor.execute(SEED_STATIONS_SQL, {'stations': stations})
+        cursor.execute(SEED_READINGS_SQL, {'readings': readings})
+        refresh_station_summary()
+        update_trends()
+    with connection.cursor() as cursor:
+        cursor.execute('analyze stations_stations, stations_stationreadings, '
+                       'stations_stationsummary;')
+    geocache.bump_version()
+
+
+def percentile(ordered, p):
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def run_endpoint(client, timer, name, path, headers, cold, requests):
+    from stations import geocache
+    start = time.strftime('%Y-%m-%d', time.gmtime(time.time() - 30 * 86400))
+    path = path.format(start=start)
+    # Warm up connections, imports and the cache of warm endpoints
+    response = client.get(path, **headers)
+    if response.status_code != 200:
+        raise RuntimeError('{} returned {}'.format(path, response.status_code))
+
+    latencies = []
+    timer.reset()
+    for _ in range(requests):
+        if cold:
+            geocache.bump_version()
+        begin = time.perf_counter()
+        response = client.get(path, **headers)
+        latencies.append(time.perf_counter() - begin)
+    size = len(response.content)
+    total = sum(latencies)
+    stages = {stage: round(seconds / requests * 1000, 3)
+              for stage, seconds in sorted(timer.totals.items())}
+    stages['other'] = round((total - sum(timer.totals.values())) / requests * 1000, 3)
+    latencies.sort()
+    result = {
+        'scenario': name,
+        'mean_ms': round(statistics.mean(latencies) * 1000, 3),
+        'max_ms': round(latencies[-1] * 1000, 3),
+        'bytes': size,
+        'stages_ms': stages,
+    }
+    for p in PERCENTILES:
+        result['p{}_ms'.format(p)] = round(percentile(latencies, p) * 1000, 3)
+    return result
+
+
+def print_result(result, previous):
+    change = ''
+    if previous:
+        change = ' ({:+.0%} vs previous)'.format(result['p50_ms'] / previous['p50_ms'] - 1)
+    print('  {scenario:<22} p50 {p50_ms:>9.2f} p90 {p90_ms:>9.2f} p99 {p99_ms:>9.2f} ms '
+          '{bytes:>10} B{change}'.format(change=change, **result))
+    print('  {:<22} {}'.format('', ' '.join('{} {:.2f}'.format(stage, ms) for stage, ms
+                                            in result['stages_ms'].items())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--stations', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--readings', type=int, nargs='+', default=[10, 1000, 10000],
+                        help='Readings per station')
+    parser.add_argument('-n', '--requests', type=int, default=20,
+                        help='Requests per endpoint')
+    parser.add_argument('-e', '--endpoint', action='append',
+                        choices=[name for name, _, _, _ in ENDPOINTS],
+                        help='Request only these endpoints')
+    parser.add_argument('--keepdb', action='store_true',
+                        help='Keep the test database after the run')
+    parser.add_argument('-o', '--output', default=os.path.join(RESULTS_DIR, 'web.json'),
+                        help='JSON file of past runs to append results to')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'riverscope.settings')
+    import django
+    django.setup()
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import setup_test_environment
+    setup_test_environment()
+
+    endpoints = [e for e in ENDPOINTS if not args.endpoint or e[0] in args.endpoint]
+    history = load_history(args.output)
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=args.keepdb)
+    timer = StageTimer()
+    client = Client()
+    try:
+        for stations in args.stations:
+            for readings in args.readings:
+                params = {'stations': stations, 'readings': readings,
+                          'requests': args.requests}
+                print('{} stations, {} readings each'.format(stations, readings))
+                seed(stations, readings)
+                results = []
+                with Patches() as patches:
+                    instrument(timer, patches)
+                    for name, path, headers, cold in endpoints:
+                        result = run_endpoint(client, timer, name, path, headers, cold,
+                                              args.requests)
+                        results.append(result)
+                        print_result(result, previous_result(history, params, name))
+                append_run(args.output, history, params, results)
+    finally:
+        if not args.keepdb:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
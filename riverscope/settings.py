@@ -42,6 +42,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so that it times the other middleware
+    'stations.middleware.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -86,6 +88,21 @@ DATABASES = {
     }
 }
 
+# Redis holds the rendered station data, see stations.geocache
+REDIS_URL = os.environ.get('RIVERSCOPE_REDIS_URL', 'redis://localhost:6379/0')
+
+# Alert notifications, see stations.alerts
+ALERT_SENDER = 'stations.alerts.ConsoleSender'
+ALERT_SENDER_OPTIONS = {}
+
+# Request profiling, see stations.middleware. The slowest requests are shown
+# at /admin/profiling and a sample can be dumped with cProfile to PROFILING_DIR
+PROFILING = os.environ.get('RIVERSCOPE_PROFILING') == '1'
+PROFILING_SLOWEST = 50
+PROFILING_SLOW_QUERY = 0.5
+PROFILING_SAMPLE_RATE = 0
+PROFILING_DIR = os.path.join(os.path.expanduser('~'), 'riverscope', 'profiles')
+
 
 # Password validation
 # https://docs.djangoproject.com/en/1.11/ref/settings/#auth-password-validators
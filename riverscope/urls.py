@@ -20,6 +20,11 @@ from django.views.generic import TemplateView
 import stations.views
 
 urlpatterns = [
+    url(r'^admin/profiling$', stations.views.profiling, name='profiling'),
     url(r'^admin/', admin.site.urls),
-    url(r'^$', stations.views.index, name='home')
+    url(r'^$', stations.views.index, name='home'),
+    url(r'^api/stations\.geojson$', stations.views.stations_geojson, name='stations_geojson'),
+    url(r'^api/stations/within$', stations.views.stations_within, name='stations_within'),
+    url(r'^api/stations/(?P<station_ref>[^/]+)/readings$', stations.views.station_readings, name='station_readings'),
+    url(r'^tiles/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)\.mvt$', stations.views.station_tile, name='station_tile'),
 ]
@@ -0,0 +1,193 @@
+"""Evaluation of user alerts against newly ingested readings.
+
+Active alerts are loaded only for the stations that received new readings
+and indexed per station by their lower threshold, so each reading is
+compared with the alerts it could trigger rather than every alert of every
+user. Alerts are edge triggered: an alert fires when a reading enters its
+range and is rearmed once a reading leaves it, its state being stored on
+the alert between runs once its notifications have been sent.
+"""
+from bisect import bisect_right
+from collections import namedtuple
+import json
+import logging
+import sys
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils.module_loading import import_string
+
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_SENDER = 'stations.alerts.ConsoleSender'
+
+AlertRule = namedtuple('AlertRule', 'id station_id reading_min reading_max triggered '
+                       'user_id email station_ref label condition')
+
+Notification = namedtuple('Notification', 'alert_id user_id email station_ref label '
+                          'condition datetime measure reading_min reading_max')
+
+ACTIVE_ALERTS_SQL = '''
+select a.id, a.station_id, a.reading_min, a.reading_max, a.triggered,
+u.id, u.email, s.station_ref, s.label, c.reading_condition_type
+from stations_alert a
+join auth_user u on u.id = a.user_id_id
+join stations_stations s on s.id = a.station_id
+join stations_readingconditiontypes c on c.id = a.reading_condition_type_id_id
+where a.active and a.station_id = any(%s);
+'''
+
+SET_TRIGGERED_SQL = 'update stations_alert set triggered = %s where id = any(%s);'
+
+
+class StationAlerts:
+    """The alerts of one station, sorted by lower threshold so the alerts
+    whose range may hold a reading are found by bisection."""
+    def __init__(self, rules):
+        self.rules = sorted(rules, key=_lower)
+        self.lows = [_lower(rule) for rule in self.rules]
+
+    def matching(self, measure):
+        """Return the ids of alerts whose range holds `measure`.
+
+        Bisection leaves the alerts with a lower threshold at or below
+        `measure`, whose upper thresholds are then checked in turn. A
+        station has a handful of alerts, for which an interval tree would
+        cost more to build each run than this scan saves.
+        """
+        end = bisect_right(self.lows, measure)
+        return {rule.id for rule in self.rules[:end]
+                if rule.reading_max is None or measure <= rule.reading_max}
+
+
+def _lower(rule):
+    return float('-inf') if rule.reading_min is None else rule.reading_min
+
+
+def evaluate(rules, readings):
+    """Evaluate alerts against new readings.
+
+    rules
+        AlertRules of the stations in `readings`.
+    readings
+        A dict of station id to a list of its new (datetime, measure).
+
+    Returns a list of Notifications of alerts entering their range and a
+    dict of alert id to its new triggered state, holding only alerts whose
+    state changed.
+    """
+    by_station = {}
+    for rule in rules:
+        by_station.setdefault(rule.station_id, []).append(rule)
+
+    notifications = []
+    changed = {}
+    for station_id, station_rules in by_station.items():
+        index = StationAlerts(station_rules)
+        rules_by_id = {rule.id: rule for rule in station_rules}
+        triggered = {rule.id for rule in station_rules if rule.triggered}
+        for date, measure in sorted(readings.get(station_id, ())):
+            matched = index.matching(measure)
+            for alert_id in matched - triggered:
+                rule = rules_by_id[alert_id]
+                notifications.append(Notification(
+                    rule.id, rule.user_id, rule.email, rule.station_ref, rule.label,
+                    rule.condition, date, measure, rule.reading_min, rule.reading_max))
+            triggered = matched
+        for rule in station_rules:
+            if (rule.id in triggered) != rule.triggered:
+                changed[rule.id] = rule.id in triggered
+    return notifications, changed
+
+
+def load_rules(station_ids):
+    """Return the AlertRules of the active alerts of `station_ids`."""
+    with connection.cursor() as cursor:
+        cursor.execute(ACTIVE_ALERTS_SQL, [list(station_ids)])
+        return [AlertRule(*row) for row in cursor.fetchall()]
+
+
+def store_triggered(changed):
+    """Save the triggered state of alerts, a dict of alert id to state."""
+    with connection.cursor() as cursor:
+        for state in (True, False):
+            ids = [alert_id for alert_id, value in changed.items() if value is state]
+            if ids:
+                cursor.execute(SET_TRIGGERED_SQL, [state, ids])
+
+
+class ConsoleSender:
+    """Write notifications to a stream, stdout by default."""
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+
+    def send(self, notifications):
+        for n in notifications:
+            self.stream.write('Alert {} for {}: {} ({}) is {} at {:%Y-%m-%d %H:%M} UTC\n'.format(
+                n.alert_id, n.email, n.label or n.station_ref, n.condition,
+                n.measure, n.datetime))
+        self.stream.flush()
+
+
+class FileSender:
+    """Append notifications to file `path` as JSON lines."""
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, notifications):
+        with open(self.path, 'a') as f:
+            for n in notifications:
+                item = n._asdict()
+                item['datetime'] = n.datetime.isoformat()
+                f.write(json.dumps(item) + '\n')
+
+
+def get_sender():
+    """Return the sender named by the ALERT_SENDER setting, created with the
+    keyword arguments of ALERT_SENDER_OPTIONS."""
+    sender_class = import_string(getattr(settings, 'ALERT_SENDER', DEFAULT_SENDER))
+    return sender_class(**getattr(settings, 'ALERT_SENDER_OPTIONS', {}))
+
+
+class NotificationQueue:
+    """Notifications held until they are sent, kept if sending fails."""
+    def __init__(self, sender=None):
+        self.sender = sender
+        self.pending = []
+
+    def put(self, notifications):
+        self.pending.extend(notifications)
+
+    def flush(self):
+        if not self.pending:
+            return 0
+        if self.sender is None:
+            self.sender = get_sender()
+        count = len(self.pending)
+        self.sender.send(self.pending)
+        self.pending = []
+        return count
+
+
+def run_alerts(readings, queue=None):
+    """Evaluate the alerts of the stations in `readings`, a dict of station
+    id to a list of its new (datetime, measure), and send notifications of
+    those that fired. Returns the number of notifications sent.
+
+    The triggered state of the alerts is only saved once their notifications
+    have been sent, so if sending fails the alerts still in range fire again
+    on the next run rather than their notifications being lost.
+    """
+    if not readings:
+        return 0
+    queue = queue or NotificationQueue()
+    rules = load_rules(readings.keys())
+    notifications, changed = evaluate(rules, readings)
+    LOG.debug('Evaluated {} alerts of {} stations, {} fired'.format(
+        len(rules), len(readings), len(notifications)))
+    queue.put(notifications)
+    count = queue.flush()
+    with transaction.atomic():
+        store_triggered(changed)
+    return count
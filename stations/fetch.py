@@ -0,0 +1,361 @@
+"""Pluggable HTTP fetch engines used to query the EA flood monitoring API.
+
+Engines share one pool of connections between all the requests they make,
+bound the number of requests in flight and retry throttled or failed
+requests with a jittered exponential backoff. Each request, including
+retries, is recorded in stations.metrics.
+"""
+import abc
+import asyncio
+import functools
+import json
+import random
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from stations import metrics
+from stations.httpcache import conditional_headers
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+# Responses with these statuses are retried
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Bytes read at a time from streamed responses
+CHUNK_SIZE = 64 * 1024
+
+# Longest Retry-After in seconds honoured beyond the backoff of a retry
+MAX_RETRY_AFTER = 60
+
+
+class FetchError(Exception):
+    pass
+
+
+class Engine(abc.ABC):
+    """Base class for fetch engines.
+
+    concurrency
+        The maximum number of requests in flight at once.
+    timeout
+        Seconds allowed for each request before it is abandoned.
+    retries
+        Number of times a request is retried after a connection error,
+        timeout or a response with one of `RETRY_STATUSES`.
+    backoff
+        Base delay in seconds before the first retry, doubled for each
+        following retry and jittered to avoid retrying in lockstep.
+    cache
+        A `stations.httpcache.ResponseCache` used to make conditional
+        requests, or None to always fetch responses in full. Requests made
+        with cache=False, such as for readings that are only asked for once,
+        bypass it.
+    limiter
+        A `RateLimiter` each request, including retries, waits on before it
+        is made, or None to make requests as soon as they can be.
+    """
+    def __init__(self, concurrency=20, timeout=30, retries=3, backoff=0.5,
+                 cache=None, limiter=None):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.cache = cache
+        self.limiter = limiter
+
+    def record(self, url, start, error=False):
+        """Record a request to `url` started at perf_counter `start`."""
+        metrics.get_metrics().record_request(metrics.endpoint_name(url),
+                                             time.perf_counter() - start, error)
+
+    def record_bytes(self, url, size):
+        metrics.get_metrics().record_bytes(metrics.endpoint_name(url), size)
+
+    def get_cached(self, url, cache=True):
+        return self.cache.get(url) if self.cache and cache else None
+
+    def decode(self, url, status, body, headers, cached, cache=True):
+        """Return the decoded JSON of a response, caching it if possible and
+        `cache` is true.
+
+        A 304 response returns the cached decoded JSON, which is shared
+        between calls and must not be modified.
+        """
+        if status == 304 and cached:
+            return self.cache.decoded(url, cached)
+        decoded = json.loads(body.decode('utf-8'))
+        if self.cache and cache:
+            self.cache.set(url, body, headers, decoded)
+        return decoded
+
+    @abc.abstractmethod
+    def get_json(self, url, cache=True):
+        """Return the decoded JSON response of `url`, raising on failure.
+        The response is only cached if `cache` is true."""
+
+    @abc.abstractmethod
+    def map_json(self, urls, cache=True):
+        """Return a list of the decoded JSON responses of `urls`.
+
+        Requests are made concurrently. A failed request does not stop the
+        others, the exception it raised is returned in its place instead.
+        Responses are only cached if `cache` is true.
+        """
+
+    @abc.abstractmethod
+    def stream(self, url):
+        """Create a generator returning the response body of `url` in
+        chunks of bytes as they are downloaded. Streamed responses are not
+        cached, and are only retried until the response starts."""
+
+    def close(self):
+        pass
+
+    def retry_delay(self, attempt, retry_after=None):
+        """Return the seconds to wait before retry number `attempt`.
+
+        A Retry-After in seconds is honoured up to `MAX_RETRY_AFTER`, or the
+        backoff of the attempt if longer, so a misbehaving server cannot
+        stall a run.
+        """
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), max(self.backoff * 2 ** attempt, MAX_RETRY_AFTER))
+        return self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+
+
+class ThreadedEngine(Engine):
+    """Fetch engine using a thread pool over a single requests Session."""
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        # Created on first use and kept for the life of the engine
+        self._pool = None
+
+    def _get(self, url, headers=None, stream=False):
+        for attempt in range(self.retries + 1):
+            retry_after = None
+            if self.limiter:
+                self.limiter.wait()
+            start = time.perf_counter()
+            try:
+                response = self.session.get(url, headers=headers, stream=stream,
+                                            timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as err:
+                self.record(url, start, error=True)
+                error = err
+            else:
+                self.record(url, start, error=response.status_code >= 400)
+                if response.status_code not in RETRY_STATUSES:
+                    response.raise_for_status()
+                    return response
+                retry_after = response.headers.get('Retry-After')
+                error = FetchError('{} returned {}'.format(url, response.status_code))
+                response.close()
+            if attempt < self.retries:
+                time.sleep(self.retry_delay(attempt, retry_after))
+        raise error
+
+    def get_json(self, url, cache=True):
+        cached = self.get_cached(url, cache)
+        response = self._get(url, headers=conditional_headers(cached))
+        self.record_bytes(url, len(response.content))
+        return self.decode(url, response.status_code, response.content,
+                           response.headers, cached, cache)
+
+    def stream(self, url):
+        with self._get(url, stream=True) as response:
+            for chunk in response.iter_content(CHUNK_SIZE):
+                self.record_bytes(url, len(chunk))
+                yield chunk
+
+    def _get_json_or_error(self, url, cache=True):
+        try:
+            return self.get_json(url, cache)
+        except Exception as err:
+            return err
+
+    def map_json(self, urls, cache=True):
+        if self._pool is None:
+            self._pool = ThreadPool(self.concurrency)
+        return self._pool.map(functools.partial(self._get_json_or_error, cache=cache), urls)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
+        self.session.close()
+
+
+class AsyncioEngine(Engine):
+    """Fetch engine running requests on an asyncio event loop with aiohttp.
+
+    The event loop and its client session are kept for the life of the
+    engine, so connections stay open between calls.
+    """
+    def __init__(self, **kwargs):
+        if aiohttp is None:
+            raise ImportError('The asyncio engine requires aiohttp')
+        super().__init__(**kwargs)
+        self.loop = asyncio.new_event_loop()
+        self.session = None
+
+    async def _get_session(self):
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=self.concurrency)
+            timeout = aiohttp.ClientTimeout(total=self.timeout)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self.session
+
+    async def _get_json(self, url, semaphore, cache=True):
+        session = await self._get_session()
+        cached = self.get_cached(url, cache)
+        headers = conditional_headers(cached)
+        for attempt in range(self.retries + 1):
+            retry_after = None
+            start = None
+            try:
+                async with semaphore:
+                    if self.limiter:
+                        await self.limiter.wait_async()
+                    start = time.perf_counter()
+                    async with session.get(url, headers=headers) as response:
+                        # Latency is recorded up to the response headers
+                        self.record(url, start, error=response.status >= 400)
+                        start = None
+                        if response.status not in RETRY_STATUSES:
+                            response.raise_for_status()
+                            body = await response.read()
+                            self.record_bytes(url, len(body))
+                            return self.decode(url, response.status, body,
+                                               response.headers, cached, cache)
+                        retry_after = response.headers.get('Retry-After')
+                        error = FetchError('{} returned {}'.format(url, response.status))
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as err:
+                # Failed before the response, otherwise already recorded
+                if start is not None:
+                    self.record(url, start, error=True)
+                error = err
+            if attempt < self.retries:
+                await asyncio.sleep(self.retry_delay(attempt, retry_after))
+        raise error
+
+    async def _map_json(self, urls, cache=True):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        return await asyncio.gather(*(self._get_json(url, semaphore, cache) for url in urls),
+                                    return_exceptions=True)
+
+    async def _open(self, url):
+        session = await self._get_session()
+        for attempt in range(self.retries + 1):
+            retry_after = None
+            if self.limiter:
+                await self.limiter.wait_async()
+            start = time.perf_counter()
+            try:
+                response = await session.get(url)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as err:
+                self.record(url, start, error=True)
+                error = err
+            else:
+                self.record(url, start, error=response.status >= 400)
+                if response.status not in RETRY_STATUSES:
+                    response.raise_for_status()
+                    return response
+                retry_after = response.headers.get('Retry-After')
+                error = FetchError('{} returned {}'.format(url, response.status))
+                response.release()
+            if attempt < self.retries:
+                await asyncio.sleep(self.retry_delay(attempt, retry_after))
+        raise error
+
+    def stream(self, url):
+        response = self.loop.run_until_complete(self._open(url))
+        try:
+            while True:
+                chunk = self.loop.run_until_complete(response.content.read(CHUNK_SIZE))
+                if not chunk:
+                    return
+                self.record_bytes(url, len(chunk))
+                yield chunk
+        finally:
+            response.release()
+
+    def get_json(self, url, cache=True):
+        result = self.map_json([url], cache)[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def map_json(self, urls, cache=True):
+        return self.loop.run_until_complete(self._map_json(urls, cache))
+
+    def close(self):
+        if self.session is not None:
+            self.loop.run_until_complete(self.session.close())
+            self.session = None
+        self.loop.close()
+
+
+class RateLimiter:
+    """Spread requests to at most `rate` a second, each request waiting
+    its turn so that they are evenly spaced rather than sent in bursts.
+
+    clock, sleep
+        Functions to tell the time and wait, for testing.
+    """
+    def __init__(self, rate, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.clock = clock
+        self.sleep = sleep
+        self._next = None
+        self._lock = threading.Lock()
+
+    def _reserve(self, n):
+        """Reserve the next turn of `n` requests, returning the seconds to
+        wait for it."""
+        with self._lock:
+            now = self.clock()
+            if self._next is None or self._next < now:
+                self._next = now
+            delay = self._next - now
+            self._next += n / self.rate
+        return delay
+
+    def wait(self, n=1):
+        """Block until `n` more requests are within the rate."""
+        delay = self._reserve(n)
+        if delay > 0:
+            self.sleep(delay)
+
+    async def wait_async(self, n=1):
+        """Wait without blocking the event loop until `n` more requests are
+        within the rate."""
+        delay = self._reserve(n)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+ENGINES = {
+    'threads': ThreadedEngine,
+    'asyncio': AsyncioEngine,
+}
+
+
+def create_engine(name='threads', **kwargs):
+    """Return a new fetch engine of type `name`, one of `ENGINES`."""
+    try:
+        engine_class = ENGINES[name]
+    except KeyError:
+        raise FetchError('engine must be one of ({})'.format(', '.join(ENGINES)))
+    return engine_class(**kwargs)
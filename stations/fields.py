@@ -0,0 +1,7 @@
+from django.db import models
+
+
+class RealField(models.FloatField):
+    """A single precision float, stored in 4 bytes rather than 8."""
+    def db_type(self, connection):
+        return 'real'
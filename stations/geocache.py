@@ -0,0 +1,80 @@
+"""Redis cache of the serialized data served to the map.
+
+Entries are keyed by an ingestion version which the ingestion commands
+bump once they commit, so cached data is never older than the last load
+and no explicit invalidation is needed. If Redis is unavailable the data
+is built on every request instead.
+"""
+import gzip
+import logging
+import time
+
+from django.conf import settings
+import redis
+
+
+LOG = logging.getLogger(__name__)
+
+VERSION_KEY = 'riverscope:version'
+UPDATED_KEY = 'riverscope:updated'
+KEY_PREFIX = 'riverscope:cache'
+# Entries of superseded versions are left to expire
+CACHE_TIMEOUT = 24 * 60 * 60
+
+_client = None
+
+
+def get_client():
+    global _client
+    if _client is None:
+        _client = redis.StrictRedis.from_url(settings.REDIS_URL)
+    return _client
+
+
+def bump_version():
+    """Invalidate all cached entries, called after each ingestion commits."""
+    try:
+        pipe = get_client().pipeline()
+        pipe.incr(VERSION_KEY)
+        pipe.set(UPDATED_KEY, time.time())
+        pipe.execute()
+    except redis.RedisError as err:
+        LOG.warning('Could not invalidate the cache: {}'.format(err))
+
+
+def get_version():
+    """Return the current ingestion version and the time it was bumped."""
+    version, updated = get_client().mget(VERSION_KEY, UPDATED_KEY)
+    return int(version or 0), float(updated or 0)
+
+
+def cached(name, build, compressed=False):
+    """Return the bytes cached under `name` for the current version.
+
+    build
+        A function returning the bytes to cache, called if the entry is
+        missing. A gzip compressed copy is cached alongside.
+    compressed
+        If true, return the gzip compressed copy.
+    """
+    try:
+        version, _ = get_version()
+        key = '{}:{}:{}'.format(KEY_PREFIX, version, name)
+        data = get_client().get(key + '.gz' if compressed else key)
+    except redis.RedisError as err:
+        LOG.warning('Could not read the cache: {}'.format(err))
+        data = build()
+        return gzip.compress(data) if compressed else data
+    if data is not None:
+        return data
+
+    data = build()
+    data_gz = gzip.compress(data)
+    try:
+        pipe = get_client().pipeline()
+        pipe.set(key, data, ex=CACHE_TIMEOUT)
+        pipe.set(key + '.gz', data_gz, ex=CACHE_TIMEOUT)
+        pipe.execute()
+    except redis.RedisError as err:
+        LOG.warning('Could not write the cache: {}'.format(err))
+    return data_gz if compressed else data
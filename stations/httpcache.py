@@ -0,0 +1,136 @@
+"""On-disk cache of HTTP responses for conditional requests.
+
+Responses carrying an ETag or Last-Modified validator are stored keyed by
+URL, so repeat requests can be sent with If-None-Match/If-Modified-Since
+and a 304 Not Modified answered from disk. The cache is bounded in size,
+evicting the least recently used responses first. The decoded JSON of
+recent responses is also held in memory, so a 304 skips parsing as well
+as the download.
+"""
+from collections import OrderedDict, namedtuple
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+
+CachedResponse = namedtuple('CachedResponse', 'body etag last_modified')
+
+
+def conditional_headers(cached):
+    """Return the conditional request headers for a CachedResponse."""
+    headers = {}
+    if cached:
+        if cached.etag:
+            headers['If-None-Match'] = cached.etag
+        if cached.last_modified:
+            headers['If-Modified-Since'] = cached.last_modified
+    return headers
+
+
+class ResponseCache:
+    """A size bounded LRU cache of response bodies in directory `path`.
+
+    max_size
+        Total size in bytes of the cached responses, beyond which the least
+        recently used are deleted.
+    max_decoded
+        Number of decoded responses held in memory.
+    """
+    def __init__(self, path, max_size=256 * 1024 * 1024, max_decoded=256):
+        self.path = path
+        self.max_size = max_size
+        self.max_decoded = max_decoded
+        self._lock = threading.Lock()
+        # URL to (etag, last_modified, decoded JSON), least recently used first
+        self._decoded = OrderedDict()
+        os.makedirs(path, exist_ok=True)
+        self._size = sum(entry.stat().st_size for entry in self._entries())
+
+    def _entries(self):
+        return [entry for entry in os.scandir(self.path)
+                if entry.is_file() and entry.name.endswith('.cache')]
+
+    def _filename(self, url):
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.path, key + '.cache')
+
+    def get(self, url):
+        """Return the CachedResponse of `url`, or None if not cached."""
+        filename = self._filename(url)
+        try:
+            with open(filename, 'rb') as f:
+                meta = json.loads(f.readline().decode('utf-8'))
+                body = f.read()
+            # Mark as recently used
+            os.utime(filename)
+        except (OSError, ValueError):
+            return None
+        if meta.get('url') != url:
+            return None
+        return CachedResponse(body, meta.get('etag'), meta.get('last_modified'))
+
+    def _remember(self, url, etag, last_modified, decoded):
+        with self._lock:
+            self._decoded[url] = (etag, last_modified, decoded)
+            self._decoded.move_to_end(url)
+            while len(self._decoded) > self.max_decoded:
+                self._decoded.popitem(last=False)
+
+    def decoded(self, url, cached):
+        """Return the decoded JSON body of `cached`, the CachedResponse of
+        `url`, parsing it only if not held in memory. The returned object is
+        shared between calls, so must not be modified."""
+        with self._lock:
+            entry = self._decoded.get(url)
+            if entry is not None and entry[:2] == (cached.etag, cached.last_modified):
+                self._decoded.move_to_end(url)
+                return entry[2]
+        decoded = json.loads(cached.body.decode('utf-8'))
+        self._remember(url, cached.etag, cached.last_modified, decoded)
+        return decoded
+
+    def set(self, url, body, headers, decoded=None):
+        """Store `body` for `url` if response `headers` carry a validator,
+        holding its `decoded` JSON in memory if given."""
+        etag = headers.get('ETag')
+        last_modified = headers.get('Last-Modified')
+        if not etag and not last_modified:
+            return
+        if decoded is not None:
+            self._remember(url, etag, last_modified, decoded)
+        meta = json.dumps({'url': url, 'etag': etag, 'last_modified': last_modified})
+        filename = self._filename(url)
+        fd, tmp_filename = tempfile.mkstemp(dir=self.path)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(meta.encode('utf-8') + b'\n')
+            f.write(body)
+        with self._lock:
+            try:
+                self._size -= os.path.getsize(filename)
+            except OSError:
+                pass
+            os.replace(tmp_filename, filename)
+            self._size += os.path.getsize(filename)
+            if self._size > self.max_size:
+                self._evict()
+
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda entry: entry.stat().st_mtime)
+        for entry in entries:
+            if self._size <= self.max_size:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+            except OSError:
+                continue
+            self._size -= size
+
+    def clear(self):
+        with self._lock:
+            self._decoded.clear()
+            for entry in self._entries():
+                os.remove(entry.path)
+            self._size = 0
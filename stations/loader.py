@@ -0,0 +1,116 @@
+"""Bulk loading of station readings with COPY.
+
+Readings are streamed from any iterable of (station id, datetime, measure)
+tuples, or (station id, epoch seconds, measure) as given by
+stations.records.ReadingBatch, into a temporary staging table with COPY
+FROM STDIN, then merged into the readings table, skipping readings already
+held. No model instances are built, and rows are sent as they are produced
+so loading overlaps with fetching. Measures are rounded to 2 decimal
+places in the merge. Loading is timed as the db_write stage of
+stations.metrics, less any time spent producing the rows.
+"""
+import io
+
+from django.db import connection
+
+from stations import metrics
+
+
+# Bytes sent to the database per COPY write
+COPY_BUFFER_SIZE = 64 * 1024
+
+STAGING_SQL = '''
+create temp table if not exists readings_staging (
+    station_id integer, datetime timestamp with time zone, epoch bigint, measure real
+) on commit drop;
+'''
+
+COPY_SQL = 'copy readings_staging (station_id, {datetime}, measure) from stdin'
+
+MERGE_SQL = '''
+insert into stations_stationreadings (station_id, datetime, measure)
+select station_id, coalesce(datetime, to_timestamp(epoch)), round(measure::numeric, 2)
+from readings_staging
+on conflict (station_id, datetime) do nothing
+{returning};
+'''
+
+TRUNCATE_SQL = 'truncate readings_staging;'
+
+DELETE_SINCE_SQL = '''
+delete from stations_stationreadings r
+using unnest(%(station_ids)s::integer[], %(epochs)s::bigint[]) as since (station_id, epoch)
+where r.station_id = since.station_id and r.datetime >= to_timestamp(since.epoch);
+'''
+
+
+class RowsFile(io.RawIOBase):
+    """A read only file of `rows` as COPY text format lines.
+
+    Values are written with str, so must not contain tabs, newlines or
+    backslashes, which holds for numbers and datetimes. Counts the rows
+    read in `count`.
+    """
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._buffer = b''
+        self.count = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        size = len(b)
+        lines = [self._buffer]
+        length = len(self._buffer)
+        for row in self._rows:
+            line = ('\t'.join(map(str, row)) + '\n').encode('utf-8')
+            lines.append(line)
+            length += len(line)
+            self.count += 1
+            if length >= size:
+                break
+        data = b''.join(lines)
+        b[:min(size, len(data))] = data[:size]
+        self._buffer = data[size:]
+        return min(size, len(data))
+
+
+def load_readings(rows, returning=False, epochs=False):
+    """Load (station id, datetime, measure) `rows` into the readings table,
+    skipping readings whose station and datetime are already held. Must be
+    called in a transaction.
+
+    returning
+        Return the inserted rows, with datetimes, rather than their count.
+    epochs
+        Rows hold epoch seconds in place of datetimes.
+
+    Returns a tuple of the number of rows read and the inserted rows or
+    their count.
+    """
+    rows_file = RowsFile(rows)
+    with metrics.stage('db_write'), connection.cursor() as cursor:
+        cursor.execute(STAGING_SQL)
+        cursor.cursor.copy_expert(COPY_SQL.format(datetime='epoch' if epochs else 'datetime'),
+                                  io.BufferedReader(rows_file, COPY_BUFFER_SIZE))
+        cursor.execute(MERGE_SQL.format(
+            returning='returning station_id, datetime, measure' if returning else ''))
+        inserted = cursor.fetchall() if returning else cursor.rowcount
+        cursor.execute(TRUNCATE_SQL)
+    metrics.count('readings_read', rows_file.count)
+    metrics.count('readings_written', len(inserted) if returning else inserted)
+    return rows_file.count, inserted
+
+
+def delete_readings_since(first_epochs):
+    """Delete the readings of each station in `first_epochs`, a dict of
+    station id to epoch seconds, taken at or after its epoch, so they can be
+    replaced by reloaded readings while older history is kept. Returns the
+    number of readings deleted."""
+    if not first_epochs:
+        return 0
+    with metrics.stage('db_write'), connection.cursor() as cursor:
+        cursor.execute(DELETE_SINCE_SQL, {'station_ids': list(first_epochs),
+                                          'epochs': list(first_epochs.values())})
+        return cursor.rowcount
@@ -0,0 +1,229 @@
+from datetime import datetime, timedelta, timezone
+import itertools
+import json
+import logging
+import os
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+import logger
+
+from stations import fetch, geocache, loader, records
+from stations.models import Stations
+from stations.summary import refresh_station_summary
+from stations.trends import update_trends
+import stations.management.commands.utils as utils
+
+
+LOG = logger.FilePrintLogger(__name__)
+
+# The EA hard limit on readings returned by a single request, chunks with
+# more readings are fetched in pages of this size
+CHUNK_LIMIT = 10000
+
+
+def parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+class Chunks:
+    """The (station, first day, last day) chunks covering `start` to `end`
+    inclusive for each station in turn, `chunk_days` at a time, indexed so
+    progress can be saved as chunk numbers."""
+    def __init__(self, stations, start, end, chunk_days=1):
+        self.stations = stations
+        self.start = start
+        self.end = end
+        self.chunk_days = chunk_days
+        self.per_station = ((end - start).days // chunk_days) + 1
+
+    def __len__(self):
+        return len(self.stations) * self.per_station
+
+    def __getitem__(self, index):
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        station_index, day_index = divmod(index, self.per_station)
+        first_day = self.start + timedelta(days=day_index * self.chunk_days)
+        last_day = min(first_day + timedelta(days=self.chunk_days - 1), self.end)
+        return self.stations[station_index], first_day, last_day
+
+
+def chunk_url(station, first_day, last_day, offset=None):
+    return utils.readings_url(measure=station.measure, date_range=(first_day, last_day),
+                              limit=CHUNK_LIMIT, offset=offset)
+
+
+def chunk_items(engine, chunk, first_page):
+    """Create a generator returning the reading items of `chunk`, starting
+    with the `first_page` response. A full page may have been truncated at
+    CHUNK_LIMIT, so the following pages are fetched until one is not."""
+    page = first_page
+    offset = 0
+    while True:
+        items = page.get('items', ())
+        yield from items
+        if len(items) < CHUNK_LIMIT:
+            return
+        offset += CHUNK_LIMIT
+        page = engine.get_json(chunk_url(*chunk, offset=offset), cache=False)
+
+
+class Checkpoint:
+    """Progress of a backfill through its chunks, saved to file `path` so an
+    interrupted run resumes where it stopped and retries failed chunks.
+
+    The checkpoint only applies to a run with the same `params`.
+    """
+    def __init__(self, path, params):
+        self.path = path
+        self.params = params
+        self.done = 0
+        self.failed = []
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        if saved.get('params') == self.params:
+            self.done = saved['done']
+            self.failed = saved['failed']
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'params': self.params, 'done': self.done, 'failed': self.failed}, f)
+        os.replace(tmp_path, self.path)
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class Command(BaseCommand):
+    help = ('Backfill historical readings of stations over a period, '
+            'resuming an interrupted run.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=parse_date, required=True, metavar='YYYY-MM-DD',
+                            help='First day to backfill.')
+        parser.add_argument('--end', type=parse_date, metavar='YYYY-MM-DD',
+                            help='Last day to backfill, by default yesterday.')
+        parser.add_argument('-s', '--stations', nargs='+', metavar='station_ref',
+                            help='Only backfill these stations.')
+        parser.add_argument('--chunk-days', type=int, default=1,
+                            help='Days of readings fetched per request.')
+        parser.add_argument('-r', '--rate', type=float, default=20,
+                            help='Maximum requests per second.')
+        parser.add_argument('--checkpoint', metavar='path',
+                            default=os.path.join(os.path.expanduser('~'), 'riverscope',
+                                                 'backfill_checkpoint.json'),
+                            help='Save progress here to resume an interrupted run.')
+        parser.add_argument('--restart', action='store_true',
+                            help='Ignore any saved progress.')
+        utils.add_fetch_arguments(parser)
+        parser.add_argument('-d', '--debug', action='store_true',
+                            help='Run in debug mode')
+        parser.add_argument('-l', '--log', help='Set the log directory',
+                            default=os.path.join(os.path.expanduser('~')),
+                            metavar='path')
+
+    def handle(self, *args, **options):
+        # Setup logger with levels and path
+        log_path = os.path.join(options['log'], 'riverscope', __name__ + '_log.txt')
+        if options['debug']:
+            LOG.set_print_handler_level(logging.DEBUG)
+            LOG.set_file_handler(log_path, logging.DEBUG)
+        else:
+            LOG.set_print_handler_level(logging.INFO)
+            LOG.set_file_handler(log_path, logging.DEBUG)
+
+        start = options['start']
+        end = options['end'] or datetime.now(timezone.utc).date() - timedelta(days=1)
+        if start > end:
+            raise CommandError('--start must not be after --end')
+        if options['chunk_days'] < 1:
+            raise CommandError('--chunk-days must be at least 1')
+
+        stations = Stations.objects.exclude(measure='').order_by('id')
+        if options['stations']:
+            stations = stations.filter(station_ref__in=options['stations'])
+        stations = list(stations)
+
+        chunks = Chunks(stations, start, end, options['chunk_days'])
+        checkpoint = Checkpoint(options['checkpoint'], {
+            'start': start.isoformat(), 'end': end.isoformat(),
+            'chunk_days': options['chunk_days'],
+            'stations': [station.station_ref for station in stations]})
+        if not options['restart']:
+            checkpoint.load()
+        if checkpoint.done:
+            LOG.info('Resuming after {} of {} chunks, retrying {} failed'.format(
+                checkpoint.done, len(chunks), len(checkpoint.failed)))
+
+        # Each request waits its turn, so requests are spread evenly
+        engine = utils.set_engine_from_options(options,
+                                               limiter=fetch.RateLimiter(options['rate']))
+        # Chunks that failed last time are retried first, staying in the
+        # checkpoint until they have been
+        retry = list(checkpoint.failed)
+        failed = []
+        indexes = itertools.chain(retry, range(checkpoint.done, len(chunks)))
+
+        time_start = utils.start_timer()
+        count_inserted = 0
+        changed_station_ids = set()
+        # Each batch is fetched concurrently then loaded in one transaction
+        for batch in utils.chunked(indexes, options['concurrency'] * 4):
+            responses = engine.map_json([chunk_url(*chunks[index]) for index in batch],
+                                        cache=False)
+
+            readings = records.ReadingBatch()
+            for index, response in zip(batch, responses):
+                station, first_day, last_day = chunks[index]
+                try:
+                    if isinstance(response, Exception):
+                        raise response
+                    # Readings of a chunk failing part way are still loaded,
+                    # those already held are skipped when it is retried
+                    skipped = readings.extend(station.id, chunk_items(
+                        engine, chunks[index], response))
+                except Exception as err:
+                    failed.append(index)
+                    LOG.warning('Failed {} {} to {}: {}'.format(
+                        station.station_ref, first_day, last_day, str(err)))
+                    continue
+                if skipped:
+                    LOG.warning('Skipped {} malformed readings for {}'.format(
+                        skipped, station.station_ref))
+            with transaction.atomic():
+                count_inserted += loader.load_readings(readings.rows(), epochs=True)[1]
+            changed_station_ids.update(readings.station_ids)
+            retry = retry[len(batch):]
+            checkpoint.failed = failed + retry
+            checkpoint.done = max(checkpoint.done, batch[-1] + 1)
+            checkpoint.save()
+            LOG.debug('{} of {} chunks, {} readings inserted'.format(
+                checkpoint.done, len(chunks), count_inserted))
+
+        with transaction.atomic():
+            refresh_station_summary(changed_station_ids)
+            update_trends()
+        geocache.bump_version()
+        if checkpoint.failed:
+            LOG.warning('{} chunks failed, run again to retry them'.format(
+                len(checkpoint.failed)))
+        else:
+            checkpoint.remove()
+
+        time_diff = utils.end_timer(time_start)
+        LOG.info('Inserted {} readings of {} stations in {}'.format(
+            count_inserted, len(stations), time_diff))
@@ -1,36 +1,194 @@
 from datetime import datetime, timedelta, timezone
-from itertools import repeat
 import logging
 import os
-from multiprocessing.pool import ThreadPool
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.db import transaction
+from django.db.models import Max
 
 import logger
 
+from stations import alerts, geocache, loader, metrics, polling, records
 from stations.models import Stations, StationReadings
+from stations.summary import refresh_station_summary
+from stations.trends import update_trends
 import stations.management.commands.utils as utils
 
 
 LOG = logger.FilePrintLogger(__name__)
 
+# The EA hard limit on readings returned by a single request
+SINCE_LIMIT = 10000
 
-def get_readings(station_limit):
-    station, limit = station_limit
-    url = utils.readings_url(measure=station.measure, sort=True, limit=limit)
-    station_readings = []
-    try:
-        measures = utils.get_url_json_response(url)
-        for measure in measures['items']:
-            date = datetime.strptime(measure['dateTime'], '%Y-%m-%dT%H:%M:%SZ')
-            date = date.replace(tzinfo=timezone.utc)
-            value = round(float(measure['value']), 2)
-            station_readings.append(StationReadings(station=station, datetime=date, measure=value))
-            # StationReadings.objects.create(station=station, datetime=date, measure=value)
-        return station_readings
-    except Exception as err:
-        LOG.warning('Skipped reading for {}: {}'.format(station.station_ref, str(err)))
+# How far back incremental bulk fetches go at most, so a station offline for
+# long does not make every poll fetch its whole gap for all stations. Longer
+# gaps are filled with the backfill command.
+BULK_SINCE_WINDOW = timedelta(hours=24)
+
+
+def latest_reading_datetimes():
+    """Return a dict of station id to the datetime of its newest reading."""
+    return dict(StationReadings.objects.values_list('station')
+                .annotate(latest=Max('datetime')))
+
+
+def parse_reading(station, item):
+    """Return a (station id, epoch seconds, measure) row of a reading item."""
+    return station.id, records.parse_datetime(item['dateTime']), float(item['value'])
+
+
+def station_readings_url(station, limit, since=None):
+    if since:
+        return utils.readings_url(measure=station.measure, since=since,
+                                  sort=True, limit=SINCE_LIMIT)
+    return utils.readings_url(measure=station.measure, sort=True, limit=limit)
+
+
+def get_readings(stations, limit, latest):
+    """Get readings for each station with a request per station measure,
+    returned as a ReadingBatch.
+
+    Stations found in `latest`, a dict of station id to datetime, only have
+    readings since that datetime requested, others their last `limit`.
+    """
+    urls = [station_readings_url(station, limit, latest.get(station.id))
+            for station in stations]
+    responses = utils.get_url_json_responses(urls, cache=False)
+    station_readings = records.ReadingBatch()
+    for station, measures in zip(stations, responses):
+        try:
+            if isinstance(measures, Exception):
+                raise measures
+            with metrics.stage('parse'):
+                skipped = station_readings.extend(station.id, measures['items'])
+        except Exception as err:
+            LOG.warning('Skipped readings for {}: {}'.format(station.station_ref, str(err)))
+        else:
+            if skipped:
+                LOG.warning('Skipped {} malformed readings for {}'.format(
+                    skipped, station.station_ref))
+    return station_readings
+
+
+def iter_bulk_readings(stations, since=None):
+    """Create a generator returning (station id, epoch seconds, measure)
+    readings for all stations from the global readings endpoint.
+
+    Pages through `data/readings` rather than making a request per station,
+    mapping each reading back to its station by measure id. Readings are
+    parsed as each page downloads. If `since` is given, returns all readings
+    taken after it, otherwise only the latest reading of each measure.
+    """
+    measure_index = {station.measure: station for station in stations if station.measure}
+    if since:
+        items = utils.get_paged_items(utils.readings_url, stream=True,
+                                      since=since, parameter='level', sort=True)
+    else:
+        items = utils.get_paged_items(utils.readings_url, stream=True,
+                                      latest=True, parameter='level')
+    for item in items:
+        station = measure_index.get(item['measure'].split('/')[-1])
+        if station is None:
+            continue
+        try:
+            yield parse_reading(station, item)
+        except (KeyError, TypeError, ValueError) as err:
+            LOG.warning('Skipped reading for {}: {}'.format(station.station_ref, str(err)))
+
+
+def bulk_since(latest, now):
+    """Return the datetime incremental bulk readings are fetched since, the
+    oldest of the newest readings in `latest`, a dict of station id to
+    datetime, but no earlier than BULK_SINCE_WINDOW before `now`. Returns
+    None if there are no readings."""
+    if not latest:
+        return None
+    since = min(latest.values())
+    if since < now - BULK_SINCE_WINDOW:
+        stale = sum(1 for latest_datetime in latest.values()
+                    if latest_datetime < now - BULK_SINCE_WINDOW)
+        LOG.warning('{} stations have no readings in the last {}, fetching since {}; '
+                    'backfill to fill their gaps'.format(stale, BULK_SINCE_WINDOW,
+                                                          now - BULK_SINCE_WINDOW))
+        since = now - BULK_SINCE_WINDOW
+    return since
+
+
+def update_readings(lastn=10, incremental=False, bulk=False, adaptive=False):
+    """Fetch readings of all stations and load them, then refresh the station
+    summaries and trends and evaluate alerts.
+
+    lastn
+        Readings fetched per station without a stored reading.
+    incremental
+        Keep stored readings, fetching only newer ones. Otherwise the stored
+        readings of each station from its oldest fetched reading on are
+        replaced, keeping older history such as backfilled readings.
+    bulk
+        Fetch readings for all stations in a few paged requests.
+    adaptive
+        Only poll stations due a new reading, see stations.polling. Implies
+        incremental and cannot be combined with bulk.
+
+    Returns a dict of polled, inserted, skipped, trends and alerts counts.
+    """
+    if adaptive and bulk:
+        raise ValueError('Adaptive polling cannot be combined with bulk fetching')
+    incremental = incremental or adaptive
+    now = datetime.now(timezone.utc)
+    if incremental:
+        latest = latest_reading_datetimes()
+    else:
+        latest = {}
+    stations = Stations.objects.all()
+    if adaptive:
+        stations = stations.filter(id__in=polling.due_station_ids(now))
+    # Readings are downloaded in full before the transaction is opened, so
+    # it is not held open for as long as the requests take
+    if bulk:
+        since = bulk_since(latest, now)
+        station_readings = records.ReadingBatch()
+        for row in metrics.timed_iter('parse', iter_bulk_readings(stations, since)):
+            station_readings.append(*row)
+        count_polled = None
+    else:
+        stations = list(stations)
+        station_readings = get_readings(stations, lastn, latest)
+        count_polled = len(stations)
+
+    with transaction.atomic():
+        if not incremental:
+            loader.delete_readings_since(station_readings.first_epochs())
+        # Readings already held by station and datetime are skipped
+        count_read, inserted = loader.load_readings(station_readings.rows(), returning=True,
+                                                    epochs=True)
+        changed_station_ids = {station_id for station_id, _, _ in inserted}
+
+        # All summaries are stale once the readings have been reloaded
+        with metrics.stage('summary'):
+            refresh_station_summary(changed_station_ids if incremental else None)
+            count_trends = update_trends()
+        if adaptive:
+            with metrics.stage('db_write'):
+                polling.update_poll_states({station.id for station in stations},
+                                           changed_station_ids, now)
+    geocache.bump_version()
+
+    # New (datetime, measure) of each station for alert evaluation, the
+    # measures rounded back from single precision
+    alert_readings = {}
+    for station_id, date, measure in inserted:
+        alert_readings.setdefault(station_id, []).append((date, round(measure, 2)))
+    if not incremental:
+        # A reload is not new, only evaluate the latest reading of each
+        # station so alerts do not fire again on old readings
+        alert_readings = {station_id: [max(readings)]
+                          for station_id, readings in alert_readings.items()}
+    with metrics.stage('alerts'):
+        count_alerts = alerts.run_alerts(alert_readings)
+    return {'polled': count_polled, 'inserted': len(inserted),
+            'skipped': count_read - len(inserted),
+            'trends': count_trends, 'alerts': count_alerts}
 
 
 class Command(BaseCommand):
@@ -39,6 +197,18 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('-n', '--lastn', type=int, default=10,
                             help='Get last n readings.')
+        parser.add_argument('-i', '--incremental', action='store_true',
+                            help='Only fetch and append readings newer than '
+                            'the latest stored reading for each station.')
+        parser.add_argument('-b', '--bulk', action='store_true',
+                            help='Fetch readings for all stations in a few '
+                            'paged requests. Without -i only the latest '
+                            'reading of each station is fetched.')
+        parser.add_argument('-a', '--adaptive', action='store_true',
+                            help='Only poll stations due a new reading by their '
+                            'learned reporting interval. Implies -i.')
+        utils.add_fetch_arguments(parser)
+        utils.add_metrics_arguments(parser)
         parser.add_argument('-d', '--debug', action='store_true',
                             help='Run in debug mode')
         parser.add_argument('-l', '--log', help='Set the log directory',
@@ -55,14 +225,19 @@ class Command(BaseCommand):
             LOG.set_print_handler_level(logging.INFO)
             LOG.set_file_handler(log_path, logging.DEBUG)
 
+        if options['adaptive'] and options['bulk']:
+            raise CommandError('-a cannot be combined with -b')
+
+        utils.set_engine_from_options(options)
         time_start = utils.start_timer()
-        pool = ThreadPool(100)
-        # TODO http://stackoverflow.com/questions/2632520/what-is-the-fastest-way-to-send-100-000-http-requests-in-python
-        results = pool.map(get_readings, zip(Stations.objects.all(), repeat(options['lastn'])))
-        clean_results = list(filter(None, results))
-        station_readings = [s for sl in clean_results for s in sl]
-        with transaction.atomic():
-            StationReadings.objects.all().delete()
-            StationReadings.objects.bulk_create(station_readings)
+        counts = update_readings(options['lastn'], options['incremental'], options['bulk'],
+                                 options['adaptive'])
+
         time_diff = utils.end_timer(time_start)
-        LOG.info('Added {} readings in {}'.format(len(station_readings), time_diff))
+        LOG.info('Inserted {} readings, skipped {}, updated {} station trends and sent {} '
+                 'alerts in {}'.format(counts['inserted'], counts['skipped'],
+                                       counts['trends'], counts['alerts'], time_diff))
+        if counts['polled'] is not None:
+            LOG.debug('Polled {} stations'.format(counts['polled']))
+        LOG.debug('Stage times: {}'.format(metrics.get_metrics().format_stages()))
+        utils.write_metrics(options, 'getreadings', result=counts)
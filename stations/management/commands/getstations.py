@@ -1,38 +1,148 @@
 import logging
 import os
 import sys
-from multiprocessing.pool import ThreadPool
 
 from django.core.management.base import BaseCommand, CommandError
-from django.contrib.gis.geos import GEOSGeometry
+from django.db import connection, transaction
 from django.db.utils import OperationalError
+from psycopg2.extras import execute_values
 
 import logger
 
-from django.core.exceptions import ObjectDoesNotExist
+from stations import geocache, metrics
 from stations.models import Stations
 import stations.management.commands.utils as utils
 
 
 LOG = logger.FilePrintLogger(__name__)
 
+# Station attributes compared and written by sync_stations, besides the
+# station_ref key and the point
+STATION_FIELDS = ('rloiid', 'url', 'town', 'river_name', 'label',
+                  'stage_scale_url', 'typical_low', 'typical_high', 'measure')
 
-def get_station_stagescale(station):
+
+def get_station_stagescale(station, stage_scale_obj):
     stn_dict = station._asdict()
-    if station.stage_scale_url:
-        stage_scale_obj = utils.get_url_json_response(station.stage_scale_url)
-        try:
-            stn_dict['typical_low'] = float(stage_scale_obj['items']['typicalRangeLow'])
-            stn_dict['typical_high'] = float(stage_scale_obj['items']['typicalRangeHigh'])
-        except KeyError:
-            pass
+    try:
+        stn_dict['typical_low'] = float(stage_scale_obj['items']['typicalRangeLow'])
+        stn_dict['typical_high'] = float(stage_scale_obj['items']['typicalRangeHigh'])
+    except KeyError:
+        pass
     return utils.Station(**stn_dict)
 
 
+def get_stations_stagescale(stations):
+    """Return `stations` with their typical range from their stage scale."""
+    scale_urls = [station.stage_scale_url for station in stations
+                  if station.stage_scale_url]
+    responses = dict(zip(scale_urls, utils.get_url_json_responses(scale_urls)))
+    stn_with_scale = []
+    for station in stations:
+        stage_scale_obj = responses.get(station.stage_scale_url)
+        if isinstance(stage_scale_obj, Exception):
+            LOG.warning('Skipped stage scale for {}: {}'.format(
+                station.station_ref, str(stage_scale_obj)))
+        elif stage_scale_obj:
+            station = get_station_stagescale(station, stage_scale_obj)
+        stn_with_scale.append(station)
+    return stn_with_scale
+
+
+def upsert_stations(stations):
+    """Insert or update `stations` by station_ref in a single statement."""
+    if not stations:
+        return
+    table = Stations._meta.db_table
+    columns = ('station_ref',) + STATION_FIELDS
+    sql = ('INSERT INTO {table} ({columns}, point) VALUES %s '
+           'ON CONFLICT (station_ref) DO UPDATE SET {updates}, point = EXCLUDED.point').format(
+        table=table,
+        columns=', '.join(columns),
+        updates=', '.join('{0} = EXCLUDED.{0}'.format(c) for c in STATION_FIELDS))
+    template = '({}, ST_SetSRID(ST_MakePoint(%s, %s), 4326))'.format(
+        ', '.join(['%s'] * len(columns)))
+    rows = [tuple(getattr(stn, c) for c in columns) + tuple(stn.point)
+            for stn in stations]
+    with connection.cursor() as cursor:
+        execute_values(cursor.cursor, sql, rows, template=template, page_size=len(rows))
+    metrics.count('stations_written', len(rows))
+
+
+def sync_stations(found_stations, keep_typical_range=False):
+    """Bring the Stations table in line with `found_stations`.
+
+    All existing stations are loaded in one query and compared in memory,
+    then only new and changed stations are written. Stations no longer
+    published by the EA are counted but kept along with their readings.
+    If `keep_typical_range`, found stations take the typical range of the
+    existing station, for when stage scales were not fetched.
+    Returns a dict of created, updated, unchanged and disappeared counts.
+    """
+    existing = {stn['station_ref']: stn for stn in
+                Stations.objects.values('station_ref', 'point', *STATION_FIELDS)}
+    # The last occurrence wins should the EA publish a station twice
+    found = {stn.station_ref: stn for stn in found_stations}
+
+    counts = {'created': 0, 'updated': 0, 'unchanged': 0}
+    changed = []
+    for stn_ref, stn in found.items():
+        exist_stn = existing.pop(stn_ref, None)
+        if exist_stn is not None and keep_typical_range:
+            stn = stn._replace(typical_low=exist_stn['typical_low'],
+                               typical_high=exist_stn['typical_high'])
+        if exist_stn is None:
+            counts['created'] += 1
+            changed.append(stn)
+        elif (any(exist_stn[f] != getattr(stn, f) for f in STATION_FIELDS) or
+              tuple(exist_stn['point'].coords) != tuple(stn.point)):
+            counts['updated'] += 1
+            changed.append(stn)
+        else:
+            counts['unchanged'] += 1
+
+    counts['disappeared'] = len(existing)
+    if existing:
+        LOG.debug('Stations no longer published: {}'.format(', '.join(sorted(existing))))
+
+    with transaction.atomic():
+        upsert_stations(changed)
+    return counts
+
+
+def update_stations(typical_range=False):
+    """Fetch the level stations published by the EA and sync the Stations
+    table with them.
+
+    typical_range
+        Also fetch the stage scale of each station for its typical range,
+        a request per station. Otherwise existing typical ranges are kept.
+
+    Returns a dict of created, updated, unchanged, disappeared and found
+    counts.
+    """
+    found_stations = list(utils.get_river_stations(parameter='level',
+        qualifier='Stage', limit=10000, stream=True))
+    if typical_range:
+        found_stations = get_stations_stagescale(found_stations)
+
+    with metrics.stage('db_write'):
+        counts = sync_stations(found_stations, keep_typical_range=not typical_range)
+    if counts['created'] or counts['updated']:
+        geocache.bump_version()
+    counts['found'] = len(found_stations)
+    return counts
+
+
 class Command(BaseCommand):
     help = 'Updates all gauge stations from the EA.'
 
     def add_arguments(self, parser):
+        parser.add_argument('-r', '--typical-range', action='store_true',
+                            help='Get the typical level range of each station '
+                            'from its stage scale, a request per station.')
+        utils.add_fetch_arguments(parser)
+        utils.add_metrics_arguments(parser)
         parser.add_argument('-d', '--debug', action='store_true',
                             help='Run in debug mode')
         parser.add_argument('-l', '--log', help='Set the log directory',
@@ -50,50 +160,18 @@ class Command(BaseCommand):
             LOG.set_print_handler_level(logging.INFO)
             LOG.set_file_handler(log_path, logging.DEBUG)
 
+        utils.set_engine_from_options(options)
         time_start = utils.start_timer()
-        found_stations = list(utils.get_river_stations(parameter='level',
-            qualifier='Stage', limit=10000))
-        pool = ThreadPool(100)
-        stn_with_scale = pool.map(get_station_stagescale, found_stations)
-
-        count_created = 0
-        count_updated = 0
-        counter = 0
-
-        for stn in stn_with_scale:
-            stn_dict = dict(stn._asdict())
-            # pop out these variables as we will use them separately
-            stn_ref = stn_dict.pop('station_ref')
-            stn_pt = stn_dict.pop('point')
-            # Only add if doesn't exist, update if it does.
-            try:
-                exist_stn = Stations.objects.get(station_ref=stn_ref)
-                exist_stn_dict = {k: v for k, v in exist_stn.__dict__.items() if k in stn_dict}
-                # get the new attributes to check if it has been updated
-                updated = exist_stn_dict != stn_dict
-            except ObjectDoesNotExist:
-                exist_stn = None
-                updated = False
-
-            try:
-                obj, created = Stations.objects.update_or_create(
-                    station_ref=stn_ref,
-                    point=GEOSGeometry('POINT ({} {})'.format(*stn_pt)),
-                    defaults=stn_dict)
-            except OperationalError as err:
-                LOG.error('ERROR: ' + ' '.join((str(err).split())))
-                sys.exit(1)
-
-            # only save if there are changes, to reduce writes
-            if created:
-                obj.save()
-                count_created += 1
-
-            if updated:
-                count_updated += 1
-
-            counter += 1
+        try:
+            counts = update_stations(options['typical_range'])
+        except OperationalError as err:
+            LOG.error('ERROR: ' + ' '.join((str(err).split())))
+            sys.exit(1)
 
         time_diff = utils.end_timer(time_start)
-        LOG.info('Added {}, updated {} stations of {} in {}'.format(
-            count_created, count_updated, len(found_stations), time_diff))
+        LOG.info('Added {}, updated {}, unchanged {}, disappeared {} stations '
+                 'of {} in {}'.format(counts['created'], counts['updated'],
+                 counts['unchanged'], counts['disappeared'],
+                 counts['found'], time_diff))
+        LOG.debug('Stage times: {}'.format(metrics.get_metrics().format_stages()))
+        utils.write_metrics(options, 'getstations', result=counts)
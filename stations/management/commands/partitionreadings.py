@@ -0,0 +1,132 @@
+from datetime import datetime, timezone
+import logging
+import os
+import re
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+import logger
+
+from stations.models import StationReadings
+import stations.management.commands.utils as utils
+
+
+LOG = logger.FilePrintLogger(__name__)
+
+PARENT_TABLE = StationReadings._meta.db_table
+DEFAULT_PARTITION = PARENT_TABLE + '_default'
+PARTITION_RE = re.compile(r'^{}_p(\d{{4}})_(\d{{2}})$'.format(PARENT_TABLE))
+
+
+def add_months(month, n):
+    """Return the first of the month `n` months after `month`."""
+    years, month_index = divmod(month.month - 1 + n, 12)
+    return month.replace(year=month.year + years, month=month_index + 1, day=1)
+
+
+def partition_name(month):
+    return '{}_p{:%Y_%m}'.format(PARENT_TABLE, month)
+
+
+def get_partitions(cursor):
+    """Return a dict of the first of the month to monthly partition name."""
+    cursor.execute('SELECT c.relname FROM pg_inherits i '
+                   'JOIN pg_class c ON c.oid = i.inhrelid '
+                   'WHERE i.inhparent = %s::regclass', [PARENT_TABLE])
+    partitions = {}
+    for name, in cursor.fetchall():
+        match = PARTITION_RE.match(name)
+        if match:
+            month = datetime(int(match.group(1)), int(match.group(2)), 1, tzinfo=timezone.utc)
+            partitions[month] = name
+    return partitions
+
+
+def get_default_months(cursor):
+    """Return the firsts of the months of readings held in the default
+    partition, such as backfilled readings older than any partition."""
+    cursor.execute("SELECT DISTINCT date_trunc('month', datetime AT TIME ZONE 'UTC') "
+                   "FROM {}".format(DEFAULT_PARTITION))
+    return sorted(month.replace(tzinfo=timezone.utc) for month, in cursor.fetchall())
+
+
+def create_partition(cursor, month):
+    """Create and attach the partition for `month`.
+
+    Readings for the month already held in the default partition are moved
+    into the new partition before it is attached.
+    """
+    name = partition_name(month)
+    bounds = [month, add_months(month, 1)]
+    cursor.execute('CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS)'.format(name, PARENT_TABLE))
+    cursor.execute(
+        'WITH moved AS (DELETE FROM {default} WHERE datetime >= %s AND datetime < %s '
+        'RETURNING id, station_id, measure, datetime) '
+        'INSERT INTO {name} (id, station_id, measure, datetime) '
+        'SELECT id, station_id, measure, datetime FROM moved'.format(
+            default=DEFAULT_PARTITION, name=name), bounds)
+    cursor.execute('ALTER TABLE {} ATTACH PARTITION {} FOR VALUES FROM (%s) TO (%s)'.format(
+        PARENT_TABLE, name), bounds)
+    return name
+
+
+class Command(BaseCommand):
+    help = ('Create monthly partitions of station readings ahead of time and '
+            'for readings held in the default partition, and drop those older '
+            'than the retention period.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('-a', '--ahead', type=int, default=3,
+                            help='Create partitions for the next n months.')
+        parser.add_argument('-r', '--retain-months', type=int,
+                            help='Drop partitions wholly older than n months '
+                            'ago. By default no partitions are dropped.')
+        parser.add_argument('-d', '--debug', action='store_true',
+                            help='Run in debug mode')
+        parser.add_argument('-l', '--log', help='Set the log directory',
+                            default=os.path.join(os.path.expanduser('~')),
+                            metavar='path')
+
+    def handle(self, *args, **options):
+        # Setup logger with levels and path
+        log_path = os.path.join(options['log'], 'riverscope', __name__ + '_log.txt')
+        if options['debug']:
+            LOG.set_print_handler_level(logging.DEBUG)
+            LOG.set_file_handler(log_path, logging.DEBUG)
+        else:
+            LOG.set_print_handler_level(logging.INFO)
+            LOG.set_file_handler(log_path, logging.DEBUG)
+
+        time_start = utils.start_timer()
+        this_month = datetime.now(timezone.utc).replace(
+            day=1, hour=0, minute=0, second=0, microsecond=0)
+
+        created = []
+        dropped = []
+        with transaction.atomic(), connection.cursor() as cursor:
+            partitions = get_partitions(cursor)
+            # Readings of past months, such as backfilled ones, are moved out
+            # of the default partition so it stays empty and retention only
+            # ever drops whole partitions
+            months = get_default_months(cursor)
+            months += [add_months(this_month, n) for n in range(options['ahead'] + 1)]
+            for month in months:
+                if month not in partitions:
+                    partitions[month] = create_partition(cursor, month)
+                    created.append(partitions[month])
+
+            if options['retain_months'] is not None:
+                cutoff = add_months(this_month, -options['retain_months'])
+                for month, name in sorted(partitions.items()):
+                    if add_months(month, 1) <= cutoff:
+                        cursor.execute('DROP TABLE {}'.format(name))
+                        dropped.append(name)
+
+        time_diff = utils.end_timer(time_start)
+        LOG.info('Created {} and dropped {} partitions in {}'.format(
+            len(created), len(dropped), time_diff))
+        for name in created:
+            LOG.debug('Created {}'.format(name))
+        for name in dropped:
+            LOG.debug('Dropped {}'.format(name))
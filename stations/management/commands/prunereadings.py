@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta, timezone
+import logging
+import os
+
+from django.core.management.base import BaseCommand
+
+import logger
+
+from stations.models import StationReadings
+import stations.management.commands.utils as utils
+
+
+LOG = logger.FilePrintLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Delete station readings older than the retention period.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-k', '--keep-days', type=int, default=7,
+                            help='Keep readings from the last n days.')
+        parser.add_argument('-d', '--debug', action='store_true',
+                            help='Run in debug mode')
+        parser.add_argument('-l', '--log', help='Set the log directory',
+                            default=os.path.join(os.path.expanduser('~')),
+                            metavar='path')
+
+    def handle(self, *args, **options):
+        # Setup logger with levels and path
+        log_path = os.path.join(options['log'], 'riverscope', __name__ + '_log.txt')
+        if options['debug']:
+            LOG.set_print_handler_level(logging.DEBUG)
+            LOG.set_file_handler(log_path, logging.DEBUG)
+        else:
+            LOG.set_print_handler_level(logging.INFO)
+            LOG.set_file_handler(log_path, logging.DEBUG)
+
+        time_start = utils.start_timer()
+        cutoff = datetime.now(timezone.utc) - timedelta(days=options['keep_days'])
+        count_deleted, _ = StationReadings.objects.filter(datetime__lt=cutoff).delete()
+        time_diff = utils.end_timer(time_start)
+        LOG.info('Deleted {} readings older than {} in {}'.format(
+            count_deleted, cutoff.strftime('%Y-%m-%d %H:%M'), time_diff))
@@ -0,0 +1,142 @@
+import json
+import logging
+import os
+import signal
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+import logger
+
+from stations.scheduler import Job, Scheduler
+import stations.management.commands.getreadings as getreadings
+import stations.management.commands.getstations as getstations
+import stations.management.commands.utils as utils
+
+
+LOG = logger.FilePrintLogger(__name__)
+
+
+def ensure_usable_connection(job):
+    """Close the database connection if it has been dropped, so the job
+    reconnects. Otherwise the connection is kept open between jobs."""
+    if connection.connection is not None and not connection.is_usable():
+        LOG.warning('Database connection lost, reconnecting')
+        connection.close()
+
+
+def write_status(path, jobs):
+    """Atomically write the status of `jobs` to `path` as JSON."""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory)
+    with os.fdopen(fd, 'w') as f:
+        json.dump({job.name: job.status() for job in jobs}, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+class Command(BaseCommand):
+    help = ('Run as a long lived worker, polling readings and syncing '
+            'stations and stage scales on a schedule.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readings-every', type=float, default=5,
+                            metavar='minutes', help='Poll readings every n minutes.')
+        parser.add_argument('--stations-every', type=float, default=24,
+                            metavar='hours', help='Sync stations every n hours.')
+        parser.add_argument('--stage-scales-every', type=float, default=7,
+                            metavar='days', help='Refresh the typical range of '
+                            'stations from their stage scales every n days.')
+        parser.add_argument('-n', '--lastn', type=int, default=10,
+                            help='Get last n readings of stations without readings.')
+        parser.add_argument('-b', '--bulk', action='store_true',
+                            help='Fetch readings for all stations in a few '
+                            'paged requests.')
+        parser.add_argument('-a', '--adaptive', action='store_true',
+                            help='Only poll stations due a new reading by their '
+                            'learned reporting interval, best with a short '
+                            '--readings-every.')
+        parser.add_argument('-s', '--status-file', metavar='path',
+                            default=os.path.join(os.path.expanduser('~'), 'riverscope',
+                                                 'riverscoped_status.json'),
+                            help='Write the last duration and lag of each job here.')
+        utils.add_fetch_arguments(parser)
+        utils.add_metrics_arguments(parser)
+        parser.add_argument('-d', '--debug', action='store_true',
+                            help='Run in debug mode')
+        parser.add_argument('-l', '--log', help='Set the log directory',
+                            default=os.path.join(os.path.expanduser('~')),
+                            metavar='path')
+
+    def handle(self, *args, **options):
+        if options['adaptive'] and options['bulk']:
+            raise CommandError('-a cannot be combined with -b')
+
+        # Setup logger with levels and path, including those of the jobs
+        log_path = os.path.join(options['log'], 'riverscope', __name__ + '_log.txt')
+        for log in (LOG, getreadings.LOG, getstations.LOG):
+            if options['debug']:
+                log.set_print_handler_level(logging.DEBUG)
+                log.set_file_handler(log_path, logging.DEBUG)
+            else:
+                log.set_print_handler_level(logging.INFO)
+                log.set_file_handler(log_path, logging.DEBUG)
+
+        # One engine for the life of the process keeps its connections warm
+        utils.set_engine_from_options(options)
+
+        def poll_readings():
+            counts = getreadings.update_readings(options['lastn'], incremental=True,
+                                                 bulk=options['bulk'],
+                                                 adaptive=options['adaptive'])
+            LOG.info('Inserted {} readings, skipped {}, updated {} station trends and '
+                     'sent {} alerts'.format(counts['inserted'], counts['skipped'],
+                                             counts['trends'], counts['alerts']))
+
+        def sync_stations(typical_range):
+            counts = getstations.update_stations(typical_range)
+            LOG.info('Added {}, updated {}, unchanged {}, disappeared {} stations '
+                     'of {}'.format(counts['created'], counts['updated'],
+                     counts['unchanged'], counts['disappeared'], counts['found']))
+
+        jobs = [
+            Job('stage_scales', options['stage_scales_every'] * 86400,
+                lambda: sync_stations(typical_range=True)),
+            Job('stations', options['stations_every'] * 3600,
+                lambda: sync_stations(typical_range=False)),
+            Job('readings', options['readings_every'] * 60, poll_readings),
+        ]
+
+        def after_job(job):
+            LOG.info('Ran {} in {:.1f}s, {:.1f}s late'.format(
+                job.name, job.last_duration, job.last_lag))
+            try:
+                write_status(options['status_file'], jobs)
+            except OSError as err:
+                LOG.warning('Could not write status: {}'.format(err))
+            # Counters accumulate over the life of the process, as Prometheus
+            # expects, and are exported after every job
+            try:
+                utils.write_metrics(options, 'riverscoped',
+                                    jobs={job.name: job.status() for job in jobs})
+            except OSError as err:
+                LOG.warning('Could not write metrics: {}'.format(err))
+
+        scheduler = Scheduler(jobs, before_job=ensure_usable_connection, after_job=after_job)
+
+        def shutdown(signum, frame):
+            LOG.info('Stopping after the current job')
+            scheduler.stop()
+
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+
+        LOG.info('Started with {}'.format(', '.join(
+            '{} every {:g}s'.format(job.name, job.interval) for job in jobs)))
+        try:
+            scheduler.run_forever()
+        finally:
+            utils.get_engine().close()
+            connection.close()
+        LOG.info('Stopped')
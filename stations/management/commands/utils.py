@@ -1,11 +1,19 @@
 from collections import namedtuple
+import codecs
 import datetime
-import requests
+from itertools import islice
+import json
+import os
 import time
 import urllib
 
+from stations import fetch, metrics
+from stations.httpcache import ResponseCache
 
-EA_API_ROOT = 'https://environment.data.gov.uk/flood-monitoring'
+
+# Override to point at another server, such as the bench.fake_ea stand in
+EA_API_ROOT = os.environ.get('RIVERSCOPE_EA_API_ROOT',
+                             'https://environment.data.gov.uk/flood-monitoring')
 QUALIFIERS = ('Stage', 'Downstream Stage', 'Groundwater', 'Tidal Level')
 STATUSES = ('Active', 'Closed', 'Suspended')
 PARAMETERS = ('level', 'flow')
@@ -33,8 +41,188 @@ def end_timer(start_time, human_readable=True):
     return out_time
 
 
-def get_url_json_response(url):
-    return requests.get(url).json()
+_engine = None
+
+
+def set_engine(name='threads', **kwargs):
+    """Replace the fetch engine used by the url helpers.
+
+    kwargs are passed to the engine, see `stations.fetch.Engine`.
+    """
+    global _engine
+    if _engine is not None:
+        _engine.close()
+    _engine = fetch.create_engine(name, **kwargs)
+    return _engine
+
+
+def get_engine():
+    if _engine is None:
+        set_engine()
+    return _engine
+
+
+def add_fetch_arguments(parser):
+    """Add the fetch engine arguments shared by the management commands."""
+    parser.add_argument('-e', '--engine', choices=sorted(fetch.ENGINES),
+                        default='threads', help='Set the HTTP fetch engine')
+    parser.add_argument('-c', '--concurrency', type=int, default=20,
+                        help='Maximum number of requests in flight')
+    parser.add_argument('-t', '--timeout', type=float, default=30,
+                        help='Seconds allowed for each request')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Always fetch responses in full rather than '
+                        'revalidating cached responses')
+    parser.add_argument('--cache-dir', help='Set the response cache directory',
+                        default=os.path.join(os.path.expanduser('~'), 'riverscope', 'httpcache'),
+                        metavar='path')
+
+
+def add_metrics_arguments(parser):
+    """Add the metrics export argument shared by the ingestion commands."""
+    parser.add_argument('-m', '--metrics-dir', metavar='path',
+                        help='Write Prometheus metrics and a JSON summary of the '
+                        'run to this directory, such as the node exporter '
+                        'textfile collector directory')
+
+
+def write_metrics(options, name, **extra):
+    """Write the metrics of the run as `name` if a metrics directory was
+    given, see `stations.metrics.Metrics.write`."""
+    if options['metrics_dir']:
+        metrics.get_metrics().write(options['metrics_dir'], name, **extra)
+
+
+def set_engine_from_options(options, **kwargs):
+    """Set the fetch engine from the options of add_fetch_arguments, passing
+    `kwargs` such as a rate limiter to the engine."""
+    cache = None if options['no_cache'] else ResponseCache(options['cache_dir'])
+    return set_engine(options['engine'], concurrency=options['concurrency'],
+                      timeout=options['timeout'], cache=cache, **kwargs)
+
+
+def get_url_json_response(url, cache=True):
+    with metrics.stage('fetch'):
+        return get_engine().get_json(url, cache)
+
+
+def get_url_json_responses(urls, cache=True):
+    """Return the JSON responses of `urls`, fetched concurrently.
+
+    Failed requests return the exception raised in place of the response.
+    Pass cache=False for URLs unlikely to be requested again, such as
+    readings since a datetime, so they are not stored in the response cache.
+    """
+    with metrics.stage('fetch'):
+        return get_engine().map_json(urls, cache)
+
+
+def chunked(iterable, size):
+    """Create a generator returning lists of up to `size` items."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+_JSON_DELIMITERS = frozenset(',:]} \t\r\n')
+
+
+class _JSONStream:
+    """Text buffer over an iterable of UTF-8 encoded byte chunks."""
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.json_decoder = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def more(self):
+        """Read the next chunk into the buffer, False if there are no more."""
+        if self.eof:
+            return False
+        # Drop the consumed part of the buffer before growing it
+        self.buf = self.buf[self.pos:]
+        self.pos = 0
+        try:
+            self.buf += self.text_decoder.decode(next(self.chunks))
+        except StopIteration:
+            self.buf += self.text_decoder.decode(b'', final=True)
+            self.eof = True
+        return True
+
+    def peek(self):
+        """Skip whitespace and return the next character."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.more():
+                raise ValueError('Unexpected end of JSON stream')
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError('Expected {!r} at position {} of JSON stream'.format(char, self.pos))
+        self.pos += 1
+
+    def decode(self):
+        """Decode and return the next JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                end = None
+            # A value not followed by a delimiter may be a truncated number
+            if end is not None and (self.eof or (end < len(self.buf) and
+                                                 self.buf[end] in _JSON_DELIMITERS)):
+                self.pos = end
+                return value
+            if not self.more():
+                raise ValueError('Unexpected end of JSON stream')
+
+
+def iter_json_items(chunks, key='items'):
+    """Create a generator returning each element of a JSON array as parsed.
+
+    chunks
+        An iterable of byte strings making up a JSON object, such as an HTTP
+        response body read in chunks.
+    key
+        The key of the array in the JSON object, other keys are skipped.
+
+    Only one element is held in memory at a time, regardless of the size of
+    the whole document.
+    """
+    stream = _JSONStream(chunks)
+    stream.expect('{')
+    while stream.peek() != '}':
+        if stream.peek() == ',':
+            stream.pos += 1
+        name = stream.decode()
+        stream.expect(':')
+        if name != key:
+            stream.decode()
+            continue
+        stream.expect('[')
+        while stream.peek() != ']':
+            if stream.peek() == ',':
+                stream.pos += 1
+            yield stream.decode()
+        return
+
+
+def stream_url_json_items(url, key='items'):
+    """Create a generator returning each element of the `key` array of the
+    JSON response of `url`, parsed as the response is downloaded. Time
+    waiting for the response is timed as the fetch stage, decoding as the
+    parse stage."""
+    chunks = metrics.timed_iter('fetch', get_engine().stream(url))
+    return metrics.timed_iter('parse', iter_json_items(chunks, key))
 
 
 Station = namedtuple('Station', 'station_ref rloiid url town river_name '
@@ -153,20 +341,25 @@ def stations_url(rloiid=None, search=None, qualifier=None, status=None,
     return (('id', 'stations'), tokens)
 
 
-def get_river_stations(with_typical_range=False, **kwargs):
+def get_river_stations(with_typical_range=False, stream=False, **kwargs):
     """Create a generator returning a Station object for each station found.
 
     kwargs:
         with_typical_range: If true, also collects the typical min/max
             levels of the station. Warning, this is a much more lengthy query
             as it makes a request per station (~1800).
+        stream: If true, stations are parsed and returned as the response is
+            downloaded rather than once it has been read into memory.
         All other kwargs are passed to stations_url function call.
 
     """
     stn_url = stations_url(**kwargs)
-    stations = get_url_json_response(stn_url)
+    if stream:
+        stations = stream_url_json_items(stn_url)
+    else:
+        stations = get_url_json_response(stn_url)['items']
 
-    for station in stations['items']:
+    for station in stations:
         if not all((station.get('lat') , station.get('long'))):
             continue
         url = station.get('@id')
@@ -215,7 +408,7 @@ def get_river_stations(with_typical_range=False, **kwargs):
 @build_ea_station_url
 def readings_url(latest=False, today=False, date=None, since=None, limit=None,
                  date_range=None, parameter=None, qualifier=None, sort=False,
-                 station_ref=None, measure=None):
+                 station_ref=None, measure=None, offset=None):
     """Get readings matching the filter arguments passed. Returns a url.
 
         latest: bool
@@ -241,7 +434,8 @@ def readings_url(latest=False, today=False, date=None, since=None, limit=None,
             particular measurement then use the dateTime of the last retrieved
             value as the since parameter to find any new readings. Will accept
             a simple date value such as 2016-09-07 which will be interpreted as
-            2016-09-07T:00:00:00Z.
+            2016-09-07T:00:00:00Z. Timezone aware datetimes are converted to
+            UTC.
 
         parameter
             Return only readings for measures of parameters with the given
@@ -258,6 +452,10 @@ def readings_url(latest=False, today=False, date=None, since=None, limit=None,
             Limits the number of results to `limit`. If used in conjuction with
             `sorted=True`, will return the latest `limit` readings.
 
+        offset
+            Skip the first `offset` readings, used with `limit` to page
+            through large result sets.
+
         sort
             Order the array of returned readings into descending order by date,
             this done before the limits is applied thus enabling you to fetch
@@ -279,6 +477,14 @@ def readings_url(latest=False, today=False, date=None, since=None, limit=None,
         raise ParameterError('Only one of station_ref or measure is allowed.')
 
     date_fmt = '%Y-%m-%d'
+    datetime_fmt = '%Y-%m-%dT%H:%M:%SZ'
+
+    if isinstance(since, datetime.datetime):
+        if since.tzinfo:
+            since = since.astimezone(datetime.timezone.utc)
+        since = since.strftime(datetime_fmt)
+    elif since:
+        since = since.strftime(date_fmt)
 
     tokens = (
         'latest' if latest else None,
@@ -286,10 +492,11 @@ def readings_url(latest=False, today=False, date=None, since=None, limit=None,
         'date={}'.format(date.strftime(date_fmt)) if date else None,
         'startdate={}&enddate={}'.format(
             *map(lambda x: x.strftime(date_fmt), date_range)) if date_range else None,
-        'since={}'.format(since.strftime(date_fmt)) if since else None,
+        'since={}'.format(since) if since else None,
         'parameter={}'.format(parameter) if parameter else None,
         'qualifier={}'.format(qualifier) if qualifier else None,
         '_limit={}'.format(limit) if limit else None,
+        '_offset={}'.format(offset) if offset else None,
         '_sorted' if sort else None
         )
 
@@ -301,3 +508,32 @@ def readings_url(latest=False, today=False, date=None, since=None, limit=None,
         url_tokens = ('id', 'measures', measure, 'readings')
 
     return url_tokens, tokens
+
+
+def get_paged_items(url_func, page_size=10000, stream=False, **kwargs):
+    """Create a generator returning every item of a paged EA query.
+
+    url_func
+        A url building function accepting `limit` and `offset`, such as
+        `readings_url`.
+    page_size
+        The number of items requested per page. Paging stops at the first
+        page returning fewer items than this.
+    stream
+        If true, items are parsed and returned as each page is downloaded.
+    All other kwargs are passed to the `url_func` call.
+    """
+    offset = 0
+    while True:
+        url = url_func(limit=page_size, offset=offset, **kwargs)
+        if stream:
+            items = stream_url_json_items(url)
+        else:
+            items = get_url_json_response(url)['items']
+        count = 0
+        for item in items:
+            count += 1
+            yield item
+        if count < page_size:
+            return
+        offset += page_size
@@ -0,0 +1,295 @@
+"""Instrumentation of ingestion runs.
+
+The fetch engines record each HTTP request against its endpoint, the EA
+URL with station and measure identifiers replaced, counting requests,
+errors, response bytes and a histogram of latencies. Ingestion code times
+its stages, such as fetch, parse and db_write, and counts rows read and
+written. A run is exported as a Prometheus text file, to be picked up by
+the node exporter textfile collector, and a JSON summary.
+
+Stage times are exclusive and per thread: time spent in a stage entered
+from within another is only counted against the inner one, so the stages
+of a run add up to no more than its duration even when fetching, parsing
+and loading are interleaved.
+"""
+from collections import defaultdict
+from datetime import datetime, timezone
+import json
+import os
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+# Upper bounds in seconds of the request latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Path segments of EA URLs followed by an identifier
+ID_COLLECTIONS = ('stations', 'measures')
+
+PREFIX = 'riverscope'
+
+
+def endpoint_name(url):
+    """Return the path of `url` with identifiers replaced by {id}, so that
+    requests for each station or measure share one endpoint."""
+    segments = urlsplit(url).path.split('/')
+    for i in range(1, len(segments)):
+        if segments[i - 1] in ID_COLLECTIONS and segments[i]:
+            segments[i] = '{id}'
+    return '/'.join(segments)
+
+
+class EndpointStats:
+    """Requests, errors, response bytes and latencies of one endpoint."""
+    __slots__ = ('requests', 'errors', 'bytes', 'seconds', 'buckets')
+
+    def __init__(self, bucket_count):
+        self.requests = 0
+        self.errors = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        # Requests per bucket, the last above the largest bound
+        self.buckets = [0] * (bucket_count + 1)
+
+
+class Metrics:
+    """Thread safe store of the metrics of a run.
+
+    buckets
+        Upper bounds in seconds of the latency histogram buckets.
+    clock
+        Function returning the seconds stages are timed with, for testing.
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS, clock=time.perf_counter):
+        self.latency_buckets = tuple(buckets)
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.endpoints = {}
+            self.stages = defaultdict(float)
+            self.counts = defaultdict(int)
+            self.started = time.time()
+
+    def _endpoint(self, endpoint):
+        stats = self.endpoints.get(endpoint)
+        if stats is None:
+            stats = self.endpoints[endpoint] = EndpointStats(len(self.latency_buckets))
+        return stats
+
+    def record_request(self, endpoint, seconds, error=False):
+        """Record a request to `endpoint` taking `seconds`."""
+        bucket = len(self.latency_buckets)
+        for i, bound in enumerate(self.latency_buckets):
+            if seconds <= bound:
+                bucket = i
+                break
+        with self._lock:
+            stats = self._endpoint(endpoint)
+            stats.requests += 1
+            stats.seconds += seconds
+            stats.buckets[bucket] += 1
+            if error:
+                stats.errors += 1
+
+    def record_bytes(self, endpoint, size):
+        """Record `size` bytes of response body read from `endpoint`."""
+        with self._lock:
+            self._endpoint(endpoint).bytes += size
+
+    def count(self, name, n=1):
+        """Add `n` to counter `name`, such as rows written."""
+        with self._lock:
+            self.counts[name] += n
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _enter(self):
+        stack = self._stack()
+        stack.append(0.0)
+        return stack, self.clock()
+
+    def _exit(self, name, stack, start):
+        elapsed = self.clock() - start
+        exclusive = elapsed - stack.pop()
+        if stack:
+            stack[-1] += elapsed
+        with self._lock:
+            self.stages[name] += exclusive
+
+    def stage(self, name):
+        """Return a context manager timing its block as stage `name`."""
+        return _Stage(self, name)
+
+    def timed_iter(self, name, iterable):
+        """Create a generator returning the items of `iterable`, timing the
+        production of each as stage `name`."""
+        iterator = iter(iterable)
+        while True:
+            stack, start = self._enter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self._exit(name, stack, start)
+            yield item
+
+    def summary(self, **extra):
+        """Return a JSON serializable dict of the run, with `extra` items."""
+        with self._lock:
+            endpoints = {}
+            for endpoint, stats in sorted(self.endpoints.items()):
+                endpoints[endpoint] = {
+                    'requests': stats.requests,
+                    'errors': stats.errors,
+                    'bytes': stats.bytes,
+                    'seconds': round(stats.seconds, 3),
+                    'mean_seconds': round(stats.seconds / stats.requests, 3)
+                    if stats.requests else None,
+                    'latency_buckets': dict(zip(
+                        [str(b) for b in self.latency_buckets] + ['+Inf'], stats.buckets)),
+                }
+            summary = {
+                'started': datetime.fromtimestamp(self.started, timezone.utc).isoformat(),
+                'seconds': round(time.time() - self.started, 3),
+                'stages': {name: round(seconds, 3)
+                           for name, seconds in sorted(self.stages.items())},
+                'counts': dict(sorted(self.counts.items())),
+                'endpoints': endpoints,
+            }
+        summary.update(extra)
+        return summary
+
+    def prometheus(self, labels=None):
+        """Return the metrics in the Prometheus text exposition format.
+
+        labels
+            A dict of labels added to every sample, such as the command.
+        """
+        labels = labels or {}
+        lines = []
+
+        def metric(name, kind, help_text):
+            lines.append('# HELP {}_{} {}'.format(PREFIX, name, help_text))
+            lines.append('# TYPE {}_{} {}'.format(PREFIX, name, kind))
+
+        def sample(name, value, **sample_labels):
+            lines.append('{}_{}{} {}'.format(PREFIX, name,
+                                             format_labels(dict(labels, **sample_labels)),
+                                             value))
+
+        with self._lock:
+            endpoints = sorted(self.endpoints.items())
+            metric('http_requests_total', 'counter', 'HTTP requests made, including retries.')
+            for endpoint, stats in endpoints:
+                sample('http_requests_total', stats.requests, endpoint=endpoint)
+            metric('http_request_errors_total', 'counter',
+                   'HTTP requests failing to connect or answered with an error status.')
+            for endpoint, stats in endpoints:
+                sample('http_request_errors_total', stats.errors, endpoint=endpoint)
+            metric('http_response_bytes_total', 'counter', 'Bytes of response bodies read.')
+            for endpoint, stats in endpoints:
+                sample('http_response_bytes_total', stats.bytes, endpoint=endpoint)
+            metric('http_request_duration_seconds', 'histogram', 'HTTP request latency.')
+            for endpoint, stats in endpoints:
+                cumulative = 0
+                for bound, count in zip(self.latency_buckets + ('+Inf',), stats.buckets):
+                    cumulative += count
+                    sample('http_request_duration_seconds_bucket', cumulative,
+                           endpoint=endpoint, le=str(bound))
+                sample('http_request_duration_seconds_sum', repr(stats.seconds),
+                       endpoint=endpoint)
+                sample('http_request_duration_seconds_count', stats.requests,
+                       endpoint=endpoint)
+            metric('stage_seconds_total', 'counter', 'Exclusive seconds spent in each stage.')
+            for name, seconds in sorted(self.stages.items()):
+                sample('stage_seconds_total', repr(seconds), stage=name)
+            for name, value in sorted(self.counts.items()):
+                metric('{}_total'.format(name), 'counter', 'Count of {}.'.format(
+                    name.replace('_', ' ')))
+                sample('{}_total'.format(name), value)
+            metric('run_duration_seconds', 'gauge', 'Seconds since the run started.')
+            sample('run_duration_seconds', repr(time.time() - self.started))
+            metric('run_started_timestamp_seconds', 'gauge', 'Unix time the run started.')
+            sample('run_started_timestamp_seconds', repr(self.started))
+        return '\n'.join(lines) + '\n'
+
+    def format_stages(self):
+        """Return a human readable line of the time spent in each stage."""
+        with self._lock:
+            return ', '.join('{} {:.2f}s'.format(name, seconds)
+                             for name, seconds in sorted(self.stages.items()))
+
+    def write(self, directory, name, **extra):
+        """Write the metrics to `name`.prom and the summary, with `extra`
+        items, to `name`.json in `directory`. Files are replaced atomically
+        so collectors never read a partial file."""
+        os.makedirs(directory, exist_ok=True)
+        write_atomic(os.path.join(directory, name + '.prom'),
+                     self.prometheus({'command': name}))
+        write_atomic(os.path.join(directory, name + '.json'),
+                     json.dumps(self.summary(command=name, **extra), indent=2))
+
+
+class _Stage:
+    __slots__ = ('metrics', 'name', 'stack', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.stack, self.start = self.metrics._enter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics._exit(self.name, self.stack, self.start)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, str(value).replace('\\', r'\\')
+                                           .replace('"', r'\"').replace('\n', r'\n'))
+                          for key, value in sorted(labels.items())) + '}'
+
+
+def write_atomic(path, text):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+_metrics = Metrics()
+
+
+def get_metrics():
+    """Return the metrics of the current process."""
+    return _metrics
+
+
+def stage(name):
+    return _metrics.stage(name)
+
+
+def timed_iter(name, iterable):
+    return _metrics.timed_iter(name, iterable)
+
+
+def count(name, n=1):
+    _metrics.count(name, n)
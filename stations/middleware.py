@@ -0,0 +1,178 @@
+"""Opt-in profiling of web requests.
+
+ProfilingMiddleware times each request and its phases, counts and times
+its SQL queries, logs slow queries and keeps the slowest requests in
+memory for the staff only profiling view. A sample of requests can also be
+run under cProfile, their stats dumped to a directory for pstats or
+snakeviz. Enable it with the PROFILING setting, without which Django drops
+the middleware at startup so it costs nothing.
+
+SQL is recorded with the debug cursor of each connection, which Django
+resets at the start of every request.
+"""
+import cProfile
+from datetime import datetime, timezone
+import heapq
+import itertools
+import logging
+import os
+import random
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+
+LOG = logging.getLogger(__name__)
+
+# Defaults of the PROFILING_* settings
+DEFAULT_SLOWEST = 50
+DEFAULT_SLOW_QUERY = 0.5
+
+# The middleware in use, None if profiling is disabled
+_profiler = None
+
+
+def slowest_requests():
+    """Return the slowest requests recorded, slowest first, or None if
+    profiling is disabled."""
+    if _profiler is None:
+        return None
+    return _profiler.slowest()
+
+
+class ProfilingMiddleware:
+    """Record the SQL, phase times and size of each request.
+
+    Settings:
+
+    PROFILING
+        Enable the middleware.
+    PROFILING_SLOWEST
+        Number of the slowest requests kept.
+    PROFILING_SLOW_QUERY
+        Seconds beyond which a query is logged as slow.
+    PROFILING_SAMPLE_RATE
+        Fraction of requests run under cProfile.
+    PROFILING_DIR
+        Directory the cProfile stats are dumped to.
+    """
+    def __init__(self, get_response):
+        global _profiler
+        if not getattr(settings, 'PROFILING', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.keep = getattr(settings, 'PROFILING_SLOWEST', DEFAULT_SLOWEST)
+        self.slow_query = getattr(settings, 'PROFILING_SLOW_QUERY', DEFAULT_SLOW_QUERY)
+        self.sample_rate = getattr(settings, 'PROFILING_SAMPLE_RATE', 0)
+        self.profile_dir = getattr(settings, 'PROFILING_DIR', None)
+        self._lock = threading.Lock()
+        # Min heap of (seconds, sequence, record) of the slowest requests
+        self._slowest = []
+        self._sequence = itertools.count()
+        self._local = threading.local()
+        _profiler = self
+
+    def __call__(self, request):
+        timings = self._local.timings = {'start': time.perf_counter()}
+        debug_cursors = [(conn, conn.force_debug_cursor) for conn in connections.all()]
+        for conn, _ in debug_cursors:
+            conn.force_debug_cursor = True
+        profile = None
+        if self.sample_rate and random.random() < self.sample_rate:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiler is active in this process
+                profile = None
+        try:
+            response = self.get_response(request)
+        finally:
+            if profile is not None:
+                profile.disable()
+            end = time.perf_counter()
+            for conn, force_debug_cursor in debug_cursors:
+                conn.force_debug_cursor = force_debug_cursor
+        self.record(request, response, timings, end, profile)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        self._local.timings['view'] = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        timings = self._local.timings
+        timings['template'] = time.perf_counter()
+
+        def rendered(response):
+            timings['rendered'] = time.perf_counter()
+        response.add_post_render_callback(rendered)
+        return response
+
+    def record(self, request, response, timings, end, profile):
+        queries = [query for conn in connections.all() for query in conn.queries_log]
+        sql_seconds = sum(float(query['time']) for query in queries)
+        for query in queries:
+            if float(query['time']) >= self.slow_query:
+                LOG.warning('Slow query ({}s) for {}: {}'.format(
+                    query['time'], request.path, query['sql']))
+
+        start = timings['start']
+        view = timings.get('view', end)
+        template = timings.get('template')
+        rendered = timings.get('rendered')
+        # Times before the view, in the view and rendering its template, and
+        # after, of which the SQL time is part
+        phases = {
+            'middleware': view - start,
+            'view': (template or end) - view,
+            'template': rendered - template if rendered else 0,
+            'response': end - rendered if rendered else 0,
+        }
+        seconds = end - start
+        record = {
+            'datetime': datetime.now(timezone.utc).isoformat(),
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'ms': round(seconds * 1000, 3),
+            'sql_count': len(queries),
+            'sql_ms': round(sql_seconds * 1000, 3),
+            'python_ms': round((seconds - sql_seconds) * 1000, 3),
+            'phases_ms': {name: round(value * 1000, 3) for name, value in phases.items()},
+            'bytes': None if response.streaming else len(response.content),
+            'profile': self.dump_profile(profile, request) if profile else None,
+        }
+        response['Server-Timing'] = 'sql;dur={:.3f};desc="{} queries", total;dur={:.3f}'.format(
+            record['sql_ms'], record['sql_count'], record['ms'])
+
+        entry = (seconds, next(self._sequence), record)
+        with self._lock:
+            if len(self._slowest) < self.keep:
+                heapq.heappush(self._slowest, entry)
+            elif self._slowest and seconds > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, entry)
+
+    def dump_profile(self, profile, request):
+        """Dump the stats of `profile` to PROFILING_DIR, returning the path."""
+        if not self.profile_dir:
+            return None
+        name = '{}-{}-{}.prof'.format(
+            datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S.%f'), request.method,
+            re.sub(r'[^A-Za-z0-9]+', '_', request.path).strip('_') or 'index')
+        path = os.path.join(self.profile_dir, name)
+        try:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            profile.dump_stats(path)
+        except OSError as err:
+            LOG.warning('Could not dump profile: {}'.format(err))
+            return None
+        return path
+
+    def slowest(self):
+        with self._lock:
+            entries = sorted(self._slowest, reverse=True)
+        return [record for _, _, record in entries]
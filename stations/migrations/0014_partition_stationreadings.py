@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11 on 2026-10-18 10:00
+from __future__ import unicode_literals
+
+from django.contrib.postgres.indexes import BrinIndex
+from django.db import migrations
+
+import stations.fields
+
+
+# Requires PostgreSQL 11 or later for keys, foreign keys and a default
+# partition on a partitioned table. The station_datetime_readings view
+# depends on the readings table so is recreated around the change.
+
+DROP_VIEW_SQL = 'DROP VIEW IF EXISTS station_datetime_readings;'
+
+CREATE_VIEW_SQL = """
+CREATE VIEW station_datetime_readings AS
+SELECT
+    s.station_ref,
+    s.label,
+    s.town,
+    s.river_name,
+    s.rloiid,
+    s.url,
+    s.typical_low,
+    s.typical_high,
+    st_x(s.point) AS lon,
+    st_y(s.point) AS lat,
+    array_agg(r.datetime::text ORDER BY r.datetime ASC) AS measure_datetimes,
+    array_agg(r.measure ORDER BY r.datetime ASC) AS measures
+FROM stations_stations s
+LEFT JOIN stations_stationreadings r ON s.id = r.station_id
+GROUP BY
+    s.station_ref,
+    s.label,
+    s.town,
+    s.river_name,
+    s.rloiid,
+    s.url,
+    s.typical_low,
+    s.typical_high,
+    lat,
+    lon;
+"""
+
+PARTITION_SQL = """
+ALTER TABLE stations_stationreadings RENAME TO stations_stationreadings_old;
+ALTER INDEX stations_stationreadings_pkey RENAME TO stations_stationreadings_old_pkey;
+ALTER SEQUENCE stations_stationreadings_id_seq RENAME TO stations_stationreadings_old_id_seq;
+
+CREATE TABLE stations_stationreadings (
+    id serial NOT NULL,
+    station_id integer NOT NULL
+        REFERENCES stations_stations (id) DEFERRABLE INITIALLY DEFERRED,
+    measure real NOT NULL,
+    datetime timestamp with time zone NOT NULL,
+    CONSTRAINT stations_stationreadings_pkey PRIMARY KEY (id, datetime),
+    CONSTRAINT stations_stationreadings_station_id_datetime_uniq
+        UNIQUE (station_id, datetime)
+) PARTITION BY RANGE (datetime);
+
+CREATE INDEX stationreadings_dt_brin ON stations_stationreadings USING brin (datetime);
+
+CREATE TABLE stations_stationreadings_default
+    PARTITION OF stations_stationreadings DEFAULT;
+
+INSERT INTO stations_stationreadings (station_id, measure, datetime)
+SELECT DISTINCT ON (station_id, datetime) station_id, measure, datetime
+FROM stations_stationreadings_old
+ORDER BY station_id, datetime, id DESC;
+
+DROP TABLE stations_stationreadings_old;
+"""
+
+UNPARTITION_SQL = """
+ALTER TABLE stations_stationreadings RENAME TO stations_stationreadings_old;
+ALTER INDEX stations_stationreadings_pkey RENAME TO stations_stationreadings_old_pkey;
+ALTER SEQUENCE stations_stationreadings_id_seq RENAME TO stations_stationreadings_old_id_seq;
+
+CREATE TABLE stations_stationreadings (
+    id serial NOT NULL PRIMARY KEY,
+    station_id integer NOT NULL
+        REFERENCES stations_stations (id) DEFERRABLE INITIALLY DEFERRED,
+    measure double precision NOT NULL,
+    datetime timestamp with time zone NOT NULL
+);
+
+CREATE INDEX stations_stationreadings_station_id ON stations_stationreadings (station_id);
+
+INSERT INTO stations_stationreadings (station_id, measure, datetime)
+SELECT station_id, measure, datetime FROM stations_stationreadings_old;
+
+DROP TABLE stations_stationreadings_old;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stations', '0013_auto_20170423_2100'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=DROP_VIEW_SQL + PARTITION_SQL + CREATE_VIEW_SQL,
+            reverse_sql=DROP_VIEW_SQL + UNPARTITION_SQL + CREATE_VIEW_SQL,
+            state_operations=[
+                migrations.AlterField(
+                    model_name='stationreadings',
+                    name='measure',
+                    field=stations.fields.RealField(),
+                ),
+                migrations.AlterUniqueTogether(
+                    name='stationreadings',
+                    unique_together=set([('station', 'datetime')]),
+                ),
+                migrations.AddIndex(
+                    model_name='stationreadings',
+                    index=BrinIndex(fields=['datetime'], name='stationreadings_dt_brin'),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11 on 2026-10-18 11:00
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+import stations.fields
+
+
+# The station summary replaces the station_datetime_readings view, which
+# aggregated every reading of every station on each page load.
+
+DROP_VIEW_SQL = 'DROP VIEW IF EXISTS station_datetime_readings;'
+
+CREATE_VIEW_SQL = """
+CREATE VIEW station_datetime_readings AS
+SELECT
+    s.station_ref,
+    s.label,
+    s.town,
+    s.river_name,
+    s.rloiid,
+    s.url,
+    s.typical_low,
+    s.typical_high,
+    st_x(s.point) AS lon,
+    st_y(s.point) AS lat,
+    array_agg(r.datetime::text ORDER BY r.datetime ASC) AS measure_datetimes,
+    array_agg(r.measure ORDER BY r.datetime ASC) AS measures
+FROM stations_stations s
+LEFT JOIN stations_stationreadings r ON s.id = r.station_id
+GROUP BY
+    s.station_ref,
+    s.label,
+    s.town,
+    s.river_name,
+    s.rloiid,
+    s.url,
+    s.typical_low,
+    s.typical_high,
+    lat,
+    lon;
+"""
+
+POPULATE_SQL = """
+INSERT INTO stations_stationsummary (station_id, measure_datetimes, measures, updated)
+SELECT
+    s.id,
+    coalesce(array_agg(r.datetime ORDER BY r.datetime) FILTER (WHERE r.datetime IS NOT NULL),
+             ARRAY[]::timestamp with time zone[]),
+    coalesce(array_agg(r.measure ORDER BY r.datetime) FILTER (WHERE r.datetime IS NOT NULL),
+             ARRAY[]::real[]),
+    now()
+FROM stations_stations s
+LEFT JOIN LATERAL (
+    SELECT datetime, measure FROM stations_stationreadings
+    WHERE station_id = s.id
+    ORDER BY datetime DESC
+    LIMIT 96
+) r ON true
+GROUP BY s.id;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stations', '0014_partition_stationreadings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StationSummary',
+            fields=[
+                ('station', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='stations.Stations')),
+                ('measure_datetimes', django.contrib.postgres.fields.ArrayField(base_field=models.DateTimeField(), default=list, size=None)),
+                ('measures', django.contrib.postgres.fields.ArrayField(base_field=stations.fields.RealField(), default=list, size=None)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunSQL(
+            sql=DROP_VIEW_SQL + POPULATE_SQL,
+            reverse_sql=CREATE_VIEW_SQL,
+        ),
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11 on 2026-10-18 13:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stations', '0016_stationreadings_covering_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stationsummary',
+            name='percent_typical',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='stationsummary',
+            name='rate',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='stationsummary',
+            name='rolling_mean',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='stationsummary',
+            name='trend',
+            field=models.CharField(max_length=7, null=True),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11 on 2026-10-18 14:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stations', '0017_stationsummary_trends'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='alert',
+            name='active',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='alert',
+            name='triggered',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11 on 2026-10-18 15:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stations', '0018_alert_state'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StationPollState',
+            fields=[
+                ('station', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='stations.Stations')),
+                ('interval', models.FloatField()),
+                ('misses', models.IntegerField(default=0)),
+                ('next_poll', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
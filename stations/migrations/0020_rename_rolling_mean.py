@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11 on 2026-10-18 16:00
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stations', '0019_stationpollstate'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='stationsummary',
+            old_name='rolling_mean',
+            new_name='window_mean',
+        ),
+    ]
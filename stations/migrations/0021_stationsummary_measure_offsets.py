@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11 on 2026-10-18 17:00
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+# Fill the new columns of existing summaries from their datetimes, rather
+# than waiting for the next ingestion to refresh them
+
+FILL_SQL = """
+UPDATE stations_stationsummary SET
+    measure_epoch = extract(epoch FROM measure_datetimes[1])::bigint,
+    measure_offsets = array(
+        SELECT extract(epoch FROM dt - measure_datetimes[1])::integer
+        FROM unnest(measure_datetimes) WITH ORDINALITY AS u(dt, i)
+        ORDER BY i
+    );
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stations', '0020_rename_rolling_mean'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stationsummary',
+            name='measure_epoch',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='stationsummary',
+            name='measure_offsets',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), default=list, size=None),
+        ),
+        migrations.RunSQL(FILL_SQL, reverse_sql=migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11 on 2026-10-18 18:00
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+# The covering index of 0016 has the same keys as the (station_id, datetime)
+# unique constraint, so every reading written maintained two B-trees. The
+# constraint is rebuilt to include measure, covering the readings series
+# query itself, and the index dropped. ON CONFLICT (station_id, datetime)
+# still infers the constraint. Django cannot express INCLUDE columns, so
+# neither is part of the model state.
+
+FORWARD_SQL = """
+ALTER TABLE stations_stationreadings
+    DROP CONSTRAINT stations_stationreadings_station_id_datetime_uniq,
+    ADD CONSTRAINT stations_stationreadings_station_id_datetime_uniq
+        UNIQUE (station_id, datetime) INCLUDE (measure);
+DROP INDEX stationreadings_station_dt_measure;
+"""
+
+REVERSE_SQL = """
+CREATE INDEX stationreadings_station_dt_measure
+    ON stations_stationreadings (station_id, datetime) INCLUDE (measure);
+ALTER TABLE stations_stationreadings
+    DROP CONSTRAINT stations_stationreadings_station_id_datetime_uniq,
+    ADD CONSTRAINT stations_stationreadings_station_id_datetime_uniq
+        UNIQUE (station_id, datetime);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stations', '0021_stationsummary_measure_offsets'),
+    ]
+
+    operations = [
+        migrations.RunSQL(FORWARD_SQL, reverse_sql=REVERSE_SQL),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11 on 2026-10-18 19:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stations', '0022_stationreadings_covering_constraint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stationsummary',
+            name='rolling_mean',
+            field=models.FloatField(null=True),
+        ),
+    ]
@@ -1,7 +1,11 @@
 from django.contrib.gis.db import models
 from django.contrib.auth.models import User
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import BrinIndex
 from django.core.exceptions import ValidationError
 
+from stations.fields import RealField
+
 
 class Stations(models.Model):
     station_ref = models.CharField(max_length=50, unique=True)
@@ -33,12 +37,46 @@ class ReadingConditionTypes(models.Model):
 
 
 class StationReadings(models.Model):
+    # The table is partitioned by month on datetime, see the
+    # partitionreadings management command
     station = models.ForeignKey(Stations, on_delete=models.CASCADE)
-    measure = models.FloatField()
+    measure = RealField()
     # units = models.ForeignKey(Units)
     datetime = models.DateTimeField()
     # reading_type = models.ForeignKey(ReadingTypes)
 
+    class Meta:
+        unique_together = ('station', 'datetime')
+        indexes = [BrinIndex(fields=['datetime'], name='stationreadings_dt_brin')]
+
+
+class StationSummary(models.Model):
+    # The most recent readings of each station, refreshed by
+    # stations.summary.refresh_station_summary after each ingestion
+    station = models.OneToOneField(Stations, on_delete=models.CASCADE, primary_key=True)
+    measure_datetimes = ArrayField(models.DateTimeField(), default=list)
+    # Epoch seconds of the first reading and seconds of each after it
+    measure_epoch = models.BigIntegerField(null=True)
+    measure_offsets = ArrayField(models.IntegerField(), default=list)
+    measures = ArrayField(RealField(), default=list)
+    updated = models.DateTimeField(auto_now=True)
+    # Level trend over recent readings, see stations.trends
+    rate = models.FloatField(null=True)
+    window_mean = models.FloatField(null=True)
+    rolling_mean = models.FloatField(null=True)
+    percent_typical = models.FloatField(null=True)
+    trend = models.CharField(max_length=7, null=True)
+
+
+class StationPollState(models.Model):
+    # When each station is next due a reading, see stations.polling
+    station = models.OneToOneField(Stations, on_delete=models.CASCADE, primary_key=True)
+    # Learned reporting interval in seconds
+    interval = models.FloatField()
+    # Consecutive polls without a new reading
+    misses = models.IntegerField(default=0)
+    next_poll = models.DateTimeField(db_index=True)
+
 
 class Alert(models.Model):
     user_id = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -47,6 +85,10 @@ class Alert(models.Model):
     reading_condition_type_id = models.ForeignKey(ReadingConditionTypes)
     reading_min = models.FloatField(null=True)
     reading_max = models.FloatField(null=True)
+    active = models.BooleanField(default=True)
+    # Set while readings are within range so an alert fires once on
+    # entering it, see stations.alerts
+    triggered = models.BooleanField(default=False)
 
     def clean(self):
         if self.reading_min is None and self.reading_max is None:
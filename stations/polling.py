@@ -0,0 +1,158 @@
+"""Adaptive polling of station readings.
+
+Each station's reporting interval is learned from the gaps between its
+stored readings, so a station is only polled once a new reading is due.
+Stations that have not reported when expected, or whose requests failed,
+are backed off exponentially, stations with a rising level less so. Poll
+state is held in the StationPollState table.
+"""
+from datetime import timedelta
+
+from django.db import connection
+from psycopg2.extras import execute_values
+
+from stations.trends import RISING
+
+
+# Interval assumed for stations without enough readings to learn from
+DEFAULT_INTERVAL = 15 * 60
+# Bounds of the learned interval, in seconds
+MIN_INTERVAL = 5 * 60
+MAX_INTERVAL = 24 * 60 * 60
+# Hours of readings the interval is learned from
+LEARN_WINDOW_HOURS = 48
+# Allowance for the EA publishing a reading after it was taken
+PUBLISH_DELAY = 2 * 60
+# Rising stations are retried this many times as often after a miss
+RISING_SPEEDUP = 2
+# Delay before polling again after a miss, doubling with each miss
+RETRY_DELAY = 5 * 60
+MAX_BACKOFF = 6 * 60 * 60
+
+DUE_SQL = '''
+select s.id from stations_stations s
+left join stations_stationpollstate p on p.station_id = s.id
+where p.next_poll is null or p.next_poll <= %s;
+'''
+
+LEARN_SQL = '''
+select station_id, percentile_cont(0.5) within group (order by gap)
+from (
+    select station_id,
+    extract(epoch from datetime - lag(datetime) over (partition by station_id order by datetime)) as gap
+    from stations_stationreadings
+    where station_id = any(%s) and datetime >= now() - %s * interval '1 hour'
+) as gaps
+where gap > 0
+group by station_id;
+'''
+
+STATE_SQL = '''
+select s.id, p.interval, p.misses, sm.trend,
+sm.measure_datetimes[array_upper(sm.measure_datetimes, 1)]
+from stations_stations s
+left join stations_stationpollstate p on p.station_id = s.id
+left join stations_stationsummary sm on sm.station_id = s.id
+where s.id = any(%s);
+'''
+
+UPSERT_SQL = '''
+insert into stations_stationpollstate (station_id, interval, misses, next_poll)
+values %s
+on conflict (station_id) do update set
+interval = excluded.interval, misses = excluded.misses, next_poll = excluded.next_poll;
+'''
+
+
+def reading_due(interval, last_reading):
+    """Return the datetime the reading after `last_reading` is expected to
+    be published, for a station reporting every `interval` seconds."""
+    return last_reading + timedelta(seconds=interval + PUBLISH_DELAY)
+
+
+def plan_next_poll(now, interval, last_reading, misses, rising=False):
+    """Return the datetime a station should next be polled.
+
+    A station is polled when its next reading is due. Once it has missed,
+    it is retried with a backoff, shortened for a rising station so a late
+    reading of a rising level is picked up sooner.
+
+    now
+        Datetime of the poll just made.
+    interval
+        Reporting interval of the station in seconds.
+    last_reading
+        Datetime of the newest reading of the station, or None.
+    misses
+        Number of consecutive polls without a new reading, including
+        failed requests.
+    rising
+        Whether the level of the station is rising.
+    """
+    if misses or last_reading is None:
+        delay = min(RETRY_DELAY * 2 ** max(misses - 1, 0), MAX_BACKOFF)
+        if rising:
+            delay /= RISING_SPEEDUP
+        return now + timedelta(seconds=delay)
+    return max(reading_due(interval, last_reading), now + timedelta(seconds=MIN_INTERVAL))
+
+
+def poll_state(now, interval, last_reading, misses, updated, rising=False):
+    """Return the consecutive misses and next poll datetime of a station
+    polled at `now`, given whether the poll `updated` it with new readings.
+
+    A poll without new readings only counts as a miss once the next reading
+    was due, so polling early does not back a station off. Other arguments
+    are as for plan_next_poll, with `misses` those before this poll.
+    """
+    if updated:
+        misses = 0
+    elif last_reading is None or now >= reading_due(interval, last_reading):
+        misses += 1
+    return misses, plan_next_poll(now, interval, last_reading, misses, rising)
+
+
+def clamp_interval(interval):
+    return min(max(interval, MIN_INTERVAL), MAX_INTERVAL)
+
+
+def due_station_ids(now):
+    """Return the set of ids of stations due to be polled at `now`."""
+    with connection.cursor() as cursor:
+        cursor.execute(DUE_SQL, [now])
+        return {pk for pk, in cursor.fetchall()}
+
+
+def learn_intervals(station_ids, window_hours=LEARN_WINDOW_HOURS):
+    """Return a dict of station id to the median gap in seconds between its
+    readings in the last `window_hours`."""
+    if not station_ids:
+        return {}
+    with connection.cursor() as cursor:
+        cursor.execute(LEARN_SQL, [list(station_ids), window_hours])
+        return dict(cursor.fetchall())
+
+
+def update_poll_states(polled_ids, updated_ids, now):
+    """Schedule the next poll of stations polled at `now`.
+
+    polled_ids
+        Ids of the stations polled.
+    updated_ids
+        Ids of the polled stations that had new readings, whose interval is
+        relearned. The others count a miss if a reading was due.
+    """
+    if not polled_ids:
+        return
+    intervals = learn_intervals(updated_ids)
+    with connection.cursor() as cursor:
+        cursor.execute(STATE_SQL, [list(polled_ids)])
+        states = cursor.fetchall()
+    rows = []
+    for station_id, interval, misses, trend, last_reading in states:
+        interval = clamp_interval(intervals.get(station_id, interval or DEFAULT_INTERVAL))
+        misses, next_poll = poll_state(now, interval, last_reading, misses or 0,
+                                       station_id in updated_ids, rising=trend == RISING)
+        rows.append((station_id, interval, misses, next_poll))
+    with connection.cursor() as cursor:
+        execute_values(cursor.cursor, UPSERT_SQL, rows, page_size=len(rows))
@@ -0,0 +1,110 @@
+"""Compact representation of readings during ingestion.
+
+Readings are parsed straight into a ReadingBatch of typed arrays of station
+id, epoch seconds and measure rather than into datetimes and model
+instances, and are loaded from it with stations.loader. The EA's datetimes
+all share one fixed format, so they are split into their day and time of
+day, each looked up from a cache of those already seen, instead of being
+parsed with strptime.
+"""
+from array import array
+from datetime import date
+
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# Days cached by parse_datetime before the cache is cleared
+MAX_CACHED_DAYS = 10000
+
+# Epoch seconds of each 'YYYY-MM-DDT' day and seconds into the day of each
+# 'HH:MM:SSZ' time seen, readings being taken at a few times of day
+_day_seconds = {}
+_time_seconds = {}
+
+
+def _parse_day(text):
+    if len(text) != 11 or text[4] != '-' or text[7] != '-' or text[10] != 'T':
+        raise ValueError('Unsupported date {!r}'.format(text))
+    seconds = (date(int(text[0:4]), int(text[5:7]), int(text[8:10])).toordinal()
+               - EPOCH_ORDINAL) * 86400
+    if len(_day_seconds) >= MAX_CACHED_DAYS:
+        _day_seconds.clear()
+    _day_seconds[text] = seconds
+    return seconds
+
+
+def _parse_time(text):
+    if len(text) != 9 or text[2] != ':' or text[5] != ':' or text[8] != 'Z':
+        raise ValueError('Unsupported time {!r}'.format(text))
+    hours, minutes, seconds = int(text[0:2]), int(text[3:5]), int(text[6:8])
+    if not (0 <= hours < 24 and 0 <= minutes < 60 and 0 <= seconds < 60):
+        raise ValueError('Invalid time {!r}'.format(text))
+    seconds += hours * 3600 + minutes * 60
+    _time_seconds[text] = seconds
+    return seconds
+
+
+def parse_datetime(text):
+    """Return the epoch seconds of a UTC datetime formatted as the EA does,
+    YYYY-MM-DDTHH:MM:SSZ. Raises ValueError for any other format."""
+    if len(text) != 20:
+        raise ValueError('Unsupported datetime {!r}'.format(text))
+    day_seconds = _day_seconds.get(text[:11])
+    if day_seconds is None:
+        day_seconds = _parse_day(text[:11])
+    time_seconds = _time_seconds.get(text[11:])
+    if time_seconds is None:
+        time_seconds = _parse_time(text[11:])
+    return day_seconds + time_seconds
+
+
+class ReadingBatch:
+    """Readings held as columns of station ids, epoch seconds and single
+    precision measures, the type they are stored as."""
+    __slots__ = ('station_ids', 'epochs', 'measures')
+
+    def __init__(self):
+        self.station_ids = array('i')
+        self.epochs = array('q')
+        self.measures = array('f')
+
+    def __len__(self):
+        return len(self.epochs)
+
+    def append(self, station_id, epoch, measure):
+        self.station_ids.append(station_id)
+        self.epochs.append(epoch)
+        self.measures.append(measure)
+
+    def extend(self, station_id, items):
+        """Add the readings of EA reading `items` of station `station_id`,
+        skipping malformed items. Returns the number skipped."""
+        skipped = 0
+        append_station_id = self.station_ids.append
+        append_epoch = self.epochs.append
+        append_measure = self.measures.append
+        for item in items:
+            try:
+                epoch = parse_datetime(item['dateTime'])
+                measure = float(item['value'])
+            except (KeyError, TypeError, ValueError):
+                skipped += 1
+                continue
+            append_station_id(station_id)
+            append_epoch(epoch)
+            append_measure(measure)
+        return skipped
+
+    def first_epochs(self):
+        """Return a dict of each station id to the epoch seconds of its
+        oldest reading."""
+        first = {}
+        for station_id, epoch in zip(self.station_ids, self.epochs):
+            if epoch < first.get(station_id, epoch + 1):
+                first[station_id] = epoch
+        return first
+
+    def rows(self):
+        """Return an iterator of (station id, epoch, measure) rows, as loaded
+        by stations.loader.load_readings with epochs=True."""
+        return zip(self.station_ids, self.epochs, self.measures)
@@ -0,0 +1,119 @@
+"""A minimal scheduler of periodic jobs run one at a time in one process.
+
+Used by the riverscoped management command so ingestion runs in a long
+lived process, keeping its HTTP pools and database connection warm between
+runs rather than paying for them in each cron invoked command.
+"""
+import logging
+import threading
+import time
+
+
+LOG = logging.getLogger(__name__)
+
+
+class Job:
+    """A function `func` run every `interval` seconds.
+
+    The status of the job is kept for reporting: the duration of its last
+    run, the lag between when it was due and when it started, and counts
+    of runs and failures.
+    """
+    def __init__(self, name, interval, func):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.next_run = None
+        self.last_started = None
+        self.last_duration = None
+        self.last_lag = None
+        self.last_error = None
+        self.runs = 0
+        self.failures = 0
+
+    def status(self):
+        return {
+            'interval': self.interval,
+            'next_run': self.next_run,
+            'last_started': self.last_started,
+            'last_duration': self.last_duration,
+            'last_lag': self.last_lag,
+            'last_error': self.last_error,
+            'runs': self.runs,
+            'failures': self.failures,
+        }
+
+
+class Scheduler:
+    """Run `jobs` when due until stopped.
+
+    All jobs are due when the scheduler starts. A job's next run is kept on
+    its interval from the previous, unless it has fallen a whole interval
+    behind when missed runs are skipped.
+
+    before_job, after_job
+        Optional functions called with each job before and after it runs.
+    clock
+        Function returning the time in seconds, for testing.
+    """
+    def __init__(self, jobs, before_job=None, after_job=None, clock=time.time):
+        self.jobs = list(jobs)
+        self.before_job = before_job
+        self.after_job = after_job
+        self.clock = clock
+        self._stopped = threading.Event()
+        now = self.clock()
+        for job in self.jobs:
+            job.next_run = now
+
+    def stop(self):
+        """Stop once the running job, if any, has finished. Safe to call from
+        a signal handler."""
+        self._stopped.set()
+
+    @property
+    def stopped(self):
+        return self._stopped.is_set()
+
+    def run_job(self, job):
+        started = self.clock()
+        job.last_lag = max(0.0, started - job.next_run)
+        job.last_started = started
+        if self.before_job:
+            self.before_job(job)
+        try:
+            job.func()
+            job.last_error = None
+        except Exception as err:
+            LOG.exception('Job {} failed'.format(job.name))
+            job.failures += 1
+            job.last_error = str(err)
+        finished = self.clock()
+        job.runs += 1
+        job.last_duration = finished - started
+        job.next_run += job.interval
+        if job.next_run <= finished:
+            job.next_run = finished + job.interval
+        if self.after_job:
+            self.after_job(job)
+
+    def run_pending(self):
+        """Run the jobs that are due in the order they fell due. Returns the
+        number of jobs run."""
+        now = self.clock()
+        due = sorted((job for job in self.jobs if job.next_run <= now),
+                     key=lambda job: job.next_run)
+        count = 0
+        for job in due:
+            if self.stopped:
+                break
+            self.run_job(job)
+            count += 1
+        return count
+
+    def run_forever(self):
+        while not self.stopped:
+            self.run_pending()
+            wait = min(job.next_run for job in self.jobs) - self.clock()
+            if wait > 0:
+                self._stopped.wait(wait)
@@ -0,0 +1,62 @@
+"""Downsampled series of a station's readings for charts.
+
+Readings over a time range are grouped in SQL into buckets of equal
+duration counted from the start of the range, so a range is covered by at
+most the number of points asked for, and the minimum, maximum and mean of
+each bucket are returned.
+"""
+import math
+
+from django.db import connection
+
+
+STATION_SERIES_SQL = '''
+select
+min(r.datetime) as datetime,
+min(r.measure) as min,
+max(r.measure) as max,
+avg(r.measure) as mean
+from stations_stationreadings r
+where r.station_id = %(station_id)s
+and r.datetime >= %(start)s
+and r.datetime < %(end)s
+group by floor((extract(epoch from r.datetime) - %(start_epoch)s) / %(bucket)s)
+order by 1;
+'''
+
+
+STATION_SQL = '''
+select id, station_ref, typical_low, typical_high
+from stations_stations
+where station_ref = %s;
+'''
+
+
+def get_station(station_ref):
+    """Return a dict of the id, reference and typical range of the station
+    `station_ref`, or None if there is no such station."""
+    with connection.cursor() as cursor:
+        cursor.execute(STATION_SQL, [station_ref])
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    return dict(zip(('id', 'station_ref', 'typical_low', 'typical_high'), row))
+
+
+def get_station_series(station_id, start, end, points):
+    """Return readings of a station between `start` and `end` downsampled
+    to at most `points` buckets of equal duration, with the minimum, maximum
+    and mean reading of each. Buckets without readings are omitted."""
+    bucket = max(math.ceil((end - start).total_seconds() / points), 1)
+    with connection.cursor() as cursor:
+        cursor.execute(STATION_SERIES_SQL, {
+            'station_id': station_id, 'start': start, 'end': end,
+            'start_epoch': start.timestamp(), 'bucket': bucket})
+        rows = cursor.fetchall()
+    return {
+        'bucket_seconds': bucket,
+        'datetimes': [int(row[0].timestamp()) for row in rows],
+        'min': [row[1] for row in rows],
+        'max': [row[2] for row in rows],
+        'mean': [round(row[3], 3) for row in rows],
+    }
@@ -0,0 +1,69 @@
+"""Maintenance of the StationSummary table read by the index page.
+
+The summary holds the most recent readings of each station as arrays, so
+page loads read one row per station rather than aggregating the readings
+table. Rows are upserted, so a refresh never blocks readers and can be
+limited to the stations whose readings changed. The datetimes of the
+readings are also held as the epoch seconds of the first and the whole
+seconds of each after it, as served to clients, so they are computed once
+per refresh rather than on each request.
+"""
+from django.db import connection
+
+from stations.models import Stations, StationReadings, StationSummary
+
+
+# The number of most recent readings held per station, a day of 15 minute
+# readings
+SUMMARY_READINGS = 96
+
+REFRESH_SQL = """
+INSERT INTO {summary} (station_id, measure_datetimes, measure_epoch, measure_offsets,
+                       measures, updated)
+SELECT
+    s.id,
+    coalesce(array_agg(r.datetime ORDER BY r.datetime) FILTER (WHERE r.datetime IS NOT NULL),
+             ARRAY[]::timestamp with time zone[]),
+    extract(epoch FROM min(r.datetime))::bigint,
+    coalesce(array_agg(extract(epoch FROM r.datetime - r.first_datetime)::integer
+                       ORDER BY r.datetime) FILTER (WHERE r.datetime IS NOT NULL),
+             ARRAY[]::integer[]),
+    coalesce(array_agg(r.measure ORDER BY r.datetime) FILTER (WHERE r.datetime IS NOT NULL),
+             ARRAY[]::real[]),
+    now()
+FROM {stations} s
+LEFT JOIN LATERAL (
+    SELECT datetime, measure, min(datetime) OVER () AS first_datetime
+    FROM (
+        SELECT datetime, measure FROM {readings}
+        WHERE station_id = s.id
+        ORDER BY datetime DESC
+        LIMIT %(limit)s
+    ) latest
+) r ON true
+{where}
+GROUP BY s.id
+ON CONFLICT (station_id) DO UPDATE SET
+    measure_datetimes = EXCLUDED.measure_datetimes,
+    measure_epoch = EXCLUDED.measure_epoch,
+    measure_offsets = EXCLUDED.measure_offsets,
+    measures = EXCLUDED.measures,
+    updated = EXCLUDED.updated
+"""
+
+
+def refresh_station_summary(station_ids=None, limit=SUMMARY_READINGS):
+    """Refresh the summary of stations `station_ids`, or of all stations if
+    None. Returns the number of summary rows written."""
+    if station_ids is not None:
+        station_ids = list(station_ids)
+        if not station_ids:
+            return 0
+    sql = REFRESH_SQL.format(
+        summary=StationSummary._meta.db_table,
+        stations=Stations._meta.db_table,
+        readings=StationReadings._meta.db_table,
+        where='WHERE s.id = ANY(%(station_ids)s)' if station_ids is not None else '')
+    with connection.cursor() as cursor:
+        cursor.execute(sql, {'limit': limit, 'station_ids': station_ids})
+        return cursor.rowcount
@@ -0,0 +1,191 @@
+"""Level trends of every station, computed in one vectorised pass.
+
+Recent readings of all stations are loaded as flat NumPy arrays sorted by
+station then time, so per station sums are taken with `np.add.reduceat`
+over the station boundaries instead of looping over stations in Python.
+Rolling means are taken from the differences of one cumulative sum over all
+readings, each window kept within its station.
+"""
+import numpy as np
+from django.db import connection
+from psycopg2.extras import execute_values
+
+
+# Hours of readings used to compute trends
+TREND_WINDOW_HOURS = 6
+# Rates of change, in metres per hour, within this of zero are steady
+STEADY_RATE = 0.01
+# Readings averaged by the rolling mean, an hour of 15 minute readings
+ROLLING_READINGS = 4
+
+RISING = 'rising'
+STEADY = 'steady'
+FALLING = 'falling'
+
+READINGS_SQL = '''
+select station_id, extract(epoch from datetime), measure
+from stations_stationreadings
+where datetime >= now() - %s * interval '1 hour'
+order by station_id, datetime;
+'''
+
+TYPICAL_RANGES_SQL = '''
+select id, typical_low, typical_high from stations_stations;
+'''
+
+UPDATE_SQL = '''
+update stations_stationsummary as sm set
+rate = v.rate,
+window_mean = v.window_mean,
+rolling_mean = v.rolling_mean,
+percent_typical = v.percent_typical,
+trend = v.trend
+from (values %s) as v (station_id, rate, window_mean, rolling_mean, percent_typical, trend)
+where sm.station_id = v.station_id;
+'''
+
+CLEAR_SQL = '''
+update stations_stationsummary set
+rate = null, window_mean = null, rolling_mean = null, percent_typical = null, trend = null
+where trend is not null and station_id <> all(%s);
+'''
+
+
+def load_readings(window_hours=TREND_WINDOW_HOURS):
+    """Return arrays of station id, epoch seconds and measure of the readings
+    in the last `window_hours`, sorted by station id then time."""
+    with connection.cursor() as cursor:
+        cursor.execute(READINGS_SQL, [window_hours])
+        rows = np.array(cursor.fetchall(), dtype=np.float64).reshape(-1, 3)
+    return rows[:, 0].astype(np.int64), rows[:, 1], rows[:, 2]
+
+
+def load_typical_ranges():
+    """Return a dict of station id to its (typical_low, typical_high)."""
+    with connection.cursor() as cursor:
+        cursor.execute(TYPICAL_RANGES_SQL)
+        return {pk: (low, high) for pk, low, high in cursor.fetchall()}
+
+
+def station_starts(station_ids):
+    """Return the index of the first reading of each station in
+    `station_ids`, an array sorted by station id."""
+    return np.flatnonzero(np.r_[True, station_ids[1:] != station_ids[:-1]])
+
+
+def rolling_mean(station_ids, measures, readings=ROLLING_READINGS):
+    """Return the trailing mean at each reading of it and the `readings` - 1
+    readings of its station before it, or as many as there are.
+
+    station_ids, measures
+        Arrays of readings sorted by station id then time.
+    """
+    starts = station_starts(station_ids)
+    counts = np.diff(np.r_[starts, len(station_ids)])
+    # Position of each reading within its station, limiting its window
+    positions = np.arange(len(station_ids)) - np.repeat(starts, counts)
+    window = np.minimum(positions + 1, readings)
+    sums = np.r_[0.0, np.cumsum(measures)]
+    ends = np.arange(1, len(station_ids) + 1)
+    return (sums[ends] - sums[ends - window]) / window
+
+
+def compute_trends(station_ids, epochs, measures, typical_ranges=None):
+    """Return the trend of each station in arrays sorted by station id.
+
+    station_ids, epochs, measures
+        Arrays of readings sorted by station id then time.
+    typical_ranges
+        A dict of station id to its (typical_low, typical_high), either of
+        which may be None.
+
+    Returns a dict of arrays:
+        station_ids: Each station with readings.
+        rate: Least squares rate of change in metres per hour, NaN for
+            stations with a single reading.
+        window_mean: Mean of the readings over the whole window.
+        rolling_mean: Mean of the latest ROLLING_READINGS readings.
+        latest: Latest reading.
+        percent_typical: Latest reading as a percentage of the typical
+            range, 0 at the typical low and 100 at the typical high.
+        trend: RISING, STEADY, FALLING or None if the rate is unknown.
+    """
+    if not len(station_ids):
+        empty = np.array([])
+        return {'station_ids': empty.astype(np.int64), 'rate': empty,
+                'window_mean': empty, 'rolling_mean': empty, 'latest': empty,
+                'percent_typical': empty, 'trend': np.array([], dtype=object)}
+
+    starts = station_starts(station_ids)
+    counts = np.diff(np.r_[starts, len(station_ids)])
+    ends = starts + counts - 1
+    unique_ids = station_ids[starts]
+
+    # Hours relative to each station's latest reading, keeping the sums small
+    hours = (epochs - np.repeat(epochs[ends], counts)) / 3600
+    n = counts.astype(np.float64)
+    sum_t = np.add.reduceat(hours, starts)
+    sum_v = np.add.reduceat(measures, starts)
+    sum_tt = np.add.reduceat(hours * hours, starts)
+    sum_tv = np.add.reduceat(hours * measures, starts)
+
+    denominator = n * sum_tt - sum_t * sum_t
+    rate = np.full(len(starts), np.nan)
+    np.divide(n * sum_tv - sum_t * sum_v, denominator, out=rate, where=denominator > 0)
+
+    latest = measures[ends]
+    percent_typical = np.full(len(starts), np.nan)
+    if typical_ranges:
+        typical = np.array([typical_ranges.get(pk, (None, None)) for pk in unique_ids.tolist()],
+                           dtype=np.float64).reshape(-1, 2)
+        low = typical[:, 0]
+        typical_range = typical[:, 1] - low
+        np.divide((latest - low) * 100, typical_range, out=percent_typical,
+                  where=typical_range > 0)
+
+    trend = np.full(len(starts), None, dtype=object)
+    trend[rate > STEADY_RATE] = RISING
+    trend[rate < -STEADY_RATE] = FALLING
+    trend[np.abs(rate) <= STEADY_RATE] = STEADY
+
+    return {
+        'station_ids': unique_ids,
+        'rate': rate,
+        'window_mean': sum_v / n,
+        'rolling_mean': rolling_mean(station_ids, measures)[ends],
+        'latest': latest,
+        'percent_typical': percent_typical,
+        'trend': trend,
+    }
+
+
+def _none_if_nan(values, decimals):
+    return [None if np.isnan(v) else v for v in np.round(values, decimals).tolist()]
+
+
+def store_trends(trends):
+    """Write `trends` to the station summaries, clearing the trend of
+    stations without recent readings."""
+    station_ids = trends['station_ids'].tolist()
+    rows = list(zip(station_ids,
+                    _none_if_nan(trends['rate'], 4),
+                    _none_if_nan(trends['window_mean'], 3),
+                    _none_if_nan(trends['rolling_mean'], 3),
+                    _none_if_nan(trends['percent_typical'], 1),
+                    trends['trend'].tolist()))
+    with connection.cursor() as cursor:
+        if rows:
+            execute_values(cursor.cursor, UPDATE_SQL, rows,
+                           template='(%s, %s::double precision, %s::double precision, '
+                           '%s::double precision, %s::double precision, %s)',
+                           page_size=len(rows))
+        cursor.execute(CLEAR_SQL, [station_ids])
+
+
+def update_trends(window_hours=TREND_WINDOW_HOURS):
+    """Compute and store the trends of all stations. Returns the number of
+    stations with readings in the window."""
+    trends = compute_trends(*load_readings(window_hours),
+                            typical_ranges=load_typical_ranges())
+    store_trends(trends)
+    return len(trends['station_ids'])
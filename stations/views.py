@@ -1,12 +1,24 @@
 import datetime
 import json
+import math
 
+from django.http import (Http404, HttpResponse, HttpResponseBadRequest,
+                         HttpResponseNotModified, JsonResponse)
+from django.contrib.admin.views.decorators import staff_member_required
 from django.shortcuts import render
-from django.shortcuts import render_to_response
 from django.db import connection
 from django.core.serializers import serialize
+from django.template.response import TemplateResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.dateparse import parse_date, parse_datetime
+from django.views.decorators.cache import cache_control
+import redis
 
-from stations.models import Stations
+from stations import geocache
+from stations.middleware import slowest_requests
+from stations.series import get_station, get_station_series
 
 
 def dictfetchall(cursor):
@@ -18,29 +30,66 @@ def dictfetchall(cursor):
     ]
 
 
-def get_station_readings():
-    with connection.cursor() as cursor:
-        cursor.execute('select * from station_datetime_readings;')
-        return dictfetchall(cursor)
+STATION_READINGS_SQL = '''
+select
+s.station_ref,
+s.label,
+s.town,
+s.river_name,
+s.rloiid,
+s.url,
+s.typical_low,
+s.typical_high,
+st_x(s.point) as lon,
+st_y(s.point) as lat
+{readings}
+from stations_stations s
+left join stations_stationsummary sm on sm.station_id = s.id
+{where}
+order by s.id
+{limit};
+'''
+
+# Recent readings as the epoch seconds of the first, the seconds of each
+# after it and their measures, as stored by stations.summary
+READINGS_COLUMNS = ''',
+sm.measure_epoch,
+sm.measure_offsets,
+sm.measures'''
+
+# Stations returned by the viewport query at most
+MAX_FEATURES = 2000
+# Views zoomed out further than this get station metadata without readings
+READINGS_MIN_ZOOM = 9
+# Kilometres per degree of latitude
+KM_PER_DEGREE = 111.32
 
 
-def fmt_datetime_in_dict(indictlist):
-    outdictlist = []
-    for d in indictlist:
-        dtlist = d.get('measure_datetimes')
-        if dtlist:
-            outdtlist = []
-            for dt in dtlist:
-                if dt:
-                    newd = datetime.datetime.strptime(dt, '%Y-%m-%d %H:%M:%S+00').strftime('%H:%M %a %w %b')
-                    outdtlist.append(newd)
-            d['measure_datetimes'] = outdtlist
-        outdictlist.append(d)
-    return outdictlist
+def get_station_readings(where='', params=(), limit=None, readings=True):
+    """Return a dict per station of its metadata and recent readings.
+
+    where
+        An SQL where clause filtering the stations, aliased `s`, with
+        placeholders for `params`.
+    limit
+        The maximum number of stations returned.
+    readings
+        If false, omit the recent readings of each station. Otherwise they
+        are given as `measure_epoch`, the epoch seconds of the first
+        reading, `measure_offsets`, the seconds of each reading after it,
+        and `measures`.
+    """
+    sql = STATION_READINGS_SQL.format(
+        readings=READINGS_COLUMNS if readings else '',
+        where=where,
+        limit='limit %s' if limit else '')
+    params = list(params) + ([limit] if limit else [])
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return dictfetchall(cursor)
 
 
 def station_readings_to_geojson(data):
-    newdata = fmt_datetime_in_dict(data)
     geojson = {
     'type': 'FeatureCollection',
     'features': [
@@ -51,12 +100,252 @@ def station_readings_to_geojson(data):
             'coordinates': [d['lon'], d['lat']],
             },
         'properties' : d,
-        } for d in newdata]
+        } for d in data]
     }
     return geojson
 
 
-def index(request):
-
+def build_station_geojson():
     station_readings = station_readings_to_geojson(get_station_readings())
-    return render_to_response('index.html', {'stations': json.dumps(station_readings)})
+    return json.dumps(station_readings).encode('utf-8')
+
+
+def accepts_gzip(request):
+    return 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+
+
+def ingestion_etag(name, compressed=False):
+    """Return a strong ETag for `name` derived from the last ingestion, or
+    None if the ingestion version is unavailable."""
+    try:
+        version, updated = geocache.get_version()
+    except redis.RedisError:
+        return None
+    return '"{}-{}-{}{}"'.format(name, version, int(updated), '-gz' if compressed else '')
+
+
+def cached_data_response(request, name, build, content_type):
+    """Return cached data `name` with an ETag, compressed if accepted.
+
+    Clients sending the current ETag in If-None-Match get a 304 response.
+    """
+    compressed = accepts_gzip(request)
+    etag = ingestion_etag(name, compressed)
+    if etag and etag in request.META.get('HTTP_IF_NONE_MATCH', ''):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(geocache.cached(name, build, compressed=compressed),
+                                content_type=content_type)
+        if compressed:
+            response['Content-Encoding'] = 'gzip'
+    if etag:
+        response['ETag'] = etag
+    # Always revalidate, the ETag changes with each ingestion
+    patch_cache_control(response, no_cache=True)
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+# stations_geojson and stations_within are not used by the map page, which
+# draws stations from tiles, and are kept as a public API
+
+
+def stations_geojson(request):
+    return cached_data_response(request, 'stations.geojson', build_station_geojson,
+                                'application/geo+json')
+
+
+def parse_floats(value, count):
+    values = [float(v) for v in value.split(',')]
+    if len(values) != count:
+        raise ValueError('Expected {} numbers'.format(count))
+    if not all(math.isfinite(v) for v in values):
+        raise ValueError('Expected finite numbers')
+    return values
+
+
+def stations_within(request):
+    """Return GeoJSON of the stations within a viewport.
+
+    The viewport is given either as `bbox=minlon,minlat,maxlon,maxlat` or as
+    `lon`, `lat` and `radius` in kilometres, answering 400 Bad Request for
+    values that are not finite. The corners of a bbox may be given in either
+    order. Stations are matched using the spatial index on their point. At
+    most `limit` stations, capped to MAX_FEATURES, are returned, and their
+    recent readings only at `zoom` levels of READINGS_MIN_ZOOM or more.
+    """
+    try:
+        if 'bbox' in request.GET:
+            minlon, minlat, maxlon, maxlat = parse_floats(request.GET['bbox'], 4)
+            where = 'where s.point && st_makeenvelope(%s, %s, %s, %s, 4326)'
+            params = [min(minlon, maxlon), min(minlat, maxlat),
+                      max(minlon, maxlon), max(minlat, maxlat)]
+        else:
+            lon, lat, radius = (float(request.GET[k]) for k in ('lon', 'lat', 'radius'))
+            if not all(math.isfinite(v) for v in (lon, lat, radius)) or radius < 0:
+                raise ValueError('Expected finite numbers and a positive radius')
+            # Match the bounding box on the index, then the exact distance
+            dlat = radius / KM_PER_DEGREE
+            dlon = dlat / max(math.cos(math.radians(lat)), 0.01)
+            where = ('where s.point && st_makeenvelope(%s, %s, %s, %s, 4326) '
+                     'and st_distancesphere(s.point, st_setsrid(st_makepoint(%s, %s), 4326)) <= %s')
+            params = [lon - dlon, lat - dlat, lon + dlon, lat + dlat, lon, lat, radius * 1000]
+        zoom = int(request.GET.get('zoom', READINGS_MIN_ZOOM))
+        limit = max(1, min(int(request.GET.get('limit', MAX_FEATURES)), MAX_FEATURES))
+    except (KeyError, ValueError) as err:
+        return HttpResponseBadRequest('Invalid viewport: {}'.format(err))
+
+    # Fetch one more than the limit to tell whether the result was truncated
+    stations = get_station_readings(where, params, limit + 1,
+                                    readings=zoom >= READINGS_MIN_ZOOM)
+    geojson = station_readings_to_geojson(stations[:limit])
+    geojson['truncated'] = len(stations) > limit
+    return HttpResponse(json.dumps(geojson), content_type='application/geo+json')
+
+
+# Half the width of the web mercator world in metres
+MERCATOR_ORIGIN = 20037508.342789244
+# Coordinate extent of a vector tile, and the buffer kept around it
+TILE_EXTENT = 4096
+TILE_BUFFER = 64
+# Stations are clustered in tiles below READINGS_MIN_ZOOM, merging
+# stations within this many pixels of a 256 pixel tile
+CLUSTER_PIXELS = 24
+
+STATION_TILE_SQL = '''
+with bounds as (
+    select st_makeenvelope(%(minx)s, %(miny)s, %(maxx)s, %(maxy)s, 3857) as geom
+),
+points as (
+    select st_transform(s.point, 3857) as geom, s.station_ref, s.label,
+    s.typical_low, s.typical_high, sm.trend, sm.percent_typical
+    from stations_stations s
+    left join stations_stationsummary sm on sm.station_id = s.id
+    where s.point && st_transform(st_expand((select geom from bounds), %(buffer)s), 4326)
+),
+mvtgeom as (
+    select
+    st_asmvtgeom(st_centroid(st_collect(p.geom)), (select geom from bounds),
+                 {extent}, {tile_buffer}, true) as geom,
+    count(*) as count,
+    case when count(*) = 1 then min(p.station_ref) end as station_ref,
+    case when count(*) = 1 then min(p.label) end as label,
+    case when count(*) = 1 then min(p.typical_low) end as typical_low,
+    case when count(*) = 1 then min(p.typical_high) end as typical_high,
+    case when count(*) = 1 then min(p.trend) end as trend,
+    case when count(*) = 1 then min(p.percent_typical) end as percent_typical
+    from points p
+    group by {group_by}
+)
+select st_asmvt(mvtgeom, 'stations', {extent}, 'geom') from mvtgeom;
+'''
+
+
+def tile_bounds(z, x, y):
+    """Return the web mercator (minx, miny, maxx, maxy) of tile z/x/y."""
+    size = 2 * MERCATOR_ORIGIN / 2 ** z
+    minx = -MERCATOR_ORIGIN + x * size
+    maxy = MERCATOR_ORIGIN - y * size
+    return minx, maxy - size, minx + size, maxy
+
+
+def build_station_tile(z, x, y):
+    """Return vector tile z/x/y of the stations, clustered when zoomed out."""
+    minx, miny, maxx, maxy = tile_bounds(z, x, y)
+    size = maxx - minx
+    if z < READINGS_MIN_ZOOM:
+        group_by = 'st_snaptogrid(p.geom, {})'.format(size * CLUSTER_PIXELS / 256)
+    else:
+        group_by = 'p.station_ref'
+    sql = STATION_TILE_SQL.format(extent=TILE_EXTENT, tile_buffer=TILE_BUFFER, group_by=group_by)
+    params = {'minx': minx, 'miny': miny, 'maxx': maxx, 'maxy': maxy,
+              'buffer': size * TILE_BUFFER / TILE_EXTENT}
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        tile = cursor.fetchone()[0]
+    return bytes(tile or b'')
+
+
+def station_tile(request, z, x, y):
+    z, x, y = int(z), int(x), int(y)
+    if z > 22 or x >= 2 ** z or y >= 2 ** z:
+        raise Http404('No such tile')
+    return cached_data_response(request, 'tiles/{}/{}/{}.mvt'.format(z, x, y),
+                                lambda: build_station_tile(z, x, y),
+                                'application/vnd.mapbox-vector-tile')
+
+
+# Default and maximum number of points in a readings series
+SERIES_POINTS = 200
+MAX_SERIES_POINTS = 2000
+# Default period of a readings series
+SERIES_PERIOD = datetime.timedelta(days=7)
+
+
+def parse_request_datetime(value, default):
+    """Parse an ISO 8601 datetime or date query value, in UTC if naive."""
+    if not value:
+        return default
+    parsed = parse_datetime(value)
+    if parsed is None:
+        parsed_date = parse_date(value)
+        if parsed_date is None:
+            raise ValueError('Invalid datetime {}'.format(value))
+        parsed = datetime.datetime.combine(parsed_date, datetime.time())
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed
+
+
+def station_readings(request, station_ref):
+    """Return a station's readings as a downsampled JSON series.
+
+    Takes the `start` and `end` of the series as ISO 8601 datetimes,
+    defaulting to the last SERIES_PERIOD, and the number of `points` wanted.
+    Datetimes in the response are seconds since the epoch.
+    """
+    station = get_station(station_ref)
+    if station is None:
+        raise Http404('No such station')
+    try:
+        end = parse_request_datetime(request.GET.get('end'), timezone.now())
+        start = parse_request_datetime(request.GET.get('start'), end - SERIES_PERIOD)
+        points = int(request.GET.get('points', SERIES_POINTS))
+    except ValueError as err:
+        return HttpResponseBadRequest(str(err))
+    if start >= end or not 0 < points <= MAX_SERIES_POINTS:
+        return HttpResponseBadRequest('Invalid range or number of points')
+
+    series = get_station_series(station['id'], start, end, points)
+    series.update({
+        'station_ref': station['station_ref'],
+        'start': int(start.timestamp()),
+        'end': int(end.timestamp()),
+        'typical_low': station['typical_low'],
+        'typical_high': station['typical_high'],
+    })
+    return JsonResponse(series)
+
+
+@staff_member_required
+def profiling(request):
+    """Return the slowest requests recorded by
+    stations.middleware.ProfilingMiddleware, slowest first."""
+    slowest = slowest_requests()
+    if slowest is None:
+        raise Http404('Profiling is disabled')
+    return JsonResponse({'requests': slowest})
+
+
+def station_tiles_url():
+    """Return the URL of the station tiles with {z}, {x} and {y} in place of
+    the tile coordinates, as taken by OpenLayers."""
+    url = reverse('station_tile', kwargs={'z': 0, 'x': 0, 'y': 0})
+    # Only the coordinates at the end are replaced, whatever the prefix
+    return url[:-len('0/0/0.mvt')] + '{z}/{x}/{y}.mvt'
+
+
+@cache_control(public=True, max_age=3600)
+def index(request):
+    # Rendered lazily so that profiling can time the template
+    return TemplateResponse(request, 'index.html', {'tiles_url': station_tiles_url()})
@@ -0,0 +1,56 @@
+import os
+
+import django
+import pytest
+import redis
+
+from stations import geocache
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'test.settings')
+django.setup()
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+        self.down = False
+
+    def check(self):
+        if self.down:
+            raise redis.ConnectionError('down')
+
+    def get(self, key):
+        self.check()
+        return self.data.get(key)
+
+    def mget(self, *keys):
+        return [self.get(key) for key in keys]
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value if isinstance(value, bytes) else str(value).encode()
+
+    def incr(self, key):
+        self.set(key, int(self.data.get(key, 0)) + 1)
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.calls.append((name, args, kwargs))
+
+    def execute(self):
+        self.client.check()
+        for name, args, kwargs in self.calls:
+            getattr(self.client, name)(*args, **kwargs)
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    """Replace the Redis client of stations.geocache with a FakeRedis."""
+    client = FakeRedis()
+    monkeypatch.setattr(geocache, '_client', client)
+    return client
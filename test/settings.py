@@ -0,0 +1,13 @@
+"""Django settings for the tests, which run without a database or the
+GIS libraries. Set as the settings module by test/conftest.py."""
+
+SECRET_KEY = 'test'
+
+INSTALLED_APPS = [
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+]
+
+REDIS_URL = 'redis://localhost:6379/15'
+
+PROFILING = False
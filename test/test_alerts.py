@@ -0,0 +1,77 @@
+import contextlib
+from datetime import datetime, timedelta, timezone
+import io
+import json
+
+import pytest
+
+from stations import alerts
+
+
+T0 = datetime(2026, 10, 18, tzinfo=timezone.utc)
+
+
+def rule(pk, station_id, reading_min, reading_max, triggered=False):
+    return alerts.AlertRule(pk, station_id, reading_min, reading_max, triggered,
+                            1, 'user@example.com', 'E1', 'Station', 'above')
+
+def readings(*measures):
+    return [(T0 + timedelta(minutes=15 * i), m) for i, m in enumerate(measures)]
+
+def test_station_alerts_matching():
+    index = alerts.StationAlerts([rule(1, 1, 1.0, 2.0), rule(2, 1, None, 0.5),
+                                  rule(3, 1, 1.5, None)])
+    assert index.matching(0.2) == {2}
+    assert index.matching(1.0) == {1}
+    assert index.matching(1.7) == {1, 3}
+    assert index.matching(5.0) == {3}
+    assert index.matching(0.7) == set()
+
+def test_evaluate_fires_on_crossing_only():
+    notifications, changed = alerts.evaluate(
+        [rule(1, 1, 2.0, None)], {1: readings(1.0, 2.5, 3.0, 1.0, 2.2)})
+    assert [(n.alert_id, n.measure) for n in notifications] == [(1, 2.5), (1, 2.2)]
+    assert changed == {1: True}
+
+def test_evaluate_keeps_triggered_state():
+    notifications, changed = alerts.evaluate(
+        [rule(1, 1, 2.0, None, triggered=True), rule(2, 2, 2.0, None, triggered=True)],
+        {1: readings(2.5, 3.0), 2: readings(1.0)})
+    assert notifications == []
+    assert changed == {2: False}
+
+def test_console_sender():
+    notifications, _ = alerts.evaluate([rule(1, 1, 2.0, None)], {1: readings(2.5)})
+    stream = io.StringIO()
+    queue = alerts.NotificationQueue(alerts.ConsoleSender(stream))
+    queue.put(notifications)
+    assert queue.flush() == 1
+    assert stream.getvalue() == ('Alert 1 for user@example.com: Station (above) '
+                                 'is 2.5 at 2026-10-18 00:00 UTC\n')
+    assert queue.flush() == 0
+
+def test_file_sender(tmpdir):
+    path = str(tmpdir.join('alerts.jsonl'))
+    notifications, _ = alerts.evaluate([rule(1, 1, 2.0, None)], {1: readings(2.5)})
+    alerts.FileSender(path).send(notifications)
+    with open(path) as f:
+        item = json.loads(f.readline())
+    assert item['alert_id'] == 1
+    assert item['datetime'] == '2026-10-18T00:00:00+00:00'
+
+class FailingSender:
+    def send(self, notifications):
+        raise OSError('Mail server down')
+
+def test_run_alerts_saves_state_once_sent(monkeypatch):
+    stored = []
+    monkeypatch.setattr(alerts, 'load_rules', lambda station_ids: [rule(1, 1, 2.0, None)])
+    monkeypatch.setattr(alerts, 'store_triggered', stored.append)
+    monkeypatch.setattr(alerts.transaction, 'atomic', contextlib.nullcontext)
+    with pytest.raises(OSError):
+        alerts.run_alerts({1: readings(2.5)}, alerts.NotificationQueue(FailingSender()))
+    # Not marked triggered, so the alert fires again on the next run
+    assert stored == []
+    queue = alerts.NotificationQueue(alerts.ConsoleSender(io.StringIO()))
+    assert alerts.run_alerts({1: readings(2.6)}, queue) == 1
+    assert stored == [{1: True}]
@@ -0,0 +1,195 @@
+import asyncio
+import json
+import types
+
+import pytest
+import requests
+
+from stations import fetch, metrics
+from stations.httpcache import ResponseCache
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=None, headers=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(self.status_code)
+
+    def close(self):
+        pass
+
+    @property
+    def content(self):
+        return json.dumps(self.body).encode('utf-8')
+
+def fake_get(responses):
+    def get(url, headers=None, stream=False, timeout=None):
+        response = responses[url].pop(0)
+        if callable(response):
+            response = response(headers)
+        if isinstance(response, Exception):
+            raise response
+        return response
+    return get
+
+def test_threaded_engine_retries(monkeypatch):
+    engine = fetch.ThreadedEngine(retries=2, backoff=0)
+    responses = {'a': [FakeResponse(503), requests.ConnectionError(), FakeResponse(200, {'items': []})]}
+    monkeypatch.setattr(engine.session, 'get', fake_get(responses))
+    assert engine.get_json('a') == {'items': []}
+
+def test_threaded_engine_gives_up(monkeypatch):
+    engine = fetch.ThreadedEngine(retries=1, backoff=0)
+    responses = {'a': [FakeResponse(429), FakeResponse(429)]}
+    monkeypatch.setattr(engine.session, 'get', fake_get(responses))
+    with pytest.raises(fetch.FetchError):
+        engine.get_json('a')
+
+def test_threaded_engine_map_returns_errors(monkeypatch):
+    engine = fetch.ThreadedEngine(retries=0)
+    responses = {'a': [FakeResponse(200, 1)], 'b': [FakeResponse(404)]}
+    monkeypatch.setattr(engine.session, 'get', fake_get(responses))
+    results = engine.map_json(['a', 'b'])
+    assert results[0] == 1
+    assert isinstance(results[1], requests.HTTPError)
+
+def test_retry_delay_honours_retry_after():
+    assert fetch.ThreadedEngine().retry_delay(0, '7') == 7
+
+def test_retry_delay_caps_retry_after():
+    engine = fetch.ThreadedEngine(backoff=1)
+    assert engine.retry_delay(0, '3600') == fetch.MAX_RETRY_AFTER
+    assert engine.retry_delay(7, '3600') == 128
+
+def test_create_engine_raises():
+    with pytest.raises(fetch.FetchError):
+        fetch.create_engine('blah')
+
+def test_threaded_engine_revalidates_cache(monkeypatch, tmpdir):
+    engine = fetch.ThreadedEngine(cache=ResponseCache(str(tmpdir)))
+    def not_modified(headers):
+        assert headers == {'If-None-Match': '"v1"'}
+        return FakeResponse(304)
+    responses = {'a': [FakeResponse(200, {'items': [1]}, {'ETag': '"v1"'}), not_modified]}
+    monkeypatch.setattr(engine.session, 'get', fake_get(responses))
+    first = engine.get_json('a')
+    assert first == {'items': [1]}
+    # The 304 response is answered with the decoded JSON held in memory
+    assert engine.get_json('a') is first
+
+def test_threaded_engine_skips_cache(monkeypatch, tmpdir):
+    cache = ResponseCache(str(tmpdir))
+    engine = fetch.ThreadedEngine(cache=cache)
+    def unconditional(headers):
+        assert headers == {}
+        return FakeResponse(200, {'items': [1]}, {'ETag': '"v1"'})
+    responses = {'a': [unconditional, unconditional]}
+    monkeypatch.setattr(engine.session, 'get', fake_get(responses))
+    assert engine.map_json(['a'], cache=False) == [{'items': [1]}]
+    assert cache.get('a') is None
+    assert engine.get_json('a', cache=False) == {'items': [1]}
+
+def test_rate_limiter():
+    now = [0.0]
+    slept = []
+    def sleep(seconds):
+        slept.append(seconds)
+        now[0] += seconds
+    limiter = fetch.RateLimiter(10, clock=lambda: now[0], sleep=sleep)
+    limiter.wait(20)
+    limiter.wait(5)
+    assert slept == [2.0]
+    now[0] += 10
+    limiter.wait(1)
+    assert slept == [2.0]
+
+def test_threaded_engine_meters_each_request(monkeypatch):
+    slept = []
+    limiter = fetch.RateLimiter(10, clock=lambda: 0.0, sleep=slept.append)
+    engine = fetch.ThreadedEngine(retries=1, backoff=0, limiter=limiter)
+    responses = {'a': [FakeResponse(503), FakeResponse(200, 1)], 'b': [FakeResponse(200, 2)]}
+    monkeypatch.setattr(engine.session, 'get', fake_get(responses))
+    assert engine.map_json(['a', 'b']) == [1, 2]
+    # Requests, including the retry, are given turns a tenth of a second apart
+    assert sorted(slept) == [0.1, 0.2]
+
+def test_threaded_engine_records_metrics(monkeypatch):
+    recorded = metrics.Metrics()
+    monkeypatch.setattr(metrics, '_metrics', recorded)
+    engine = fetch.ThreadedEngine(retries=1, backoff=0)
+    url = 'http://ea/id/stations/E1/stageScale'
+    responses = {url: [FakeResponse(503), FakeResponse(200, {'items': []})]}
+    monkeypatch.setattr(engine.session, 'get', fake_get(responses))
+    engine.get_json(url)
+    stats = recorded.endpoints['/id/stations/{id}/stageScale']
+    assert (stats.requests, stats.errors, stats.bytes) == (2, 1, len(b'{"items": []}'))
+
+
+class FakeAsyncResponse:
+    def __init__(self, status, body=None, headers=None):
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise requests.HTTPError(self.status)
+
+    async def read(self):
+        return json.dumps(self.body).encode('utf-8')
+
+class FakeClientSession:
+    def __init__(self, responses):
+        self.responses = responses
+
+    def get(self, url, headers=None):
+        response = self.responses[url].pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    async def close(self):
+        pass
+
+@pytest.fixture
+def async_engine(monkeypatch):
+    fake_aiohttp = types.SimpleNamespace(ClientConnectionError=ConnectionError)
+    monkeypatch.setattr(fetch, 'aiohttp', fake_aiohttp)
+    def create(responses, **kwargs):
+        engine = fetch.AsyncioEngine(**kwargs)
+        engine.session = FakeClientSession(responses)
+        return engine
+    return create
+
+def test_asyncio_engine_retries(async_engine):
+    engine = async_engine({'a': [FakeAsyncResponse(503), ConnectionError(),
+                                 asyncio.TimeoutError(), FakeAsyncResponse(200, {'items': []})]},
+                          retries=3, backoff=0)
+    assert engine.get_json('a') == {'items': []}
+    engine.close()
+
+def test_asyncio_engine_gives_up(async_engine):
+    engine = async_engine({'a': [FakeAsyncResponse(429), FakeAsyncResponse(429)]},
+                          retries=1, backoff=0)
+    with pytest.raises(fetch.FetchError):
+        engine.get_json('a')
+    engine.close()
+
+def test_asyncio_engine_map_returns_errors(async_engine):
+    engine = async_engine({'a': [FakeAsyncResponse(200, 1)], 'b': [FakeAsyncResponse(404)],
+                           'c': [FakeAsyncResponse(200, 3)]}, retries=0)
+    results = engine.map_json(['a', 'b', 'c'])
+    assert results[0] == 1
+    assert isinstance(results[1], requests.HTTPError)
+    assert results[2] == 3
+    engine.close()
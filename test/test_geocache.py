@@ -0,0 +1,34 @@
+import gzip
+
+from stations import geocache
+
+
+def test_bump_version(fake_redis):
+    assert geocache.get_version() == (0, 0)
+    geocache.bump_version()
+    geocache.bump_version()
+    version, updated = geocache.get_version()
+    assert version == 2
+    assert updated > 0
+
+def test_cached_builds_once_per_version(fake_redis):
+    builds = []
+    def build():
+        builds.append(1)
+        return 'data {}'.format(len(builds)).encode()
+    assert geocache.cached('a', build) == b'data 1'
+    assert geocache.cached('a', build) == b'data 1'
+    # The gzip copy is cached alongside
+    assert gzip.decompress(geocache.cached('a', build, compressed=True)) == b'data 1'
+    assert fake_redis.data['riverscope:cache:0:a.gz'] == geocache.cached('a', build, True)
+    assert len(builds) == 1
+    geocache.bump_version()
+    assert geocache.cached('a', build) == b'data 2'
+    assert 'riverscope:cache:1:a' in fake_redis.data
+
+def test_cached_builds_without_redis(fake_redis):
+    fake_redis.down = True
+    assert geocache.cached('a', lambda: b'data') == b'data'
+    assert gzip.decompress(geocache.cached('a', lambda: b'data', compressed=True)) == b'data'
+    # Failing to invalidate is logged, not raised
+    geocache.bump_version()
@@ -0,0 +1,41 @@
+import os
+import time
+
+from stations.httpcache import ResponseCache, conditional_headers
+
+def test_cache_round_trip(tmpdir):
+    cache = ResponseCache(str(tmpdir))
+    cache.set('http://a', b'{"items": []}', {'ETag': '"x"', 'Last-Modified': 'Sun, 23 Apr 2017 21:00:00 GMT'})
+    cached = cache.get('http://a')
+    assert cached.body == b'{"items": []}'
+    assert conditional_headers(cached) == {
+        'If-None-Match': '"x"', 'If-Modified-Since': 'Sun, 23 Apr 2017 21:00:00 GMT'}
+
+def test_cache_skips_responses_without_validators(tmpdir):
+    cache = ResponseCache(str(tmpdir))
+    cache.set('http://a', b'{}', {})
+    assert cache.get('http://a') is None
+    assert conditional_headers(None) == {}
+
+def test_cache_evicts_least_recently_used(tmpdir):
+    cache = ResponseCache(str(tmpdir), max_size=450)
+    cache.set('http://a', b'a' * 100, {'ETag': 'a'})
+    cache.set('http://b', b'b' * 100, {'ETag': 'b'})
+    # Make a the oldest entry then use it, leaving b as least recently used
+    past = time.time() - 60
+    os.utime(cache._filename('http://a'), (past, past))
+    os.utime(cache._filename('http://b'), (past + 1, past + 1))
+    cache.get('http://a')
+    cache.set('http://c', b'c' * 100, {'ETag': 'c'})
+    assert cache.get('http://b') is None
+    assert cache.get('http://a') is not None
+    assert cache.get('http://c') is not None
+
+def test_cache_holds_decoded_responses(tmpdir):
+    cache = ResponseCache(str(tmpdir))
+    decoded = {'items': [1]}
+    cache.set('http://a', b'{"items": [1]}', {'ETag': '"x"'}, decoded)
+    assert cache.decoded('http://a', cache.get('http://a')) is decoded
+    # A changed validator is parsed from the body again
+    cache.set('http://a', b'{"items": [2]}', {'ETag': '"y"'})
+    assert cache.decoded('http://a', cache.get('http://a')) == {'items': [2]}
@@ -0,0 +1,23 @@
+from datetime import datetime, timezone
+import io
+
+from stations.loader import RowsFile
+
+
+ROWS = [(1, datetime(2026, 10, 18, tzinfo=timezone.utc), 0.25),
+        (2, '2026-10-18T00:15:00Z', 1.5)]
+EXPECTED = b'1\t2026-10-18 00:00:00+00:00\t0.25\n2\t2026-10-18T00:15:00Z\t1.5\n'
+
+def test_rows_file():
+    rows_file = RowsFile(iter(ROWS))
+    assert rows_file.read() == EXPECTED
+    assert rows_file.count == 2
+
+def test_rows_file_small_reads():
+    for size in (1, 5, 64):
+        reader = io.BufferedReader(RowsFile(ROWS), size)
+        chunks = iter(lambda: reader.read(size), b'')
+        assert b''.join(chunks) == EXPECTED
+
+def test_rows_file_empty():
+    assert RowsFile([]).read() == b''
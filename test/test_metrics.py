@@ -0,0 +1,78 @@
+import json
+
+from stations import metrics
+
+
+def test_endpoint_name_replaces_identifiers():
+    assert (metrics.endpoint_name('http://ea/flood-monitoring/id/measures/E1-level/readings?_sorted')
+            == '/flood-monitoring/id/measures/{id}/readings')
+    assert metrics.endpoint_name('http://ea/id/stations?parameter=level') == '/id/stations'
+    assert metrics.endpoint_name('http://ea/data/readings?latest') == '/data/readings'
+
+def test_record_request_histogram():
+    recorded = metrics.Metrics(buckets=(0.1, 1))
+    recorded.record_request('/a', 0.05)
+    recorded.record_request('/a', 0.5, error=True)
+    recorded.record_request('/a', 5)
+    recorded.record_bytes('/a', 100)
+    stats = recorded.endpoints['/a']
+    assert stats.buckets == [1, 1, 1]
+    assert (stats.requests, stats.errors, stats.bytes) == (3, 1, 100)
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+def test_stages_are_exclusive():
+    clock = FakeClock()
+    recorded = metrics.Metrics(clock=clock)
+    with recorded.stage('outer'):
+        clock.sleep(2)
+        with recorded.stage('inner'):
+            clock.sleep(5)
+        clock.sleep(1)
+    assert recorded.stages == {'outer': 3, 'inner': 5}
+
+def test_timed_iter_times_production():
+    clock = FakeClock()
+    recorded = metrics.Metrics(clock=clock)
+    def slow():
+        for i in range(3):
+            clock.sleep(1)
+            yield i
+    with recorded.stage('consume'):
+        for _ in recorded.timed_iter('produce', slow()):
+            clock.sleep(0.5)
+    assert recorded.stages == {'produce': 3, 'consume': 1.5}
+
+def test_prometheus_format():
+    recorded = metrics.Metrics(buckets=(0.1, 1))
+    recorded.record_request('/a', 0.5)
+    recorded.count('readings_written', 10)
+    text = recorded.prometheus({'command': 'getreadings'})
+    assert '# TYPE riverscope_http_request_duration_seconds histogram' in text
+    assert ('riverscope_http_request_duration_seconds_bucket'
+            '{command="getreadings",endpoint="/a",le="0.1"} 0') in text
+    assert ('riverscope_http_request_duration_seconds_bucket'
+            '{command="getreadings",endpoint="/a",le="+Inf"} 1') in text
+    assert 'riverscope_readings_written_total{command="getreadings"} 10' in text
+
+def test_write(tmp_path):
+    recorded = metrics.Metrics()
+    recorded.record_request('/a', 0.2)
+    with recorded.stage('parse'):
+        pass
+    recorded.write(str(tmp_path), 'getreadings', result={'inserted': 1})
+    summary = json.loads((tmp_path / 'getreadings.json').read_text())
+    assert summary['command'] == 'getreadings'
+    assert summary['result'] == {'inserted': 1}
+    assert summary['endpoints']['/a']['requests'] == 1
+    assert 'parse' in summary['stages']
+    assert (tmp_path / 'getreadings.prom').read_text().startswith('# HELP')
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['getreadings.json', 'getreadings.prom']
@@ -0,0 +1,48 @@
+import time
+
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpRequest, HttpResponse
+from django.test import override_settings
+import pytest
+
+from stations import middleware
+
+
+def request(path):
+    req = HttpRequest()
+    req.method = 'GET'
+    req.path = req.path_info = path
+    return req
+
+@pytest.fixture
+def profiling(monkeypatch):
+    monkeypatch.setattr(middleware, '_profiler', None)
+    with override_settings(PROFILING=True, PROFILING_SLOWEST=2):
+        yield
+
+@override_settings(PROFILING=False)
+def test_disabled_middleware_is_not_used():
+    with pytest.raises(MiddlewareNotUsed):
+        middleware.ProfilingMiddleware(lambda req: HttpResponse())
+    assert middleware.slowest_requests() is None
+
+def test_keeps_slowest_requests(profiling):
+    durations = {'/a': 0.03, '/b': 0.01, '/c': 0.02}
+    def get_response(req):
+        time.sleep(durations[req.path])
+        return HttpResponse(b'x' * 10)
+    profiler = middleware.ProfilingMiddleware(get_response)
+    for path in durations:
+        response = profiler(request(path))
+        assert 'Server-Timing' in response
+    slowest = middleware.slowest_requests()
+    assert [record['path'] for record in slowest] == ['/a', '/c']
+    assert slowest[0]['bytes'] == 10
+    assert slowest[0]['sql_count'] == 0
+
+def test_dumps_sampled_profiles(profiling, tmp_path):
+    with override_settings(PROFILING_SAMPLE_RATE=1, PROFILING_DIR=str(tmp_path)):
+        profiler = middleware.ProfilingMiddleware(lambda req: HttpResponse())
+    profiler(request('/api/stations.geojson'))
+    path = middleware.slowest_requests()[0]['profile']
+    assert path.startswith(str(tmp_path)) and path.endswith('GET-api_stations_geojson.prof')
@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta, timezone
+
+from stations import polling
+
+
+NOW = datetime(2026, 10, 18, 12, 0, tzinfo=timezone.utc)
+
+
+def test_plan_next_poll_due_after_interval():
+    last = NOW - timedelta(minutes=3)
+    assert polling.plan_next_poll(NOW, 900, last, 0) == last + timedelta(seconds=900 + polling.PUBLISH_DELAY)
+
+def test_plan_next_poll_rising_waits_for_reading():
+    last = NOW - timedelta(minutes=3)
+    assert polling.plan_next_poll(NOW, 3600, last, 0, rising=True) == \
+        last + timedelta(seconds=3600 + polling.PUBLISH_DELAY)
+
+def test_plan_next_poll_rising_retries_sooner():
+    delay = polling.plan_next_poll(NOW, 900, NOW, 1, rising=True) - NOW
+    assert delay == timedelta(seconds=polling.RETRY_DELAY / polling.RISING_SPEEDUP)
+
+def test_plan_next_poll_not_before_min_interval():
+    last = NOW - timedelta(hours=2)
+    assert polling.plan_next_poll(NOW, 900, last, 0) == NOW + timedelta(seconds=polling.MIN_INTERVAL)
+
+def test_plan_next_poll_backs_off_misses():
+    delays = [polling.plan_next_poll(NOW, 900, NOW, misses) - NOW for misses in range(1, 10)]
+    assert delays[:3] == [timedelta(minutes=5), timedelta(minutes=10), timedelta(minutes=20)]
+    assert delays[-1] == timedelta(seconds=polling.MAX_BACKOFF)
+
+def test_clamp_interval():
+    assert polling.clamp_interval(10) == polling.MIN_INTERVAL
+    assert polling.clamp_interval(900.0) == 900.0
+    assert polling.clamp_interval(10 ** 6) == polling.MAX_INTERVAL
+
+def test_poll_state_early_poll_is_not_a_miss():
+    last = NOW - timedelta(minutes=5)
+    assert polling.poll_state(NOW, 900, last, 0, updated=False) == \
+        (0, polling.reading_due(900, last))
+    misses, _ = polling.poll_state(NOW, 900, last - timedelta(hours=1), 0, updated=False)
+    assert misses == 1
+
+def test_poll_state_rising_station_over_cycles():
+    # Readings every 15 minutes, published a minute after they are taken
+    def newest_reading(now):
+        published = (now - NOW - timedelta(minutes=1)) // timedelta(minutes=15)
+        return NOW + published * timedelta(minutes=15)
+    last, misses, now = NOW, 0, NOW + timedelta(minutes=1)
+    for _ in range(8):
+        misses, now = polling.poll_state(now, 900, last, misses, newest_reading(now) > last,
+                                         rising=True)
+        assert misses == 0
+        # Each poll finds the next reading
+        assert newest_reading(now) == last + timedelta(minutes=15)
+        last = newest_reading(now)
@@ -0,0 +1,35 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from stations import records
+
+
+def test_parse_datetime():
+    for text in ('1970-01-01T00:00:00Z', '2017-04-23T21:15:00Z', '2024-02-29T23:59:59Z'):
+        expected = datetime.strptime(text, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc)
+        assert records.parse_datetime(text) == expected.timestamp()
+
+@pytest.mark.parametrize('text', ['2017-04-23', '2017-04-23T21:15:00', '2017-04-23 21:15:00Z',
+                                  '2017-02-30T00:00:00Z', '2017-04-23T2x:15:00Z'])
+def test_parse_datetime_invalid(text):
+    with pytest.raises(ValueError):
+        records.parse_datetime(text)
+
+def test_reading_batch():
+    batch = records.ReadingBatch()
+    skipped = batch.extend(7, [
+        {'dateTime': '2017-04-23T21:15:00Z', 'value': 0.25},
+        {'dateTime': '2017-04-23T21:30:00Z', 'value': [0.3, 0.4]},
+        {'value': 0.3},
+        {'dateTime': '2017-04-23T21:45:00Z', 'value': '0.5'},
+    ])
+    assert skipped == 2
+    assert len(batch) == 2
+    assert list(batch.rows()) == [(7, 1492982100, 0.25), (7, 1492983900, 0.5)]
+
+def test_reading_batch_first_epochs():
+    batch = records.ReadingBatch()
+    for station_id, epoch in ((1, 300), (2, 200), (1, 100), (1, 200)):
+        batch.append(station_id, epoch, 0.5)
+    assert batch.first_epochs() == {1: 100, 2: 200}
@@ -0,0 +1,50 @@
+from stations.scheduler import Job, Scheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def test_scheduler_runs_due_jobs():
+    clock = FakeClock()
+    ran = []
+    fast = Job('fast', 60, lambda: ran.append('fast'))
+    slow = Job('slow', 3600, lambda: ran.append('slow'))
+    scheduler = Scheduler([fast, slow], clock=clock)
+    assert scheduler.run_pending() == 2
+    assert ran == ['fast', 'slow']
+    clock.now += 30
+    assert scheduler.run_pending() == 0
+    clock.now += 45
+    assert scheduler.run_pending() == 1
+    assert fast.last_lag == 15
+    assert fast.next_run == 1120
+    assert fast.runs == 2 and slow.runs == 1
+
+def test_scheduler_skips_missed_runs():
+    clock = FakeClock()
+    def work():
+        clock.now += 200
+    job = Job('work', 60, work)
+    scheduler = Scheduler([job], clock=clock)
+    scheduler.run_pending()
+    assert job.last_duration == 200
+    assert job.next_run == 1260
+
+def test_scheduler_records_failures():
+    def fail():
+        raise ValueError('boom')
+    job = Job('fail', 60, fail)
+    scheduler = Scheduler([job], clock=FakeClock())
+    scheduler.run_pending()
+    assert job.failures == 1
+    assert job.status()['last_error'] == 'boom'
+
+def test_scheduler_stop():
+    scheduler = Scheduler([Job('a', 60, lambda: None)], clock=FakeClock())
+    scheduler.stop()
+    assert scheduler.run_pending() == 0
+    scheduler.run_forever()
@@ -0,0 +1,46 @@
+from datetime import datetime, timedelta, timezone
+import math
+
+from stations import series
+
+
+class FakeCursor:
+    def __init__(self, executed):
+        self.executed = executed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def execute(self, sql, params):
+        self.executed.append((sql, params))
+
+    def fetchall(self):
+        return []
+
+class FakeConnection:
+    def __init__(self):
+        self.executed = []
+
+    def cursor(self):
+        return FakeCursor(self.executed)
+
+def test_series_buckets_start_at_range_start(monkeypatch):
+    connection = FakeConnection()
+    monkeypatch.setattr(series, 'connection', connection)
+    # Not a multiple of the bucket, so epoch aligned buckets would need 201
+    start = datetime(2026, 10, 11, 0, 0, 7, tzinfo=timezone.utc)
+    end = start + timedelta(days=7)
+    result = series.get_station_series(1, start, end, 200)
+    sql, params = connection.executed[0]
+    bucket = result['bucket_seconds']
+    assert start.timestamp() % bucket
+    assert '- %(start_epoch)s) / %(bucket)s' in sql
+    assert params['start_epoch'] == start.timestamp()
+    # The buckets that readings each minute over the range fall in
+    buckets = {math.floor((epoch - params['start_epoch']) / bucket)
+               for epoch in range(int(start.timestamp()), int(end.timestamp()), 60)}
+    assert len(buckets) <= 200
+    assert min(buckets) == 0
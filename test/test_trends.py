@@ -0,0 +1,32 @@
+import numpy as np
+
+from stations import trends
+
+def test_compute_trends():
+    station_ids = np.array([1, 1, 1, 2, 2, 3, 4, 4])
+    epochs = np.array([0, 3600, 7200, 0, 3600, 0, 0, 3600], dtype=np.float64)
+    measures = np.array([1.0, 1.5, 2.0, 3.0, 2.0, 5.0, 0.4, 0.4])
+    result = trends.compute_trends(station_ids, epochs, measures,
+                                   typical_ranges={1: (0.0, 4.0), 2: (None, 3.0), 4: (0.4, 0.4)})
+    assert result['station_ids'].tolist() == [1, 2, 3, 4]
+    np.testing.assert_allclose(result['rate'][[0, 1, 3]], [0.5, -1.0, 0.0])
+    assert np.isnan(result['rate'][2])
+    np.testing.assert_allclose(result['window_mean'], [1.5, 2.5, 5.0, 0.4])
+    np.testing.assert_allclose(result['rolling_mean'], [1.5, 2.5, 5.0, 0.4])
+    assert result['latest'].tolist() == [2.0, 2.0, 5.0, 0.4]
+    assert result['percent_typical'][0] == 50
+    assert np.isnan(result['percent_typical'][1:]).all()
+    assert result['trend'].tolist() == [trends.RISING, trends.FALLING, None, trends.STEADY]
+
+def test_compute_trends_empty():
+    empty = np.array([])
+    result = trends.compute_trends(empty.astype(np.int64), empty, empty)
+    assert len(result['station_ids']) == 0
+
+def test_rolling_mean():
+    station_ids = np.array([1, 1, 1, 1, 1, 2, 2, 3])
+    measures = np.array([1.0, 2.0, 3.0, 4.0, 5.0, 10.0, 20.0, 7.0])
+    # Windows never reach back into the readings of the previous station
+    np.testing.assert_allclose(trends.rolling_mean(station_ids, measures, readings=3),
+                               [1.0, 1.5, 2.0, 3.0, 4.0, 10.0, 15.0, 7.0])
+    assert len(trends.rolling_mean(np.array([], dtype=np.int64), np.array([]))) == 0
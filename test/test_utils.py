@@ -1,6 +1,8 @@
 import pytest
 import datetime
+import json
 
+from bench.fake_ea import FakeEA, FakeEAServer
 from stations.management.commands import utils
 
 def test_stations_url_tokenising():
@@ -39,15 +41,38 @@ def test_stations_url_raises():
     with pytest.raises(utils.ParameterError):
         utils.stations_url(status='blah')
 
-def test_get_river_stations_something():
+@pytest.fixture(scope='module')
+def fake_ea_server():
+    # A fixed time, so readings do not move on between requests
+    now = datetime.datetime(2026, 10, 18, 12, 7, tzinfo=datetime.timezone.utc).timestamp()
+    with FakeEAServer(FakeEA(stations=20, clock=lambda: now)) as server:
+        yield server
+
+@pytest.fixture
+def fake_ea(fake_ea_server, monkeypatch):
+    monkeypatch.setattr(utils, 'EA_API_ROOT', fake_ea_server.url)
+    return fake_ea_server.api
+
+def test_get_river_stations_something(fake_ea):
     stns = list(utils.get_river_stations(station_ref='E8360'))
     label = stns[0].label
     assert label == 'Uckfield Mill upstream'
 
-def test_get_river_stations_nothing():
+def test_get_river_stations_nothing(fake_ea):
     stns = list(utils.get_river_stations(station_ref='E8360', search='blah'))
     assert stns == []
 
+def test_get_river_stations_stream(fake_ea):
+    stns = list(utils.get_river_stations(stream=True, limit=10000))
+    assert len(stns) == 20
+    assert stns[1].measure == 'F00001-level-stage-i-15_min-mASD'
+
+def test_get_paged_readings(fake_ea):
+    items = list(utils.get_paged_items(utils.readings_url, page_size=7, stream=True,
+                                       latest=True, parameter='level'))
+    assert len(items) == 20
+    assert len({item['measure'] for item in items}) == 20
+
 def test_readings_url_tokenising():
     url = utils.readings_url(latest=True, today=True,
         date=datetime.date(2015, 5, 18), since=datetime.date(2015, 5, 18),
@@ -58,4 +83,55 @@ def test_readings_url_tokenising():
         'blah/readings?latest&today&date=2015-05-18&startdate=2015-05-18&'
         'enddate=2015-05-29&since=2015-05-18&parameter=level&qualifier=Stage'
         '&_limit=10&_sorted')
-    assert url == exp_url
\ No newline at end of file
+    assert url == exp_url
+
+def test_readings_url_since_datetime():
+    since = datetime.datetime(2017, 4, 23, 21, 15, tzinfo=datetime.timezone.utc)
+    url = utils.readings_url(since=since, measure='E8360-level-stage-i-15_min-m')
+    exp_url = ('https://environment.data.gov.uk/flood-monitoring/id/measures/'
+        'E8360-level-stage-i-15_min-m/readings?since=2017-04-23T21:15:00Z')
+    assert url == exp_url
+
+def test_readings_url_offset():
+    url = utils.readings_url(latest=True, parameter='level', limit=100, offset=200)
+    exp_url = ('https://environment.data.gov.uk/flood-monitoring/data/readings?'
+        'latest&parameter=level&_limit=100&_offset=200')
+    assert url == exp_url
+
+def test_get_paged_items(monkeypatch):
+    pages = {0: [1, 2], 2: [3, 4], 4: [5]}
+    monkeypatch.setattr(utils, 'get_url_json_response', lambda url: {'items': pages[url]})
+    items = list(utils.get_paged_items(lambda limit, offset: offset, page_size=2))
+    assert items == [1, 2, 3, 4, 5]
+
+def test_iter_json_items_across_chunks():
+    body = json.dumps({
+        '@context': 'http://environment.data.gov.uk/flood-monitoring/meta/context.jsonld',
+        'meta': {'limit': 10, 'items': 'not these'},
+        'count': 12345,
+        'items': [{'notation': 'E8360', 'label': 'Uckfield Mill – upstream'}, 1.25, [], 100]
+    }).encode('utf-8')
+    for size in (1, 2, 7, len(body)):
+        chunks = (body[i:i + size] for i in range(0, len(body), size))
+        items = list(utils.iter_json_items(chunks))
+        assert items == [{'notation': 'E8360', 'label': 'Uckfield Mill – upstream'}, 1.25, [], 100]
+
+def test_iter_json_items_missing_key():
+    assert list(utils.iter_json_items([b'{"meta": {}}'])) == []
+
+def test_iter_json_items_truncated():
+    with pytest.raises(ValueError):
+        list(utils.iter_json_items([b'{"items": [1, 2']))
+
+def test_chunked():
+    assert list(utils.chunked(range(5), 2)) == [[0, 1], [2, 3], [4]]
+
+def test_get_readings_since(fake_ea):
+    measure = 'E8360-level-stage-i-15_min-mASD'
+    latest = utils.get_url_json_response(
+        utils.readings_url(measure=measure, sort=True, limit=3))['items']
+    assert len(latest) == 3
+    assert latest[0]['dateTime'] > latest[1]['dateTime'] > latest[2]['dateTime']
+    since = datetime.datetime.strptime(latest[2]['dateTime'], '%Y-%m-%dT%H:%M:%SZ')
+    newer = utils.get_url_json_response(utils.readings_url(measure=measure, since=since))['items']
+    assert [item['dateTime'] for item in newer] == [latest[1]['dateTime'], latest[0]['dateTime']]
@@ -0,0 +1,135 @@
+import gzip
+import json
+
+from django.test import RequestFactory
+import pytest
+
+from stations import views
+
+
+STATION = {'station_ref': 'E1', 'label': 'Bridge', 'town': 'Town', 'river_name': 'River',
+           'rloiid': 1, 'url': 'http://ea/id/stations/E1', 'typical_low': 0.2,
+           'typical_high': 1.8, 'lon': -1.5, 'lat': 52.5, 'measure_epoch': 1792108800,
+           'measure_offsets': [900], 'measures': [0.5, 0.6]}
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.description = [(name,) for name in connection.columns]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def execute(self, sql, params):
+        self.connection.executed.append((sql, params))
+
+    def fetchall(self):
+        return self.connection.rows
+
+class FakeConnection:
+    def __init__(self, stations):
+        self.columns = list(STATION)
+        self.rows = [[station[column] for column in self.columns] for station in stations]
+        self.executed = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    connection = FakeConnection([STATION])
+    monkeypatch.setattr(views, 'connection', connection)
+    return connection
+
+def test_stations_geojson(fake_redis, fake_db):
+    response = views.stations_geojson(RequestFactory().get('/api/stations.geojson'))
+    assert response.status_code == 200
+    assert response['Content-Type'] == 'application/geo+json'
+    assert response['ETag'] == '"stations.geojson-0-0"'
+    assert 'no-cache' in response['Cache-Control']
+    assert response['Vary'] == 'Accept-Encoding'
+    feature, = json.loads(response.content.decode('utf-8'))['features']
+    assert feature['geometry']['coordinates'] == [-1.5, 52.5]
+    assert feature['properties'] == STATION
+
+def test_stations_geojson_not_modified(fake_redis, fake_db):
+    etag = views.stations_geojson(RequestFactory().get('/api/stations.geojson'))['ETag']
+    response = views.stations_geojson(RequestFactory().get(
+        '/api/stations.geojson', HTTP_IF_NONE_MATCH=etag))
+    assert response.status_code == 304
+    assert response['ETag'] == etag
+    # The ETag changes with the next ingestion
+    fake_redis.incr('riverscope:version')
+    response = views.stations_geojson(RequestFactory().get(
+        '/api/stations.geojson', HTTP_IF_NONE_MATCH=etag))
+    assert response.status_code == 200
+    assert len(fake_db.executed) == 2
+
+def test_stations_geojson_gzip(fake_redis, fake_db):
+    plain = views.stations_geojson(RequestFactory().get('/api/stations.geojson'))
+    response = views.stations_geojson(RequestFactory().get(
+        '/api/stations.geojson', HTTP_ACCEPT_ENCODING='gzip, deflate'))
+    assert response['Content-Encoding'] == 'gzip'
+    assert response['ETag'] == '"stations.geojson-0-0-gz"'
+    assert gzip.decompress(response.content) == plain.content
+    # Both copies are cached from a single build
+    assert len(fake_db.executed) == 1
+
+def test_stations_geojson_without_redis(fake_redis, fake_db):
+    fake_redis.down = True
+    response = views.stations_geojson(RequestFactory().get('/api/stations.geojson'))
+    assert response.status_code == 200
+    assert not response.has_header('ETag')
+    assert json.loads(response.content.decode('utf-8'))['features']
+
+def within(**params):
+    return views.stations_within(RequestFactory().get('/api/stations/within', params))
+
+def test_stations_within_bbox(fake_db):
+    response = within(bbox='0,52,-2,51', zoom=10)
+    assert response.status_code == 200
+    sql, params = fake_db.executed[0]
+    assert 'st_makeenvelope' in sql and 'sm.measures' in sql
+    # Corners given in either order are sorted, one more station than the
+    # limit is asked for to tell whether the result is truncated
+    assert params == [-2, 51, 0, 52, views.MAX_FEATURES + 1]
+    geojson = json.loads(response.content.decode('utf-8'))
+    assert len(geojson['features']) == 1
+    assert geojson['truncated'] is False
+
+def test_stations_within_radius(fake_db):
+    response = within(lon='-1.5', lat='52.5', radius='10', zoom=6)
+    assert response.status_code == 200
+    sql, params = fake_db.executed[0]
+    assert 'st_distancesphere' in sql and 'sm.measures' not in sql
+    minlon, minlat, maxlon, maxlat, lon, lat, metres = params[:7]
+    assert minlon < lon < maxlon and minlat < lat < maxlat
+    assert maxlat - minlat == pytest.approx(2 * 10 / views.KM_PER_DEGREE)
+    assert metres == 10000
+
+@pytest.mark.parametrize('params', [
+    {'bbox': '-2,51,0'}, {'bbox': '-2,51,0,nan'}, {'bbox': 'a,b,c,d'},
+    {'lon': '-1.5', 'lat': '52.5'}, {'lon': '-1.5', 'lat': '52.5', 'radius': '-1'},
+    {'lon': 'inf', 'lat': '52.5', 'radius': '1'}, {'bbox': '-2,51,0,52', 'limit': 'x'},
+])
+def test_stations_within_invalid(fake_db, params):
+    assert within(**params).status_code == 400
+    assert not fake_db.executed
+
+def test_stations_within_limit(monkeypatch, fake_db):
+    monkeypatch.setattr(views, 'MAX_FEATURES', 2)
+    fake_db.rows = fake_db.rows * 3
+    geojson = json.loads(within(bbox='-2,51,0,52', limit=10).content.decode('utf-8'))
+    assert fake_db.executed[0][1][-1] == 3
+    assert len(geojson['features']) == 2
+    assert geojson['truncated'] is True
+
+def test_station_tiles_url(monkeypatch):
+    # Digits elsewhere in the URL are left alone
+    monkeypatch.setattr(views, 'reverse', lambda name, kwargs: '/river1000/tiles/{z}/{x}/{y}.mvt'
+                        .format(**kwargs))
+    assert views.station_tiles_url() == '/river1000/tiles/{z}/{x}/{y}.mvt'